@@ -1,42 +1,23 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc, case
+from sqlalchemy import func, desc, case, insert
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 from ..auth import require_admin
 from ..client_info import get_client_ip, parse_user_agent
-from ..geoip import get_location
+from ..enrichment import resolve_hostname, schedule_enrichment
+from ..live import LIVE_WINDOW, concurrent_viewers, is_live_media, record_heartbeat
 from ..database import get_db
-from ..models import Analytics, Listener, Media, BandwidthStats
-from pydantic import BaseModel
-from typing import Optional
+from ..models import Analytics, Listener, Media, BandwidthStats, PlaybackQoE
+from pydantic import BaseModel, Field, model_validator
+from typing import List, Optional
 from datetime import datetime, timedelta, timezone
-import functools
-import socket
+import asyncio
 
 router = APIRouter()
 
-# Cap DNS lookups: gethostbyaddr blocks the FastAPI worker, and many client
-# IPs have no reverse record (we'd otherwise wait the OS default ~5s).
-socket.setdefaulttimeout(0.5)
-
-
-@functools.lru_cache(maxsize=1024)
-def get_hostname(ip: str) -> str:
-    """Try to resolve IP to hostname, return IP if fails.
-
-    Cached per-process to avoid repeating the same blocking lookup on every
-    analytics overview request.
-    """
-    if not ip or ip == "unknown":
-        return "unknown"
-    try:
-        return socket.gethostbyaddr(ip)[0]
-    except (socket.herror, socket.gaierror, socket.timeout, OSError):
-        return ip
-
 class AnalyticsEvent(BaseModel):
     media_id: str
-    event_type: str  # play, pause, complete, seek, error
+    event_type: str  # play, pause, complete, seek, error, heartbeat
     session_id: Optional[str] = None
     listener_id: Optional[str] = None  # persistent client UUID from localStorage
     data: Optional[dict] = None
@@ -47,13 +28,24 @@ async def track_event(
     request: Request,
     db: Session = Depends(get_db)
 ):
+    listener_id = (event.listener_id or "").strip()[:64] or None
+    ip = get_client_ip(request)
+
+    # Heartbeats only feed the live-viewer counters in Redis; they never
+    # touch Postgres per request (the session from get_db is never used, so
+    # no connection is checked out; media ids come from live's cached set).
+    if event.event_type == "heartbeat":
+        if not await is_live_media(event.media_id):
+            raise HTTPException(status_code=404, detail="Media not found")
+        viewer_id = listener_id or event.session_id or ip or "unknown"
+        await record_heartbeat(event.media_id, viewer_id[:64])
+        return {"message": "Heartbeat recorded"}
+
     # Verify media exists
-    media = db.query(Media).filter(Media.id == event.media_id).first()
+    media = db.query(Media).filter(Media.id == event.media_id, Media.deleted_at.is_(None)).first()
     if not media:
         raise HTTPException(status_code=404, detail="Media not found")
 
-    listener_id = (event.listener_id or "").strip()[:64] or None
-    ip = get_client_ip(request)
     user_agent = request.headers.get("user-agent")
     device, browser, os_name = parse_user_agent(user_agent)
 
@@ -70,6 +62,7 @@ async def track_event(
     )
     db.add(analytics)
 
+    enrich = False
     if listener_id:
         play_inc = 1 if event.event_type == "play" else 0
         stmt = pg_insert(Listener).values(
@@ -93,17 +86,206 @@ async def track_event(
                 "total_events": Listener.total_events + 1,
                 "total_plays": Listener.total_plays + play_inc,
             },
-        )
-        db.execute(stmt)
+        ).returning(Listener.geo_ip.is_distinct_from(Listener.ip_address))
+        # New listener or a changed IP: resolve its location once, off the request
+        enrich = db.execute(stmt).scalar()
 
     db.commit()
+    if enrich:
+        schedule_enrichment(listener_id, ip)
 
     return {"message": "Event tracked successfully"}
 
+QOE_MAX_BATCH = 500
+
+
+class QoEBatch(BaseModel):
+    """Column-oriented batch of player QoE reports.
+
+    Each list holds one entry per report, so a batch of N reports costs one
+    key per field instead of N JSON objects, and maps straight onto a
+    single multi-row INSERT into typed columns.
+    """
+    listener_id: Optional[str] = None
+    media_id: List[str] = Field(max_length=QOE_MAX_BATCH)
+    session_id: List[Optional[str]]
+    variant: List[Optional[str]]
+    startup_ms: List[Optional[int]]
+    played_ms: List[int]
+    rebuffer_ms: List[int]
+    rebuffer_count: List[int]
+    switch_count: List[int]
+
+    @model_validator(mode="after")
+    def _columns_aligned(self):
+        n = len(self.media_id)
+        for name in ("session_id", "variant", "startup_ms", "played_ms",
+                     "rebuffer_ms", "rebuffer_count", "switch_count"):
+            if len(getattr(self, name)) != n:
+                raise ValueError(f"column {name} has {len(getattr(self, name))} values, expected {n}")
+        return self
+
+
+@router.post("/analytics/qoe")
+async def track_qoe(batch: QoEBatch, db: Session = Depends(get_db)):
+    if not batch.media_id:
+        return {"accepted": 0}
+
+    # Drop reports for media deleted since playback started
+    known = {
+        media_id for (media_id,) in
+        db.query(Media.id).filter(Media.id.in_(set(batch.media_id)), Media.deleted_at.is_(None)).all()
+    }
+    listener_id = (batch.listener_id or "").strip()[:64] or None
+
+    def clamp(value):
+        # A backgrounded tab can report absurd spans; cap at one day
+        return min(max(value, 0), 86_400_000) if value is not None else None
+
+    def clamp_count(value):
+        # Keeps buggy or hostile counts inside the INTEGER columns
+        return min(max(value, 0), 100_000)
+
+    rows = [
+        {
+            "media_id": media_id,
+            "session_id": (batch.session_id[i] or "")[:64] or None,
+            "listener_id": listener_id,
+            "variant": (batch.variant[i] or "")[:16] or None,
+            "startup_ms": clamp(batch.startup_ms[i]),
+            "played_ms": clamp(batch.played_ms[i]),
+            "rebuffer_ms": clamp(batch.rebuffer_ms[i]),
+            "rebuffer_count": clamp_count(batch.rebuffer_count[i]),
+            "switch_count": clamp_count(batch.switch_count[i]),
+        }
+        for i, media_id in enumerate(batch.media_id)
+        if media_id in known
+    ]
+    if rows:
+        db.execute(insert(PlaybackQoE), rows)
+        db.commit()
+
+    return {"accepted": len(rows)}
+
+
+def _qoe_rollup(db: Session, since: datetime, group_by=None, media_id: Optional[str] = None, limit: int = 50):
+    """p50/p95 startup, rebuffer ratio and switch rate, optionally grouped."""
+    total_ms = func.sum(PlaybackQoE.played_ms) + func.sum(PlaybackQoE.rebuffer_ms)
+    columns = [
+        func.count(func.distinct(PlaybackQoE.session_id)).label("sessions"),
+        func.percentile_cont(0.5).within_group(PlaybackQoE.startup_ms).label("startup_p50"),
+        func.percentile_cont(0.95).within_group(PlaybackQoE.startup_ms).label("startup_p95"),
+        (func.sum(PlaybackQoE.rebuffer_ms) * 1.0 / func.nullif(total_ms, 0)).label("rebuffer_ratio"),
+        func.sum(PlaybackQoE.rebuffer_count).label("rebuffers"),
+        func.sum(PlaybackQoE.switch_count).label("switches"),
+        func.sum(PlaybackQoE.played_ms).label("played_ms"),
+    ]
+    if group_by is not None:
+        columns.insert(0, group_by.label("key"))
+
+    query = db.query(*columns).filter(PlaybackQoE.timestamp >= since)
+    if media_id:
+        query = query.filter(PlaybackQoE.media_id == media_id)
+    if group_by is not None:
+        query = query.group_by(group_by).order_by(desc("sessions")).limit(limit)
+
+    def as_dict(r):
+        hours = (r.played_ms or 0) / 3_600_000
+        return {
+            "sessions": r.sessions,
+            "startup_p50_ms": round(r.startup_p50) if r.startup_p50 is not None else None,
+            "startup_p95_ms": round(r.startup_p95) if r.startup_p95 is not None else None,
+            "rebuffer_ratio": round(float(r.rebuffer_ratio), 4) if r.rebuffer_ratio is not None else 0.0,
+            "rebuffers_per_hour": round((r.rebuffers or 0) / hours, 2) if hours else 0.0,
+            "switches_per_session": round((r.switches or 0) / r.sessions, 2) if r.sessions else 0.0,
+            "played_hours": round(hours, 2),
+        }
+
+    if group_by is None:
+        return as_dict(query.one())
+    return [{"key": r.key, **as_dict(r)} for r in query.all()]
+
+
+@router.get("/analytics/qoe", dependencies=[Depends(require_admin)])
+async def get_qoe_summary(
+    days: int = Query(7, ge=1, le=365),
+    media_id: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Playback QoE rollups: overall, per media and per HLS variant.
+
+    With media_id, the overall and per-variant figures cover that media
+    only - the view used to tune its ladder.
+    """
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+
+    by_media_rows = [] if media_id else _qoe_rollup(db, since, group_by=PlaybackQoE.media_id)
+    media_by_id = {}
+    if by_media_rows:
+        media_by_id = {
+            m.id: m for m in db.query(Media).filter(
+                Media.id.in_([r["key"] for r in by_media_rows]), Media.deleted_at.is_(None)
+            ).all()
+        }
+
+    by_media = []
+    for row in by_media_rows:
+        media = media_by_id.get(row.pop("key"))
+        if media:
+            by_media.append({"media_id": media.id, "filename": media.original_filename, **row})
+
+    by_variant = [
+        {"variant": row.pop("key") or "unknown", **row}
+        for row in _qoe_rollup(db, since, group_by=PlaybackQoE.variant, media_id=media_id)
+    ]
+
+    return {
+        "period_days": days,
+        "media_id": media_id,
+        "overall": _qoe_rollup(db, since, media_id=media_id),
+        "by_media": by_media,
+        "by_variant": by_variant,
+    }
+
+@router.get("/analytics/live", dependencies=[Depends(require_admin)])
+async def get_live_viewers(
+    media_id: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Concurrent viewers right now, per media, from heartbeat counters."""
+    counts = await concurrent_viewers(media_id)
+
+    media_by_id = {}
+    if counts:
+        media_by_id = {
+            m.id: m for m in db.query(Media).filter(Media.id.in_(list(counts)), Media.deleted_at.is_(None)).all()
+        }
+
+    items = sorted(
+        (
+            {
+                "media_id": mid,
+                "filename": media_by_id[mid].original_filename,
+                "media_type": media_by_id[mid].media_type.value,
+                "viewers": viewers,
+            }
+            for mid, viewers in counts.items()
+            if mid in media_by_id
+        ),
+        key=lambda item: item["viewers"],
+        reverse=True,
+    )
+
+    return {
+        "window_seconds": LIVE_WINDOW,
+        "total": sum(item["viewers"] for item in items),
+        "media": items,
+    }
+
 @router.get("/analytics/media/{media_id}", dependencies=[Depends(require_admin)])
 async def get_media_analytics(media_id: str, db: Session = Depends(get_db)):
     # Verify media exists
-    media = db.query(Media).filter(Media.id == media_id).first()
+    media = db.query(Media).filter(Media.id == media_id, Media.deleted_at.is_(None)).first()
     if not media:
         raise HTTPException(status_code=404, detail="Media not found")
 
@@ -165,29 +347,32 @@ async def get_analytics_overview(
         func.sum(BandwidthStats.total_bytes).desc()
     ).limit(10).all()
 
-    # Convert to list with hostnames
+    # Convert to list with hostnames (resolved concurrently, cached per process)
+    hostnames = await asyncio.gather(*(resolve_hostname(ip) for ip, _, _ in bandwidth_by_ip_raw))
     bandwidth_by_ip_list = [
         {
             "ip": ip,
-            "hostname": get_hostname(ip),
+            "hostname": hostname or ip or "unknown",
             "bandwidth_bytes": int(total_bytes),
             "requests": int(request_count)
         }
-        for ip, total_bytes, request_count in bandwidth_by_ip_raw
+        for (ip, total_bytes, request_count), hostname in zip(bandwidth_by_ip_raw, hostnames)
     ]
 
-    # Top media by plays
+    # Top media by plays; deleted media keep their analytics rows but drop
+    # out of the rankings
     top_media = db.query(
         Analytics.media_id,
         func.count(Analytics.id).label("play_count")
-    ).filter(
+    ).join(Media, Media.id == Analytics.media_id).filter(
         Analytics.event_type == "play",
-        Analytics.timestamp >= since
+        Analytics.timestamp >= since,
+        Media.deleted_at.is_(None),
     ).group_by(Analytics.media_id).order_by(desc("play_count")).limit(10).all()
 
     top_media_details = []
     for tm in top_media:
-        media = db.query(Media).filter(Media.id == tm.media_id).first()
+        media = db.query(Media).filter(Media.id == tm.media_id, Media.deleted_at.is_(None)).first()
         if media:
             top_media_details.append({
                 "media_id": tm.media_id,
@@ -320,9 +505,10 @@ async def get_analytics_dashboard(
         func.count(Analytics.id).filter(Analytics.event_type == "complete").label("completions"),
         func.count(func.distinct(Analytics.listener_id)).filter(Analytics.event_type == "play").label("listeners"),
         func.max(Analytics.timestamp).filter(Analytics.event_type == "play").label("last_played"),
-    ).filter(
+    ).join(Media, Media.id == Analytics.media_id).filter(
         Analytics.timestamp >= cur_start,
         Analytics.event_type.in_(["play", "complete"]),
+        Media.deleted_at.is_(None),
     ).group_by(Analytics.media_id).having(
         func.count(Analytics.id).filter(Analytics.event_type == "play") > 0
     ).order_by(desc("plays")).limit(10).all()
@@ -333,7 +519,9 @@ async def get_analytics_dashboard(
     if top_rows:
         media_by_id = {
             m.id: m
-            for m in db.query(Media).filter(Media.id.in_([r.media_id for r in top_rows])).all()
+            for m in db.query(Media).filter(
+                Media.id.in_([r.media_id for r in top_rows]), Media.deleted_at.is_(None)
+            ).all()
         }
 
     top_media = []
@@ -367,12 +555,23 @@ async def list_listeners(
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=100),
     days: Optional[int] = Query(None, ge=1),
+    country: Optional[str] = Query(None, max_length=2),
+    region: Optional[str] = None,
+    city: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     query = db.query(Listener)
     if days:
         since = datetime.utcnow() - timedelta(days=days)
         query = query.filter(Listener.last_seen >= since)
+    # Location columns are filled in the background (app.enrichment);
+    # ix_listeners_geo serves these filters
+    if country:
+        query = query.filter(Listener.country == country.upper())
+    if region:
+        query = query.filter(Listener.region == region)
+    if city:
+        query = query.filter(Listener.city == city)
 
     total = query.count()
     listeners = query.order_by(desc(Listener.last_seen)).offset(skip).limit(limit).all()
@@ -390,14 +589,13 @@ async def list_listeners(
 
     items = []
     for l in listeners:
-        city, region, country = get_location(l.ip_address)
         items.append({
             "listener_id": l.id,
             "ip_address": l.ip_address,
-            "hostname": get_hostname(l.ip_address) if l.ip_address else None,
-            "city": city,
-            "region": region,
-            "country": country,
+            "hostname": l.hostname or l.ip_address,
+            "city": l.city,
+            "region": l.region,
+            "country": l.country,
             "device": l.device,
             "browser": l.browser,
             "os": l.os,
@@ -434,22 +632,20 @@ async def get_listener_detail(listener_id: str, db: Session = Depends(get_db)):
     media_by_id = {}
     if media_ids:
         media_by_id = {
-            m.id: m for m in db.query(Media).filter(Media.id.in_(media_ids)).all()
+            m.id: m for m in db.query(Media).filter(Media.id.in_(media_ids), Media.deleted_at.is_(None)).all()
         }
 
     recent_events = db.query(Analytics).filter(
         Analytics.listener_id == listener_id
     ).order_by(desc(Analytics.timestamp)).limit(100).all()
 
-    city, region, country = get_location(listener.ip_address)
-
     return {
         "listener_id": listener.id,
         "ip_address": listener.ip_address,
-        "hostname": get_hostname(listener.ip_address) if listener.ip_address else None,
-        "city": city,
-        "region": region,
-        "country": country,
+        "hostname": listener.hostname or listener.ip_address,
+        "city": listener.city,
+        "region": listener.region,
+        "country": listener.country,
         "device": listener.device,
         "browser": listener.browser,
         "os": listener.os,
@@ -1,6 +1,7 @@
 from datetime import datetime, timezone
 
 from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
 
@@ -9,6 +10,7 @@ from ..auth import (
     COOKIE_SECURE,
     TOKEN_TTL,
     create_token,
+    forget_admin,
     hash_password,
     require_admin,
     verify_password,
@@ -44,7 +46,8 @@ def _set_session_cookie(response: Response, user: AdminUser):
 @router.post("/auth/login")
 async def login(request: LoginRequest, response: Response, db: Session = Depends(get_db)):
     user = db.query(AdminUser).filter(AdminUser.username == request.username).first()
-    if not user or not verify_password(request.password, user.password_hash):
+    # bcrypt takes ~250 ms; keep it off the event loop
+    if not user or not await run_in_threadpool(verify_password, request.password, user.password_hash):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     _set_session_cookie(response, user)
     return {"username": user.username}
@@ -57,23 +60,27 @@ async def logout(response: Response):
 
 
 @router.get("/auth/me")
-async def me(admin: AdminUser = Depends(require_admin)):
-    return {"username": admin.username}
+async def me(username: str = Depends(require_admin)):
+    return {"username": username}
 
 
 @router.post("/auth/change-password")
 async def change_password(
     request: ChangePasswordRequest,
     response: Response,
-    admin: AdminUser = Depends(require_admin),
+    username: str = Depends(require_admin),
     db: Session = Depends(get_db),
 ):
-    if not verify_password(request.current_password, admin.password_hash):
+    admin = db.query(AdminUser).filter(AdminUser.username == username).first()
+    if not admin:
+        raise HTTPException(status_code=401, detail="Session revoked")
+    if not await run_in_threadpool(verify_password, request.current_password, admin.password_hash):
         raise HTTPException(status_code=403, detail="Current password is incorrect")
-    admin.password_hash = hash_password(request.new_password)
+    admin.password_hash = await run_in_threadpool(hash_password, request.new_password)
     admin.password_changed_at = datetime.now(timezone.utc)
     db.commit()
     db.refresh(admin)
+    forget_admin(username)
     # re-issue with the new pwd_ts so this session survives its own change
     _set_session_cookie(response, admin)
     return {"message": "Password updated"}
@@ -1,20 +1,24 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, Body, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session, selectinload
 from sqlalchemy import desc, func
 from ..auth import require_admin
 from ..database import get_db
-from ..models import Media, MediaStatus, MediaType, MediaVariant, Analytics
+from ..models import Media, MediaStatus, MediaType, MediaVariant, Analytics, ProcessingRun
+from ..storage import get_storage
+from ..worker.hls import STARTUP_BUNDLE, variant_first_segments
 from typing import Optional, List
 from pydantic import BaseModel
 import os
-import shutil
 from pathlib import Path
-from PIL import Image
 import io
+import json
 from datetime import datetime, timezone
 
 router = APIRouter()
 
+MEDIA_ROOT = os.getenv("MEDIA_ROOT", "/media")
+
 
 def versioned_thumbnail(media: Media) -> Optional[str]:
     """Append a cache-version to the thumbnail URL so browsers can cache it
@@ -51,7 +55,7 @@ async def list_media(
     status: Optional[MediaStatus] = None,
     db: Session = Depends(get_db)
 ):
-    query = db.query(Media).options(selectinload(Media.tags))
+    query = db.query(Media).options(selectinload(Media.tags)).filter(Media.deleted_at.is_(None))
 
     if media_type:
         query = query.filter(Media.media_type == media_type)
@@ -96,12 +100,11 @@ async def list_media(
         ]
     }
 
-@router.get("/media/{media_id}")
-async def get_media(media_id: str, db: Session = Depends(get_db)):
-    media = db.query(Media).filter(Media.id == media_id).first()
-    if not media:
-        raise HTTPException(status_code=404, detail="Media not found")
 
+MAX_BATCH_IDS = 100
+
+
+def media_detail(media: Media) -> dict:
     return {
         "id": media.id,
         "filename": media.original_filename,
@@ -130,6 +133,134 @@ async def get_media(media_id: str, db: Session = Depends(get_db)):
         "tags": [{"id": t.id, "name": t.name} for t in media.tags]
     }
 
+
+def first_segments(media: Media) -> List[list]:
+    """[url, Range header or None] of each rendition's first segment, as
+    stored by the worker (see variant_first_segments)."""
+    return (media.playback or {}).get("first_segments") or []
+
+
+def read_startup_bundle(media: Media) -> Optional[dict]:
+    """The startup bundle file the worker wrote; a storage read."""
+    bundle = get_storage().read_text(Path(MEDIA_ROOT) / "hls" / media.id / STARTUP_BUNDLE)
+    try:
+        return json.loads(bundle) if bundle else None
+    except ValueError:
+        return None
+
+
+def fill_playback(media_list: List[Media], db: Session):
+    """Cache playback info on rows processed before the worker stored it
+    (Media.playback) - once per item. Blocking storage reads: run it in
+    the threadpool."""
+    for media in media_list:
+        media.playback = {
+            "startup": read_startup_bundle(media),
+            "first_segments": variant_first_segments(media.variants, MEDIA_ROOT, get_storage().read_text),
+        }
+    db.commit()
+
+
+def needs_playback(media: Media) -> bool:
+    return media.status == MediaStatus.READY and "first_segments" not in (media.playback or {})
+
+
+def startup_bundle(media: Media) -> Optional[dict]:
+    """Master playlist, starting playlists and first segments written by the
+    worker alongside the master playlist; None until the media is ready."""
+    if media.status != MediaStatus.READY:
+        return None
+    return (media.playback or {}).get("startup")
+
+
+@router.get("/media/batch")
+async def get_media_batch(
+    ids: str = Query(..., description="Comma-separated media IDs"),
+    include_playback: bool = False,
+    db: Session = Depends(get_db)
+):
+    """Detail records for many media in a fixed number of queries (media,
+    variants, tags), in the order requested. Declared before
+    /media/{media_id} so "batch" is not taken as an ID."""
+    requested = list(dict.fromkeys(i.strip() for i in ids.split(",") if i.strip()))
+    if not requested:
+        raise HTTPException(status_code=400, detail="No media IDs given")
+    if len(requested) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_IDS} IDs per request")
+
+    found = {
+        m.id: m
+        for m in db.query(Media).options(
+            selectinload(Media.variants), selectinload(Media.tags)
+        ).filter(Media.id.in_(requested), Media.deleted_at.is_(None)).all()
+    }
+    stale = [m for m in found.values() if needs_playback(m)] if include_playback else []
+    if stale:
+        await run_in_threadpool(fill_playback, stale, db)
+
+    items = []
+    for media_id in requested:
+        media = found.get(media_id)
+        if not media:
+            continue
+        item = media_detail(media)
+        if include_playback and media.status == MediaStatus.READY:
+            item["master_playlist"] = f"/media/hls/{media.id}/master.m3u8"
+            segments = first_segments(media)
+            item["first_segments"] = [url for url, _ in segments]
+            item["first_segment_ranges"] = [byte_range for _, byte_range in segments]
+            item["startup"] = startup_bundle(media)
+        items.append(item)
+
+    return {
+        "items": items,
+        "missing": [media_id for media_id in requested if media_id not in found],
+    }
+
+
+@router.get("/media/{media_id}")
+async def get_media(media_id: str, db: Session = Depends(get_db)):
+    media = db.query(Media).filter(Media.id == media_id, Media.deleted_at.is_(None)).first()
+    if not media:
+        raise HTTPException(status_code=404, detail="Media not found")
+
+    if needs_playback(media):
+        await run_in_threadpool(fill_playback, [media], db)
+    detail = media_detail(media)
+    detail["startup"] = startup_bundle(media)
+    return detail
+
+@router.get("/media/{media_id}/processing-runs", dependencies=[Depends(require_admin)])
+async def get_processing_runs(media_id: str, db: Session = Depends(get_db)):
+    """Timing history of every processing attempt for a media item."""
+    runs = db.query(ProcessingRun).join(Media, Media.id == ProcessingRun.media_id).filter(
+        ProcessingRun.media_id == media_id, Media.deleted_at.is_(None)
+    ).order_by(desc(ProcessingRun.started_at)).all()
+
+    return [
+        {
+            "id": r.id,
+            "status": r.status,
+            "worker": r.worker,
+            "queued_at": r.queued_at.isoformat() if r.queued_at else None,
+            "started_at": r.started_at.isoformat() if r.started_at else None,
+            "finished_at": r.finished_at.isoformat() if r.finished_at else None,
+            "queue_wait_seconds": r.queue_wait_seconds,
+            "processing_seconds": r.processing_seconds,
+            "media_duration": r.media_duration,
+            "realtime_factor": r.realtime_factor,
+            "output_bytes": r.output_bytes,
+            "stages": r.stages or [],
+        }
+        for r in runs
+    ]
+
+def fetch_original(storage, media_id: str) -> Optional[str]:
+    for file in storage.list(Path(MEDIA_ROOT) / "original", f"{media_id}."):
+        if storage.load(file):
+            return str(file)
+    return None
+
 class RenameRequest(BaseModel):
     filename: str
 
@@ -144,25 +275,24 @@ async def set_thumbnail(
 ):
     from ..worker.tasks import generate_thumbnail_at_timestamp
 
-    media = db.query(Media).filter(Media.id == media_id).first()
+    media = db.query(Media).filter(Media.id == media_id, Media.deleted_at.is_(None)).first()
     if not media:
         raise HTTPException(status_code=404, detail="Media not found")
 
-    # Find original file
-    media_root = os.getenv("MEDIA_ROOT", "/media")
-    original_dir = Path(media_root) / "original"
-
-    original_file = None
-    for file in original_dir.glob(f"{media_id}.*"):
-        original_file = str(file)
-        break
+    # Find original file, fetching it from storage if needed (possibly a
+    # multi-GB download: off the event loop, like the ffmpeg run below)
+    storage = get_storage()
+    original_file = await run_in_threadpool(fetch_original, storage, media_id)
 
-    if not original_file or not os.path.exists(original_file):
+    if not original_file:
         raise HTTPException(status_code=404, detail="Original file not found")
 
     # Generate thumbnail at specific timestamp
     try:
-        thumbnail_path = generate_thumbnail_at_timestamp(original_file, media_id, request.timestamp)
+        thumbnail_path = await run_in_threadpool(
+            generate_thumbnail_at_timestamp, original_file, media_id, request.timestamp
+        )
+        await run_in_threadpool(storage.release, original_file)
         if thumbnail_path:
             media.thumbnail_path = thumbnail_path
             # Touch updated_at so the versioned URL changes even though the
@@ -190,7 +320,9 @@ async def upload_thumbnail(
     db: Session = Depends(get_db)
 ):
     """Upload a custom thumbnail image for any media type (video or audio)."""
-    media = db.query(Media).filter(Media.id == media_id).first()
+    from PIL import Image
+
+    media = db.query(Media).filter(Media.id == media_id, Media.deleted_at.is_(None)).first()
     if not media:
         raise HTTPException(status_code=404, detail="Media not found")
 
@@ -236,6 +368,7 @@ async def upload_thumbnail(
 
         thumbnail_path = thumbnail_dir / f"{media_id}.jpg"
         img.save(thumbnail_path, "JPEG", quality=82, optimize=True, progressive=True)
+        await run_in_threadpool(get_storage().save, thumbnail_path)
 
         # Update database (touch updated_at so the versioned URL changes)
         media.thumbnail_path = f"/media/thumbnails/{media_id}.jpg"
@@ -260,7 +393,7 @@ async def rename_media(
     request: RenameRequest,
     db: Session = Depends(get_db)
 ):
-    media = db.query(Media).filter(Media.id == media_id).first()
+    media = db.query(Media).filter(Media.id == media_id, Media.deleted_at.is_(None)).first()
     if not media:
         raise HTTPException(status_code=404, detail="Media not found")
 
@@ -274,55 +407,33 @@ async def delete_media(
     media_id: str,
     db: Session = Depends(get_db)
 ):
-    media = db.query(Media).filter(Media.id == media_id).first()
+    media = db.query(Media).filter(Media.id == media_id, Media.deleted_at.is_(None)).first()
     if not media:
         raise HTTPException(status_code=404, detail="Media not found")
 
-    # Delete files from disk
-    media_root = os.getenv("MEDIA_ROOT", "/media")
-
-    # Delete original file (stored as /media/original/{media_id}{extension})
-    original_dir = Path(media_root) / "original"
-    for original_file in original_dir.glob(f"{media_id}.*"):
-        try:
-            os.remove(original_file)
-        except Exception as e:
-            print(f"Error deleting original file: {e}")
-
-    # Delete HLS directory
-    hls_dir = Path(media_root) / "hls" / media_id
-    if hls_dir.exists():
-        try:
-            shutil.rmtree(hls_dir)
-        except Exception as e:
-            print(f"Error deleting HLS directory: {e}")
-
-    # Delete thumbnail
-    if media.thumbnail_path:
-        thumbnail_full_path = Path(media_root) / media.thumbnail_path.lstrip("/media/")
-        if thumbnail_full_path.exists():
-            try:
-                os.remove(thumbnail_full_path)
-            except Exception as e:
-                print(f"Error deleting thumbnail: {e}")
-
-    # Delete from database
-    db.delete(media)
+    # Hidden from now on; files and the row are removed in the background
+    # (large HLS trees take seconds), and collect_deleted_media retries
+    # anything a crashed purge left behind
+    media.deleted_at = datetime.now(timezone.utc)
     db.commit()
+    from ..celery_app import celery_app  # imported on first use: ~0.15s of worker cold start
+
+    celery_app.send_task("app.worker.tasks.purge_media", args=(media_id,))
 
     return {"message": "Media deleted successfully"}
 
 @router.get("/media/stats/overview", dependencies=[Depends(require_admin)])
 async def get_stats_overview(db: Session = Depends(get_db)):
-    total_media = db.query(func.count(Media.id)).scalar()
-    total_videos = db.query(func.count(Media.id)).filter(Media.media_type == MediaType.VIDEO).scalar()
-    total_audio = db.query(func.count(Media.id)).filter(Media.media_type == MediaType.AUDIO).scalar()
-    processing = db.query(func.count(Media.id)).filter(Media.status == MediaStatus.PROCESSING).scalar()
-    ready = db.query(func.count(Media.id)).filter(Media.status == MediaStatus.READY).scalar()
-    failed = db.query(func.count(Media.id)).filter(Media.status == MediaStatus.FAILED).scalar()
-
-    total_size = db.query(func.sum(Media.file_size)).scalar() or 0
-    total_duration = db.query(func.sum(Media.duration)).scalar() or 0
+    live = Media.deleted_at.is_(None)
+    total_media = db.query(func.count(Media.id)).filter(live).scalar()
+    total_videos = db.query(func.count(Media.id)).filter(live, Media.media_type == MediaType.VIDEO).scalar()
+    total_audio = db.query(func.count(Media.id)).filter(live, Media.media_type == MediaType.AUDIO).scalar()
+    processing = db.query(func.count(Media.id)).filter(live, Media.status == MediaStatus.PROCESSING).scalar()
+    ready = db.query(func.count(Media.id)).filter(live, Media.status == MediaStatus.READY).scalar()
+    failed = db.query(func.count(Media.id)).filter(live, Media.status == MediaStatus.FAILED).scalar()
+
+    total_size = db.query(func.sum(Media.file_size)).filter(live).scalar() or 0
+    total_duration = db.query(func.sum(Media.duration)).filter(live).scalar() or 0
 
     return {
         "total_media": total_media,
@@ -68,7 +68,7 @@ async def add_tag_to_media(
 ):
     """Add a tag to media, creating the tag if it doesn't exist"""
     # Check if media exists
-    media = db.query(Media).filter(Media.id == media_id).first()
+    media = db.query(Media).filter(Media.id == media_id, Media.deleted_at.is_(None)).first()
     if not media:
         raise HTTPException(status_code=404, detail="Media not found")
 
@@ -94,7 +94,7 @@ async def remove_tag_from_media(
 ):
     """Remove a tag from media"""
     # Check if media exists
-    media = db.query(Media).filter(Media.id == media_id).first()
+    media = db.query(Media).filter(Media.id == media_id, Media.deleted_at.is_(None)).first()
     if not media:
         raise HTTPException(status_code=404, detail="Media not found")
 
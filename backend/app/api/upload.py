@@ -1,12 +1,19 @@
 from fastapi import APIRouter, UploadFile, File, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from ..database import get_db
-from ..models import Media, MediaType, MediaStatus
-from ..worker.tasks import process_media
+from ..models import Media, MediaType, MediaStatus, MediaVariant
+from ..storage import get_storage
+from ..worker.hls import STARTUP_BUNDLE
+import hashlib
+import json
+import logging
 import os
 import aiofiles
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 MEDIA_ROOT = os.getenv("MEDIA_ROOT", "/media")
@@ -23,6 +30,70 @@ def get_media_type(filename: str) -> MediaType:
     else:
         raise ValueError(f"Unsupported file type: {ext}")
 
+def link_duplicate(source: Media, media: Media, original_path: Path, db: Session) -> bool:
+    """
+    Give media the renditions of an already processed, identical upload.
+
+    The source's HLS tree, original and thumbnail are copied under the new
+    id (players derive URLs from the id) - hard links on local storage,
+    server-side copies on object storage - so no bytes pass through the
+    API and deleting either item later leaves the other intact. Returns
+    False, with nothing changed, if copying isn't possible (e.g. the
+    source files are gone). Blocking storage calls: run it in the
+    threadpool.
+    """
+    storage = get_storage()
+    media_root = Path(MEDIA_ROOT)
+    source_hls = media_root / "hls" / source.id
+    target_hls = media_root / "hls" / media.id
+    source_original = next(iter(storage.list(media_root / "original", f"{source.id}.")), None)
+    if source_original is None:
+        return False
+
+    thumbnail_path = source.thumbnail_path
+    try:
+        storage.copy(source_hls, target_hls)
+        # Swap the fresh upload for a copy of the source's original
+        storage.copy(source_original, original_path)
+        if thumbnail_path == f"/media/thumbnails/{source.id}.jpg":
+            storage.copy(media_root / "thumbnails" / f"{source.id}.jpg", media_root / "thumbnails" / f"{media.id}.jpg")
+            thumbnail_path = f"/media/thumbnails/{media.id}.jpg"
+        # The startup bundle lists URLs; replace (never edit: it may be a
+        # hard link) the copy with one pointing at the new id
+        bundle = storage.read_text(target_hls / STARTUP_BUNDLE)
+        if bundle:
+            bundle_path = target_hls / STARTUP_BUNDLE
+            bundle_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = bundle_path.with_name(STARTUP_BUNDLE + ".tmp")
+            tmp_path.write_text(bundle.replace(f"/hls/{source.id}/", f"/hls/{media.id}/"))
+            os.replace(tmp_path, bundle_path)
+            storage.save(bundle_path)
+    except Exception as e:
+        logger.warning("Could not copy %s to duplicate %s: %s", source.id, media.id, e)
+        storage.delete(target_hls)
+        return False
+
+    for field in ("duration", "width", "height", "codec", "bitrate"):
+        setattr(media, field, getattr(source, field))
+    media.thumbnail_path = thumbnail_path
+    if source.playback is not None:
+        media.playback = json.loads(
+            json.dumps(source.playback).replace(f"/hls/{source.id}/", f"/hls/{media.id}/")
+        )
+    for variant in source.variants:
+        db.add(MediaVariant(
+            media_id=media.id,
+            quality=variant.quality,
+            path=variant.path.replace(f"/hls/{source.id}/", f"/hls/{media.id}/"),
+            bitrate=variant.bitrate,
+            file_size=variant.file_size,
+            width=variant.width,
+            height=variant.height,
+        ))
+    media.status = MediaStatus.READY
+    db.commit()
+    return True
+
 @router.post("/upload")
 async def upload_file(
     file: UploadFile = File(...),
@@ -53,11 +124,13 @@ async def upload_file(
     original_path = original_dir / f"{media.id}{file_extension}"
 
     try:
-        # Save file in chunks
+        # Save file in chunks, hashing as we go for dedup
         file_size = 0
+        sha256 = hashlib.sha256()
         async with aiofiles.open(original_path, 'wb') as f:
             while chunk := await file.read(1024 * 1024):  # 1MB chunks
                 file_size += len(chunk)
+                sha256.update(chunk)
                 if file_size > MAX_FILE_SIZE:
                     await f.close()
                     original_path.unlink()
@@ -68,11 +141,42 @@ async def upload_file(
 
         # Update media record
         media.file_size = file_size
+        media.content_hash = sha256.hexdigest()
+
+        # Same bytes already transcoded: reuse those renditions
+        duplicate = db.query(Media).filter(
+            Media.content_hash == media.content_hash,
+            Media.media_type == media.media_type,
+            Media.status == MediaStatus.READY,
+            Media.deleted_at.is_(None),
+            Media.id != media.id,
+        ).order_by(Media.created_at).first()
+        storage = get_storage()
+        if duplicate and await run_in_threadpool(link_duplicate, duplicate, media, original_path, db):
+            await run_in_threadpool(storage.release, original_path)
+            return {
+                "id": media.id,
+                "filename": media.original_filename,
+                "status": media.status,
+                "duplicate_of": duplicate.id,
+                "message": "Identical file already processed, reusing its renditions"
+            }
+
+        # Workers read it from storage; this node's copy is only scratch
+        # when that is an object store. Up to MAX_FILE_SIZE of upload to
+        # it: off the event loop
+        await run_in_threadpool(storage.save, original_path)
+        await run_in_threadpool(storage.release, original_path)
+
         media.status = MediaStatus.PROCESSING
         db.commit()
 
-        # Queue processing task
-        process_media.delay(media.id, str(original_path))
+        # Probe on the interactive queue; it routes the transcode by cost.
+        # Sent by name so the API never imports the worker (ffmpeg, PIL, ...);
+        # Celery itself is imported on first use: ~0.15s of worker cold start
+        from ..celery_app import celery_app
+
+        celery_app.send_task("app.worker.tasks.probe_media", args=(media.id, str(original_path)))
 
         return {
             "id": media.id,
@@ -83,15 +187,14 @@ async def upload_file(
 
     except Exception as e:
         # Clean up on error
-        if original_path.exists():
-            original_path.unlink()
+        await run_in_threadpool(get_storage().delete, original_path)
         db.delete(media)
         db.commit()
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
 @router.get("/upload/status/{media_id}")
 async def get_upload_status(media_id: str, db: Session = Depends(get_db)):
-    media = db.query(Media).filter(Media.id == media_id).first()
+    media = db.query(Media).filter(Media.id == media_id, Media.deleted_at.is_(None)).first()
     if not media:
         raise HTTPException(status_code=404, detail="Media not found")
 
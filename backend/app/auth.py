@@ -1,12 +1,15 @@
 import os
+import threading
+import time
 from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
 
 import bcrypt
 from fastapi import Depends, HTTPException, Request
 from jose import JWTError, jwt
 from sqlalchemy.orm import Session
 
-from .database import get_db
+from .database import SessionLocal, get_db
 from .models import AdminUser
 
 JWT_SECRET = os.getenv("JWT_SECRET", "onplay-dev-insecure-secret")
@@ -14,6 +17,15 @@ JWT_ALGORITHM = "HS256"
 TOKEN_TTL = timedelta(days=7)
 COOKIE_NAME = "onplay_admin"
 COOKIE_SECURE = os.getenv("COOKIE_SECURE", "false").lower() == "true"
+# How long a process trusts its cached pwd_ts for an admin. Bounds how long
+# a token revoked by a password change made through another API process
+# keeps working; the process handling the change forgets it at once.
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "30"))
+
+# username -> (pwd_ts, monotonic expiry); None pwd_ts caches "no such user"
+_pwd_ts_cache: Dict[str, Tuple[Optional[int], float]] = {}
+_pwd_ts_lock = threading.Lock()
+_MISS = object()
 
 
 def hash_password(password: str) -> str:
@@ -38,19 +50,65 @@ def create_token(user: AdminUser) -> str:
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
 
-def require_admin(request: Request, db: Session = Depends(get_db)) -> AdminUser:
-    token = request.cookies.get(COOKIE_NAME)
+def _lookup_pwd_ts(db: Session, username: str) -> Optional[int]:
+    user = db.query(AdminUser).filter(AdminUser.username == username).first()
+    pwd_ts = _password_ts(user) if user else None
+    with _pwd_ts_lock:
+        _pwd_ts_cache[username] = (pwd_ts, time.monotonic() + AUTH_CACHE_TTL)
+    return pwd_ts
+
+
+def _cached_pwd_ts(username: str):
+    with _pwd_ts_lock:
+        entry = _pwd_ts_cache.get(username)
+    if entry and entry[1] > time.monotonic():
+        return entry[0]
+    return _MISS
+
+
+def forget_admin(username: str):
+    """Drop the cached pwd_ts, e.g. after a password change."""
+    with _pwd_ts_lock:
+        _pwd_ts_cache.pop(username, None)
+
+
+def authenticate(token: Optional[str], db: Session) -> str:
+    """Username for a session cookie value; 401 if it isn't a live admin
+    session. The AdminUser row is only read when this process has no fresh
+    cached pwd_ts for it."""
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid or expired session")
-    user = db.query(AdminUser).filter(AdminUser.username == payload.get("sub")).first()
+    username = payload.get("sub")
+    pwd_ts = _cached_pwd_ts(username)
+    if pwd_ts is _MISS or pwd_ts != payload.get("pwd_ts"):
+        # A mismatch may just be a token from a password change made
+        # through another process, newer than this cache
+        pwd_ts = _lookup_pwd_ts(db, username)
     # pwd_ts mismatch revokes tokens issued before the last password change
-    if not user or payload.get("pwd_ts") != _password_ts(user):
+    if pwd_ts is None or payload.get("pwd_ts") != pwd_ts:
         raise HTTPException(status_code=401, detail="Session revoked")
-    return user
+    return username
+
+
+def require_admin(request: Request, db: Session = Depends(get_db)) -> str:
+    """Username of the signed-in admin."""
+    return authenticate(request.cookies.get(COOKIE_NAME), db)
+
+
+def websocket_admin(websocket) -> Optional[str]:
+    """require_admin for a WebSocket handshake; None when not signed in.
+    Blocking on a cache miss - call it from a thread."""
+    db = SessionLocal()
+    try:
+        return authenticate(websocket.cookies.get(COOKIE_NAME), db)
+    except HTTPException:
+        return None
+    finally:
+        db.close()
 
 
 def seed_admin(session_factory):
@@ -1,8 +1,18 @@
 from celery import Celery
+from celery.signals import before_task_publish, worker_init, worker_process_shutdown
+from kombu import Queue
 import os
+import time
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 
+# Workers subscribe to a subset of these (celery worker -Q ...), which is
+# how per-queue concurrency is set: see docker-compose.yml.
+QUEUE_INTERACTIVE = "interactive"          # seconds-long, user is waiting (probe, routing)
+QUEUE_TRANSCODE_LIGHT = "transcode-light"  # audio and short videos
+QUEUE_TRANSCODE_HEAVY = "transcode-heavy"  # long videos
+QUEUE_MAINTENANCE = "maintenance"          # periodic housekeeping
+
 celery_app = Celery(
     "media_worker",
     broker=REDIS_URL,
@@ -20,6 +30,41 @@ celery_app.conf.update(
     task_time_limit=3600,  # 1 hour max per task
     worker_prefetch_multiplier=1,
     worker_max_tasks_per_child=50,
+    task_queues=[
+        Queue(QUEUE_INTERACTIVE),
+        Queue(QUEUE_TRANSCODE_LIGHT),
+        Queue(QUEUE_TRANSCODE_HEAVY),
+        Queue(QUEUE_MAINTENANCE),
+    ],
+    task_default_queue=QUEUE_INTERACTIVE,
+    # process_media is routed per call by probe_media (see transcode_route);
+    # this is the fallback for direct callers.
+    task_routes={
+        "app.worker.tasks.probe_media": {"queue": QUEUE_INTERACTIVE},
+        "app.worker.tasks.process_media": {"queue": QUEUE_TRANSCODE_HEAVY},
+        # Chunks only exist for long sources; stitching them is quick
+        "app.worker.tasks.encode_chunk": {"queue": QUEUE_TRANSCODE_HEAVY},
+        "app.worker.tasks.assemble_media": {"queue": QUEUE_TRANSCODE_LIGHT},
+        "app.worker.tasks.process_bandwidth_logs": {"queue": QUEUE_MAINTENANCE},
+        "app.worker.tasks.schedule_popular_encodes": {"queue": QUEUE_MAINTENANCE},
+        "app.worker.tasks.collect_cold_renditions": {"queue": QUEUE_MAINTENANCE},
+        "app.worker.tasks.tier_media_storage": {"queue": QUEUE_MAINTENANCE},
+        "app.worker.tasks.purge_media": {"queue": QUEUE_MAINTENANCE},
+        "app.worker.tasks.collect_deleted_media": {"queue": QUEUE_MAINTENANCE},
+        "app.worker.tasks.reconcile_media_storage": {"queue": QUEUE_MAINTENANCE},
+        "app.worker.tasks.encode_renditions": {"queue": QUEUE_TRANSCODE_HEAVY},
+    },
+    task_default_priority=5,
+    broker_transport_options={
+        # Enables message priorities on Redis (0 = highest)
+        "priority_steps": list(range(10)),
+        "sep": ":",
+        # A worker on several queues drains them in the order given to -Q
+        "queue_order_strategy": "priority",
+        # Unacked acks_late messages are redelivered after this long; it
+        # must exceed task_time_limit or a running encode gets duplicated
+        "visibility_timeout": 7200,
+    },
 )
 
 # Celery Beat schedule for periodic tasks
@@ -28,4 +73,47 @@ celery_app.conf.beat_schedule = {
         'task': 'app.worker.tasks.process_bandwidth_logs',
         'schedule': 300.0,  # Run every 5 minutes
     },
+    # Both are no-ops unless LAZY_RUNG_THRESHOLDS or MODERN_CODEC_MIN_PLAYS is set
+    'schedule-popular-encodes': {
+        'task': 'app.worker.tasks.schedule_popular_encodes',
+        'schedule': 600.0,
+    },
+    'collect-cold-renditions': {
+        'task': 'app.worker.tasks.collect_cold_renditions',
+        'schedule': 3600.0,
+    },
+    # No-op unless ARCHIVE_ROOT is set or STORAGE_BACKEND=s3
+    'tier-media-storage': {
+        'task': 'app.worker.tasks.tier_media_storage',
+        'schedule': 21600.0,
+    },
+    # Deletes are soft: purge_media does the work, these catch what it missed
+    'collect-deleted-media': {
+        'task': 'app.worker.tasks.collect_deleted_media',
+        'schedule': 600.0,
+    },
+    'reconcile-media-storage': {
+        'task': 'app.worker.tasks.reconcile_media_storage',
+        'schedule': 21600.0,
+    },
 }
+
+
+@before_task_publish.connect
+def _stamp_enqueue_time(headers=None, **kwargs):
+    """Record when a task was queued so workers can report queue wait."""
+    if headers is not None:
+        headers.setdefault("enqueued_at", time.time())
+
+
+@worker_init.connect
+def _serve_worker_metrics(**kwargs):
+    from .worker.instrumentation import serve_worker_metrics
+    serve_worker_metrics()
+
+
+@worker_process_shutdown.connect
+def _mark_metrics_process_dead(pid=None, **kwargs):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid or os.getpid())
@@ -0,0 +1,149 @@
+"""Geolocation and reverse DNS for listeners, resolved once per IP.
+
+The listeners row stores city/region/country/hostname together with
+geo_ip, the address they were resolved for. track_event upserts the row
+and, when it is new or its IP changed (geo_ip no longer matches), hands
+it to enrich_listener on this process's event loop. The GeoIP lookup is
+local; the PTR query goes through the loop's resolver with a timeout,
+so neither blocks a request. The admin pages then read columns only.
+
+sweep_listeners catches whatever that misses - a process restart, rows
+from before the columns existed, IPs seen while the GeoIP database was
+still downloading - one API process per interval.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+from typing import Dict, Optional
+
+import redis.asyncio as aioredis
+from sqlalchemy import desc
+
+from . import geoip
+from .database import SessionLocal
+from .models import Listener
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+HOSTNAME_TIMEOUT = float(os.getenv("HOSTNAME_LOOKUP_TIMEOUT", "2"))
+ENRICH_SWEEP_INTERVAL = int(os.getenv("LISTENER_ENRICH_INTERVAL", "60"))
+ENRICH_BATCH_SIZE = int(os.getenv("LISTENER_ENRICH_BATCH", "200"))
+
+_SWEEP_LOCK_KEY = "onplay:listeners:enrich-sweep"
+_HOSTNAME_CACHE_SIZE = 4096
+
+_redis_client = aioredis.from_url(REDIS_URL)
+_hostnames: Dict[str, Optional[str]] = {}
+# getnameinfo runs in the default executor; cap how many threads it holds
+_dns_slots = asyncio.Semaphore(8)
+_in_flight: Dict[str, asyncio.Task] = {}
+
+
+async def resolve_hostname(ip: Optional[str]) -> Optional[str]:
+    """PTR name for ip; None when there is none or it takes too long.
+
+    Results, misses included, are cached per process.
+    """
+    if not ip or ip == "unknown":
+        return None
+    if ip in _hostnames:
+        return _hostnames[ip]
+    loop = asyncio.get_running_loop()
+    try:
+        async with _dns_slots:
+            hostname, _ = await asyncio.wait_for(
+                loop.getnameinfo((ip, 0), socket.NI_NAMEREQD), HOSTNAME_TIMEOUT
+            )
+    except (asyncio.TimeoutError, OSError, ValueError):
+        hostname = None
+    if len(_hostnames) >= _HOSTNAME_CACHE_SIZE:
+        _hostnames.pop(next(iter(_hostnames)))
+    _hostnames[ip] = hostname
+    return hostname
+
+
+def _store(results) -> None:
+    """Write (listener_id, ip, city, region, country, hostname) rows."""
+    db = SessionLocal()
+    try:
+        for listener_id, ip, city, region, country, hostname in results:
+            # Only if the IP is still the one resolved; a newer one is pending again
+            db.query(Listener).filter(
+                Listener.id == listener_id,
+                Listener.ip_address.is_not_distinct_from(ip),
+            ).update({
+                Listener.city: city,
+                Listener.region: region,
+                Listener.country: country,
+                Listener.hostname: hostname,
+                Listener.geo_ip: ip,
+            }, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+async def _resolve(listener_id: str, ip: Optional[str]):
+    city, region, country = geoip.get_location(ip)
+    return listener_id, ip, city, region, country, await resolve_hostname(ip)
+
+
+async def enrich_listener(listener_id: str, ip: Optional[str]) -> None:
+    # Left pending while the database is missing, rather than stored as
+    # unknown for good
+    if not geoip.is_ready():
+        return
+    await asyncio.to_thread(_store, [await _resolve(listener_id, ip)])
+
+
+def schedule_enrichment(listener_id: str, ip: Optional[str]) -> None:
+    """Enrich in the background, once at a time per listener."""
+    if listener_id in _in_flight:
+        return
+    task = asyncio.create_task(enrich_listener(listener_id, ip))
+    _in_flight[listener_id] = task
+
+    def done(t: asyncio.Task):
+        _in_flight.pop(listener_id, None)
+        if not t.cancelled() and t.exception():
+            logger.warning("Listener %s enrichment failed: %s", listener_id, t.exception())
+
+    task.add_done_callback(done)
+
+
+def _pending(limit: int):
+    db = SessionLocal()
+    try:
+        return db.query(Listener.id, Listener.ip_address).filter(
+            Listener.geo_ip.is_distinct_from(Listener.ip_address)
+        ).order_by(desc(Listener.last_seen)).limit(limit).all()
+    finally:
+        db.close()
+
+
+async def sweep_listeners():
+    """Enrich pending listeners every ENRICH_SWEEP_INTERVAL seconds.
+
+    Every API process runs this; a Redis key expiring with the interval
+    lets only one of them sweep each time.
+    """
+    while True:
+        await asyncio.sleep(ENRICH_SWEEP_INTERVAL)
+        try:
+            if not geoip.is_ready():
+                continue
+            if not await _redis_client.set(_SWEEP_LOCK_KEY, os.getpid(), nx=True, ex=ENRICH_SWEEP_INTERVAL):
+                continue
+            rows = await asyncio.to_thread(_pending, ENRICH_BATCH_SIZE)
+            if not rows:
+                continue
+            results = await asyncio.gather(*(_resolve(listener_id, ip) for listener_id, ip in rows))
+            await asyncio.to_thread(_store, results)
+            logger.info("Enriched %d listeners", len(results))
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:  # noqa: BLE001 - Redis or database down; retry next interval
+            logger.warning("Listener enrichment sweep failed: %s", exc)
@@ -18,8 +18,6 @@ from ipaddress import ip_address
 from typing import Optional, Tuple
 from urllib.request import Request, urlopen
 
-import maxminddb
-
 logger = logging.getLogger(__name__)
 
 GEOIP_DB_PATH = os.environ.get("GEOIP_DB_PATH", "/geoip/dbip-city-lite.mmdb")
@@ -27,7 +25,7 @@ GEOIP_DB_PATH = os.environ.get("GEOIP_DB_PATH", "/geoip/dbip-city-lite.mmdb")
 # DB-IP publishes one file per month; recent months stay available.
 _DOWNLOAD_URL = "https://download.db-ip.com/free/dbip-city-lite-{year}-{month:02d}.mmdb.gz"
 
-_reader: Optional[maxminddb.Reader] = None
+_reader = None  # maxminddb.Reader, imported on first open
 _reader_lock = threading.Lock()
 
 
@@ -88,11 +86,13 @@ def ensure_db() -> None:
     threading.Thread(target=_download_db, daemon=True).start()
 
 
-def _get_reader() -> Optional[maxminddb.Reader]:
+def _get_reader():
     global _reader
     if _reader is None and os.path.exists(GEOIP_DB_PATH):
         with _reader_lock:
             if _reader is None:
+                import maxminddb
+
                 try:
                     _reader = maxminddb.open_database(GEOIP_DB_PATH)
                 except Exception as exc:  # noqa: BLE001 - corrupt/partial file
@@ -100,14 +100,21 @@ def _get_reader() -> Optional[maxminddb.Reader]:
     return _reader
 
 
+def is_ready() -> bool:
+    """Whether the database is downloaded and open."""
+    return _get_reader() is not None
+
+
 @lru_cache(maxsize=4096)
 def _lookup(ip: str) -> Tuple[Optional[str], Optional[str], Optional[str]]:
     reader = _reader
     if reader is None:
         return None, None, None
+    from maxminddb import InvalidDatabaseError
+
     try:
         record = reader.get(ip) or {}
-    except (ValueError, maxminddb.InvalidDatabaseError):
+    except (ValueError, InvalidDatabaseError):
         return None, None, None
     city = (record.get("city") or {}).get("names", {}).get("en")
     subdivisions = record.get("subdivisions") or []
@@ -128,7 +135,7 @@ def get_location(
             return None, None, None
     except ValueError:
         return None, None, None
-    if _get_reader() is None:
+    if not is_ready():
         # Don't poison the cache while the database is still downloading.
         return None, None, None
     return _lookup(ip)
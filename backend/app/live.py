@@ -0,0 +1,142 @@
+"""Live concurrent-viewer counts from player heartbeats, kept in Redis only.
+
+Players send a heartbeat event every HEARTBEAT_INTERVAL seconds while
+playing. Each heartbeat is two pipelined ZADDs - no Postgres row, no media
+lookup - so the write path scales with Redis rather than with the
+analytics table:
+
+  onplay:live:viewers:{media_id}   viewer id -> last heartbeat (unix seconds)
+  onplay:live:media                media id  -> last heartbeat
+
+A viewer counts as watching while their last heartbeat is inside
+LIVE_WINDOW. Heartbeats are unauthenticated, so only ids of ready media
+are recorded (checked against a set of them reloaded every
+KNOWN_MEDIA_TTL seconds), each write trims its own viewer set, and the
+active-media set is trimmed at most once per window per process - the
+keys stay bounded whether or not anyone reads the counts.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, FrozenSet, Optional
+
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+
+from .database import SessionLocal
+from .models import Media, MediaStatus
+from .realtime import ConnectionManager
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+HEARTBEAT_INTERVAL = 15
+# Two missed heartbeats (plus slack for a slow network) and the viewer is gone
+LIVE_WINDOW = int(os.getenv("LIVE_WINDOW_SECONDS", "45"))
+LIVE_PUSH_INTERVAL = float(os.getenv("LIVE_PUSH_INTERVAL", "5"))
+KNOWN_MEDIA_TTL = float(os.getenv("LIVE_KNOWN_MEDIA_TTL", "60"))
+# An unknown id reloads the set early (a just-processed item), at most this often
+_KNOWN_MEDIA_MISS_RELOAD = 5.0
+# WebSocket client id that receives periodic live-count snapshots
+LIVE_CLIENT_ID = "live-viewers"
+
+_VIEWERS_KEY = "onplay:live:viewers:{}"
+_ACTIVE_MEDIA_KEY = "onplay:live:media"
+
+_redis_client = aioredis.from_url(REDIS_URL)
+_known_media: FrozenSet[str] = frozenset()
+_known_media_loaded = float("-inf")
+_known_media_lock = asyncio.Lock()
+_active_trimmed = 0.0
+
+
+def _load_known_media() -> FrozenSet[str]:
+    db = SessionLocal()
+    try:
+        return frozenset(
+            media_id for (media_id,) in db.query(Media.id).filter(
+                Media.status == MediaStatus.READY, Media.deleted_at.is_(None)
+            )
+        )
+    finally:
+        db.close()
+
+
+async def is_live_media(media_id: str) -> bool:
+    """Whether media_id is a ready, non-deleted item, from the cached id set."""
+    global _known_media, _known_media_loaded
+    age = time.monotonic() - _known_media_loaded
+    if age > KNOWN_MEDIA_TTL or (media_id not in _known_media and age > _KNOWN_MEDIA_MISS_RELOAD):
+        async with _known_media_lock:
+            # Another request may have reloaded it while this one waited
+            if time.monotonic() - _known_media_loaded > _KNOWN_MEDIA_MISS_RELOAD:
+                _known_media = await asyncio.to_thread(_load_known_media)
+                _known_media_loaded = time.monotonic()
+    return media_id in _known_media
+
+
+async def record_heartbeat(media_id: str, viewer_id: str) -> None:
+    global _active_trimmed
+    now = time.time()
+    cutoff = now - LIVE_WINDOW
+    key = _VIEWERS_KEY.format(media_id)
+    async with _redis_client.pipeline(transaction=False) as pipe:
+        pipe.zadd(key, {viewer_id: now})
+        pipe.zremrangebyscore(key, "-inf", cutoff)
+        pipe.expire(key, LIVE_WINDOW * 2)
+        pipe.zadd(_ACTIVE_MEDIA_KEY, {media_id: now})
+        if now - _active_trimmed > LIVE_WINDOW:
+            _active_trimmed = now
+            pipe.zremrangebyscore(_ACTIVE_MEDIA_KEY, "-inf", cutoff)
+        await pipe.execute()
+
+
+async def concurrent_viewers(media_id: Optional[str] = None) -> Dict[str, int]:
+    """{media_id: viewers} for media with a heartbeat inside the window."""
+    cutoff = time.time() - LIVE_WINDOW
+    if media_id:
+        media_ids = [media_id]
+    else:
+        await _redis_client.zremrangebyscore(_ACTIVE_MEDIA_KEY, "-inf", cutoff)
+        media_ids = [m.decode() for m in await _redis_client.zrange(_ACTIVE_MEDIA_KEY, 0, -1)]
+    if not media_ids:
+        return {}
+
+    async with _redis_client.pipeline(transaction=False) as pipe:
+        for mid in media_ids:
+            key = _VIEWERS_KEY.format(mid)
+            pipe.zremrangebyscore(key, "-inf", cutoff)
+            pipe.zcard(key)
+        results = await pipe.execute()
+
+    counts = {mid: results[i * 2 + 1] for i, mid in enumerate(media_ids)}
+    return {mid: n for mid, n in counts.items() if n or mid == media_id}
+
+
+async def push_live_counts(manager: ConnectionManager):
+    """Periodically send live counts to this process's LIVE_CLIENT_ID sockets.
+
+    Each API process serves only the sockets it holds, so snapshots go
+    straight to local connections instead of through pub/sub, and nothing
+    is read from Redis while no dashboard is open here.
+    """
+    while True:
+        await asyncio.sleep(LIVE_PUSH_INTERVAL)
+        if LIVE_CLIENT_ID not in manager.active_connections:
+            continue
+        try:
+            counts = await concurrent_viewers()
+        except RedisError as exc:
+            logger.warning("Live viewer snapshot failed: %s", exc)
+            continue
+        await manager.send_message(
+            {
+                "type": "live_viewers",
+                "total": sum(counts.values()),
+                "media": counts,
+                "window_seconds": LIVE_WINDOW,
+            },
+            LIVE_CLIENT_ID,
+        )
@@ -2,25 +2,62 @@ from fastapi import Depends, FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
-from .database import engine, Base, SessionLocal
-from .auth import require_admin, seed_admin
-from .migrations import run_startup_migrations
+from fastapi.concurrency import run_in_threadpool
+from .database import engine, SessionLocal
+from .auth import require_admin, websocket_admin
+from .migrations import prepare_database, verify_database
 from .geoip import ensure_db as ensure_geoip_db
+from .enrichment import sweep_listeners
 from .api import auth, upload, media, analytics, tags
+from .realtime import manager, relay_pubsub
+from .live import push_live_counts
+from .metrics import (
+    instrument_engine,
+    mark_process_dead,
+    metrics_endpoint,
+    metrics_middleware,
+    monitor_event_loop_lag,
+)
+from contextlib import asynccontextmanager
+import asyncio
 import os
-import json
-from typing import Dict, Set
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
-run_startup_migrations(engine)
-seed_admin(SessionLocal)
-ensure_geoip_db()
+# Schema handling at process startup (never at import):
+#   migrate - create/migrate/seed if the schema is behind (dev default;
+#             processes serialise on the migration lock only when it is)
+#   verify  - only check the schema version and refuse to start if it is
+#             behind; migrations run once per deploy via python -m app.manage migrate
+DB_SCHEMA_MODE = os.getenv("DB_SCHEMA_MODE", "migrate")
+
+instrument_engine(engine)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if DB_SCHEMA_MODE == "verify":
+        await asyncio.to_thread(verify_database, engine)
+    else:
+        await asyncio.to_thread(prepare_database, engine, SessionLocal)
+    ensure_geoip_db()
+
+    # Each API process relays Redis pub/sub messages to the sockets it holds
+    background = [
+        asyncio.create_task(relay_pubsub(manager)),
+        asyncio.create_task(push_live_counts(manager)),
+        asyncio.create_task(monitor_event_loop_lag()),
+        asyncio.create_task(sweep_listeners()),
+    ]
+    try:
+        yield
+    finally:
+        for task in background:
+            task.cancel()
+        mark_process_dead()
 
 app = FastAPI(
     title="OnPlay API",
     description="Professional media streaming platform API - onplay.site",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS Configuration
@@ -34,6 +71,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency / SQL-per-request metrics and slow-request logging
+app.middleware("http")(metrics_middleware)
+
 # Include routers
 app.include_router(auth.router, prefix="/api", tags=["auth"])
 app.include_router(upload.router, prefix="/api", tags=["upload"], dependencies=[Depends(require_admin)])
@@ -41,32 +81,13 @@ app.include_router(media.router, prefix="/api", tags=["media"])
 app.include_router(analytics.router, prefix="/api", tags=["analytics"])
 app.include_router(tags.router, prefix="/api", tags=["tags"])
 
-# WebSocket connection manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, Set[WebSocket]] = {}
-
-    async def connect(self, websocket: WebSocket, client_id: str):
-        await websocket.accept()
-        if client_id not in self.active_connections:
-            self.active_connections[client_id] = set()
-        self.active_connections[client_id].add(websocket)
-
-    def disconnect(self, websocket: WebSocket, client_id: str):
-        if client_id in self.active_connections:
-            self.active_connections[client_id].discard(websocket)
-            if not self.active_connections[client_id]:
-                del self.active_connections[client_id]
-
-    async def send_message(self, message: dict, client_id: str):
-        if client_id in self.active_connections:
-            for connection in self.active_connections[client_id]:
-                await connection.send_text(json.dumps(message))
-
-manager = ConnectionManager()
-
 @app.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
+    # Every channel carries admin data (processing progress for media-<id>,
+    # live viewer counts for LIVE_CLIENT_ID): refuse the handshake otherwise
+    if await run_in_threadpool(websocket_admin, websocket) is None:
+        await websocket.close(code=1008)  # policy violation
+        return
     await manager.connect(websocket, client_id)
     try:
         while True:
@@ -74,6 +95,12 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
             # Echo back for now, can be extended
             await manager.send_message({"message": "received", "data": data}, client_id)
     except WebSocketDisconnect:
+        pass
+    except RuntimeError:
+        # The manager closed the socket under us (slow consumer, 1013), so
+        # there is nothing left to receive
+        pass
+    finally:
         manager.disconnect(websocket, client_id)
 
 @app.get("/")
@@ -85,6 +112,10 @@ async def root():
         "docs": "/docs"
     }
 
+# Prometheus scrape target. Not routed by nginx (only /api and /ws are),
+# so it is reachable on the internal network only.
+app.add_api_route("/metrics", metrics_endpoint, include_in_schema=False)
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
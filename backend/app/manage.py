@@ -0,0 +1,41 @@
+"""
+One-off administration commands, run outside the API processes:
+
+    python -m app.manage migrate   # create tables, apply migrations, seed admin
+    python -m app.manage check     # exit 1 if the schema is behind this code
+
+Run migrate once per deploy, so API workers only verify the schema
+version at startup instead of each taking the migration lock (see
+DB_SCHEMA_MODE in main.py). The production stack written by install.sh
+does this: its api container runs migrate before uvicorn, with
+DB_SCHEMA_MODE=verify. The dev docker-compose keeps the default
+(migrate), so its single --reload process applies new migrations itself.
+"""
+
+import argparse
+import logging
+import sys
+
+from .database import SessionLocal, engine
+from .migrations import SCHEMA_VERSION, prepare_database, schema_current
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.manage")
+    parser.add_argument("command", choices=["migrate", "check"])
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "migrate":
+        changed = prepare_database(engine, SessionLocal)
+        print(f"Schema version {SCHEMA_VERSION} ({'migrated' if changed else 'already current'})")
+        return 0
+    if schema_current(engine):
+        print(f"Schema version {SCHEMA_VERSION}: current")
+        return 0
+    print(f"Schema is behind version {SCHEMA_VERSION}; run `python -m app.manage migrate`")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
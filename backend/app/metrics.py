@@ -0,0 +1,152 @@
+"""Prometheus metrics for the API: request latency, SQL per request and
+event-loop lag, plus slow-request logging.
+
+With several uvicorn workers each process keeps its own counters, so set
+PROMETHEUS_MULTIPROC_DIR to an empty, writable directory shared by the
+workers (wiped before they start); /metrics then aggregates every
+process's samples. Without it, /metrics reports the serving process only.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi import Request, Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "1.0"))
+LOOP_LAG_INTERVAL = 0.5
+_MULTIPROC = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+REQUEST_LATENCY = Histogram(
+    "onplay_http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUEST_SQL_STATEMENTS = Histogram(
+    "onplay_http_request_sql_statements",
+    "SQL statements executed per HTTP request",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100),
+)
+REQUEST_SQL_SECONDS = Histogram(
+    "onplay_http_request_sql_seconds",
+    "Time spent in SQL per HTTP request",
+    ["route"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+SLOW_REQUESTS = Counter(
+    "onplay_http_slow_requests_total",
+    "Requests slower than SLOW_REQUEST_SECONDS",
+    ["route"],
+)
+EVENT_LOOP_LAG = Histogram(
+    "onplay_event_loop_lag_seconds",
+    "Delay between when a timer was due and when the event loop ran it",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+EVENT_LOOP_LAG_LAST = Gauge(
+    "onplay_event_loop_lag_last_seconds",
+    "Most recent event-loop lag sample",
+    multiprocess_mode="max",
+)
+
+
+class _SqlStats:
+    __slots__ = ("statements", "seconds")
+
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+
+
+# Mutable per-request accumulator. Starlette copies the context into the
+# threadpool for sync dependencies, so they share the same object.
+_request_sql: ContextVar[Optional[_SqlStats]] = ContextVar("request_sql", default=None)
+
+
+def instrument_engine(engine):
+    """Count statements and time spent in them for the current request."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_start"].pop()
+        stats = _request_sql.get()
+        if stats is not None:
+            stats.statements += 1
+            stats.seconds += time.perf_counter() - started
+
+
+async def metrics_middleware(request: Request, call_next):
+    if request.url.path == "/metrics":
+        return await call_next(request)
+
+    stats = _SqlStats()
+    token = _request_sql.set(stats)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - started
+        _request_sql.reset(token)
+        # Label by route template, not raw path, to bound cardinality
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        REQUEST_LATENCY.labels(request.method, route, str(status)).observe(elapsed)
+        REQUEST_SQL_STATEMENTS.labels(route).observe(stats.statements)
+        REQUEST_SQL_SECONDS.labels(route).observe(stats.seconds)
+        if elapsed >= SLOW_REQUEST_SECONDS:
+            SLOW_REQUESTS.labels(route).inc()
+            logger.warning(
+                "Slow request %s %s -> %s in %.3fs (%d SQL statements, %.3fs in SQL)",
+                request.method, request.url.path, status, elapsed,
+                stats.statements, stats.seconds,
+            )
+
+
+async def monitor_event_loop_lag():
+    """Sample how late a periodic timer fires; sustained lag means some
+    handler is blocking the loop (sync I/O in an async def)."""
+    loop = asyncio.get_running_loop()
+    while True:
+        due = loop.time() + LOOP_LAG_INTERVAL
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(loop.time() - due, 0.0)
+        EVENT_LOOP_LAG.observe(lag)
+        EVENT_LOOP_LAG_LAST.set(lag)
+
+
+def mark_process_dead():
+    if _MULTIPROC:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+async def metrics_endpoint():
+    if _MULTIPROC:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        payload = generate_latest(registry)
+    else:
+        payload = generate_latest()
+    return Response(payload, media_type=CONTENT_TYPE_LATEST)
@@ -1,23 +1,233 @@
-from sqlalchemy import text
-
-# Idempotent DDL applied at startup. create_all only creates new tables, so
-# changes to existing tables must be listed here.
-STATEMENTS = [
-    "ALTER TABLE analytics ADD COLUMN IF NOT EXISTS listener_id VARCHAR",
-    "CREATE INDEX IF NOT EXISTS ix_analytics_listener_id ON analytics (listener_id)",
-    "CREATE INDEX IF NOT EXISTS ix_analytics_media_id ON analytics (media_id)",
-    "CREATE INDEX IF NOT EXISTS ix_analytics_event_ts ON analytics (event_type, timestamp)",
+"""
+Numbered schema migrations, tracked in the schema_version table.
+
+create_all only creates missing tables, so every change to an existing
+table is appended to MIGRATIONS with the next version number - never
+edit or reorder an applied one. Each migration has a kind:
+
+    DDL         statements run in one transaction under a short
+                lock_timeout, retried if the table is busy, so an ALTER
+                never queues in front of the analytics inserts. Add
+                nullable columns without volatile defaults (no rewrite)
+                and fill them with a BACKFILL.
+    CONCURRENT  CREATE/DROP INDEX CONCURRENTLY, run outside a transaction
+                so writes continue during the build. Name the migration
+                after the index: an invalid leftover from an interrupted
+                build is dropped before retrying.
+    BACKFILL    an UPDATE limited to :batch rows, repeated (one commit per
+                batch) until it changes fewer rows than that. It must be
+                idempotent, e.g. WHERE new_column IS NULL.
+
+Every migration is stamped once it completes, so an interrupted run
+resumes where it stopped.
+"""
+
+import logging
+import os
+import time
+from typing import NamedTuple, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
+
+from .auth import seed_admin
+from .database import Base
+from . import models  # noqa: F401 - registers the tables on Base.metadata
+
+logger = logging.getLogger(__name__)
+
+DDL = "ddl"
+CONCURRENT = "concurrent"
+BACKFILL = "backfill"
+
+LOCK_TIMEOUT = os.getenv("MIGRATION_LOCK_TIMEOUT", "3s")
+DDL_ATTEMPTS = int(os.getenv("MIGRATION_DDL_ATTEMPTS", "10"))
+BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "5000"))
+BATCH_PAUSE = float(os.getenv("MIGRATION_BATCH_PAUSE", "0.05"))  # seconds between backfill batches
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    kind: str
+    statements: Tuple[str, ...]
+
+
+MIGRATIONS = [
+    Migration(1, "analytics.listener_id", DDL, (
+        "ALTER TABLE analytics ADD COLUMN IF NOT EXISTS listener_id VARCHAR",
+    )),
+    Migration(2, "ix_analytics_listener_id", CONCURRENT, (
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_analytics_listener_id ON analytics (listener_id)",
+    )),
+    Migration(3, "ix_analytics_media_id", CONCURRENT, (
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_analytics_media_id ON analytics (media_id)",
+    )),
+    Migration(4, "ix_analytics_event_ts", CONCURRENT, (
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_analytics_event_ts ON analytics (event_type, timestamp)",
+    )),
+    Migration(5, "media.content_hash", DDL, (
+        "ALTER TABLE media ADD COLUMN IF NOT EXISTS content_hash VARCHAR",
+    )),
+    Migration(6, "ix_media_content_hash", CONCURRENT, (
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_media_content_hash ON media (content_hash)",
+    )),
+    Migration(7, "media.deleted_at", DDL, (
+        "ALTER TABLE media ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP WITH TIME ZONE",
+    )),
+    Migration(8, "ix_media_deleted_at", CONCURRENT, (
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_media_deleted_at ON media (deleted_at)",
+    )),
+    # Existing rows stay pending (geo_ip NULL) and are filled by
+    # app.enrichment's sweep: GeoIP and DNS can't run in SQL
+    Migration(9, "listeners geo columns", DDL, (
+        "ALTER TABLE listeners ADD COLUMN IF NOT EXISTS geo_ip VARCHAR",
+        "ALTER TABLE listeners ADD COLUMN IF NOT EXISTS city VARCHAR",
+        "ALTER TABLE listeners ADD COLUMN IF NOT EXISTS region VARCHAR",
+        "ALTER TABLE listeners ADD COLUMN IF NOT EXISTS country VARCHAR",
+        "ALTER TABLE listeners ADD COLUMN IF NOT EXISTS hostname VARCHAR",
+    )),
+    Migration(10, "ix_listeners_geo", CONCURRENT, (
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_listeners_geo ON listeners (country, region, city, last_seen)",
+    )),
+    Migration(11, "ix_listeners_enrich_pending", CONCURRENT, (
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_listeners_enrich_pending ON listeners (last_seen) "
+        "WHERE geo_ip IS DISTINCT FROM ip_address",
+    )),
+    # Media processed earlier is filled on first read (api.media.fill_playback)
+    Migration(12, "media.playback", DDL, (
+        "ALTER TABLE media ADD COLUMN IF NOT EXISTS playback JSON",
+    )),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1].version
+assert [m.version for m in MIGRATIONS] == list(range(1, SCHEMA_VERSION + 1)), "migration versions must be 1..n"
+
+LOCK_KEY = 872634917  # advisory lock: only one process migrates at a time
+
+SCHEMA_VERSION_TABLE = [
+    "CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)",
+    "ALTER TABLE schema_version ADD COLUMN IF NOT EXISTS name VARCHAR",
+    "ALTER TABLE schema_version ADD COLUMN IF NOT EXISTS applied_at TIMESTAMP WITH TIME ZONE DEFAULT now()",
 ]
 
-LOCK_KEY = 872634917  # advisory lock: prod runs 4 workers that race on DDL
 
+def schema_version(conn) -> int:
+    """Highest migration applied; 0 if never stamped."""
+    if not inspect(conn).has_table("schema_version"):
+        return 0
+    return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
 
-def run_startup_migrations(engine):
+
+def schema_current(engine) -> bool:
+    """Whether every table exists and all MIGRATIONS were applied - two
+    catalog queries, no locks."""
     with engine.connect() as conn:
-        conn.execute(text("SELECT pg_advisory_lock(:k)"), {"k": LOCK_KEY})
+        missing = set(Base.metadata.tables) - set(inspect(conn).get_table_names())
+        return not missing and schema_version(conn) >= SCHEMA_VERSION
+
+
+def _is_lock_timeout(e: OperationalError) -> bool:
+    return getattr(e.orig, "pgcode", None) == "55P03"  # lock_not_available
+
+
+def _run_ddl(engine, migration: Migration):
+    for attempt in range(1, DDL_ATTEMPTS + 1):
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+                for stmt in migration.statements:
+                    conn.execute(text(stmt))
+            return
+        except OperationalError as e:
+            if not _is_lock_timeout(e) or attempt == DDL_ATTEMPTS:
+                raise
+            logger.warning("Migration %d (%s): table busy, retrying (%d/%d)",
+                           migration.version, migration.name, attempt, DDL_ATTEMPTS)
+            time.sleep(min(attempt, 5))
+
+
+def _run_concurrent(conn, migration: Migration):
+    # A failed CONCURRENTLY build leaves an INVALID index that IF NOT EXISTS
+    # would then silently accept
+    invalid = conn.execute(text(
+        "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name AND NOT i.indisvalid"
+    ), {"name": migration.name}).first()
+    if invalid:
+        logger.warning("Dropping invalid index %s left by an interrupted build", migration.name)
+        conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{migration.name}"'))
+    for stmt in migration.statements:
+        conn.execute(text(stmt))
+
+
+def _run_backfill(engine, migration: Migration):
+    total = 0
+    for stmt in migration.statements:
+        while True:
+            with engine.begin() as conn:
+                conn.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+                changed = conn.execute(text(stmt), {"batch": BATCH_SIZE}).rowcount
+            total += changed
+            if changed < BATCH_SIZE:
+                break
+            time.sleep(BATCH_PAUSE)
+    logger.info("Migration %d (%s): backfilled %d rows", migration.version, migration.name, total)
+
+
+def run_migrations(engine) -> int:
+    """
+    Create missing tables and apply pending MIGRATIONS in order; returns how
+    many were applied. The advisory lock is polled from a connection that
+    stays outside any transaction, so neither a waiting process nor the lock
+    holder keeps a CONCURRENTLY build waiting on its snapshot.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_conn:
+        while not lock_conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": LOCK_KEY}).scalar():
+            time.sleep(1)
         try:
-            for stmt in STATEMENTS:
-                conn.execute(text(stmt))
-            conn.commit()
+            Base.metadata.create_all(bind=engine)
+            for stmt in SCHEMA_VERSION_TABLE:
+                lock_conn.execute(text(stmt))
+            current = schema_version(lock_conn)
+            pending = [m for m in MIGRATIONS if m.version > current]
+            for migration in pending:
+                logger.info("Applying migration %d (%s)", migration.version, migration.name)
+                started = time.monotonic()
+                if migration.kind == CONCURRENT:
+                    _run_concurrent(lock_conn, migration)
+                elif migration.kind == BACKFILL:
+                    _run_backfill(engine, migration)
+                else:
+                    _run_ddl(engine, migration)
+                lock_conn.execute(
+                    text("INSERT INTO schema_version (version, name) VALUES (:v, :n)"),
+                    {"v": migration.version, "n": migration.name},
+                )
+                logger.info("Migration %d done in %.1fs", migration.version, time.monotonic() - started)
+            return len(pending)
         finally:
-            conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": LOCK_KEY})
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": LOCK_KEY})
+
+
+def prepare_database(engine, session_factory) -> bool:
+    """
+    Create tables, apply pending migrations and seed the admin account - the
+    one-off release step (python -m app.manage migrate). Only two catalog
+    queries, without the migration lock, when the schema is already current;
+    returns whether anything had to be done.
+    """
+    if schema_current(engine):
+        return False
+    logger.info("Migrating database schema to version %d", SCHEMA_VERSION)
+    run_migrations(engine)
+    seed_admin(session_factory)
+    return True
+
+
+def verify_database(engine):
+    """Refuse to serve against a schema older than this code expects."""
+    if not schema_current(engine):
+        raise RuntimeError(
+            f"Database schema is behind version {SCHEMA_VERSION}; run `python -m app.manage migrate`"
+        )
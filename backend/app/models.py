@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, DateTime, Float, ForeignKey, Enum as SQLEnum, JSON, Table
+from sqlalchemy import Column, String, Integer, BigInteger, DateTime, Float, ForeignKey, Enum as SQLEnum, JSON, Table
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
@@ -43,10 +43,14 @@ class Media(Base):
     bitrate = Column(Integer, nullable=True)
     thumbnail_path = Column(String, nullable=True)
     error_message = Column(String, nullable=True)
+    content_hash = Column(String, nullable=True, index=True)  # sha256 of the original, for upload dedup
+    deleted_at = Column(DateTime(timezone=True), nullable=True, index=True)  # soft delete; files and row go in purge_media
+    playback = Column(JSON, nullable=True)  # {"startup": bundle, "first_segments": [[url, range], ...]}, written with the master playlist
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
     variants = relationship("MediaVariant", back_populates="media", cascade="all, delete-orphan")
+    processing_runs = relationship("ProcessingRun", back_populates="media", cascade="all, delete-orphan")
     analytics = relationship("Analytics", back_populates="media", cascade="all, delete-orphan")
     tags = relationship("Tag", secondary=media_tags, back_populates="media")
 
@@ -65,6 +69,27 @@ class MediaVariant(Base):
 
     media = relationship("Media", back_populates="variants")
 
+class ProcessingRun(Base):
+    """One execution of process_media, with per-stage timings for capacity planning."""
+    __tablename__ = "processing_runs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    media_id = Column(String, ForeignKey("media.id", ondelete="CASCADE"), nullable=False, index=True)
+    task_id = Column(String, nullable=True)
+    worker = Column(String, nullable=True)
+    status = Column(String, nullable=False, default="running")  # running, success, failed
+    queued_at = Column(DateTime(timezone=True), nullable=True)
+    started_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    queue_wait_seconds = Column(Float, nullable=True)
+    processing_seconds = Column(Float, nullable=True)
+    media_duration = Column(Float, nullable=True)
+    realtime_factor = Column(Float, nullable=True)  # encode seconds / media seconds
+    output_bytes = Column(BigInteger, nullable=True)
+    stages = Column(JSON, nullable=True)  # [{stage, variant, seconds, cpu_seconds, peak_rss_kb, bytes, realtime_factor}]
+
+    media = relationship("Media", back_populates="processing_runs")
+
 class Analytics(Base):
     __tablename__ = "analytics"
 
@@ -82,6 +107,27 @@ class Analytics(Base):
 
     media = relationship("Media", back_populates="analytics")
 
+class PlaybackQoE(Base):
+    """One quality-of-experience report from a player.
+
+    Counters are deltas since the client's previous report for the same
+    session, so summing rows gives per-session totals; startup_ms is only
+    set on the first report of a session.
+    """
+    __tablename__ = "playback_qoe"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    media_id = Column(String, ForeignKey("media.id", ondelete="CASCADE"), nullable=False, index=True)
+    timestamp = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    session_id = Column(String, nullable=True)
+    listener_id = Column(String, nullable=True)
+    variant = Column(String, nullable=True)  # quality most recently played, e.g. "720p"
+    startup_ms = Column(Integer, nullable=True)  # play request -> first frame
+    played_ms = Column(Integer, nullable=False, default=0)
+    rebuffer_ms = Column(Integer, nullable=False, default=0)
+    rebuffer_count = Column(Integer, nullable=False, default=0)
+    switch_count = Column(Integer, nullable=False, default=0)
+
 class Tag(Base):
     __tablename__ = "tags"
 
@@ -113,6 +159,13 @@ class Listener(Base):
     os = Column(String, nullable=True)
     total_events = Column(Integer, nullable=False, default=0)
     total_plays = Column(Integer, nullable=False, default=0)
+    # Resolved in the background (app.enrichment) for geo_ip; pending while
+    # that differs from ip_address
+    geo_ip = Column(String, nullable=True)
+    city = Column(String, nullable=True)
+    region = Column(String, nullable=True)
+    country = Column(String, nullable=True)
+    hostname = Column(String, nullable=True)
 
 class BandwidthLog(Base):
     __tablename__ = "bandwidth_logs"
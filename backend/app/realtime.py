@@ -0,0 +1,180 @@
+"""Cross-process WebSocket fan-out over Redis pub/sub.
+
+Sockets live in whichever uvicorn worker accepted them, so nothing may send
+to them directly from another process. Every producer (API handlers and
+Celery workers alike) publishes to the Redis channel for a client id, and
+each API process runs one pattern subscription that relays messages to the
+sockets it holds locally.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from typing import Dict, Optional
+
+import redis
+import redis.asyncio as aioredis
+from fastapi import WebSocket
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+CHANNEL_PREFIX = "onplay:ws:"
+
+# Publishing is fire-and-forget; the client connects lazily on first use.
+_redis_client = redis.from_url(REDIS_URL)
+
+
+def channel_for(client_id: str) -> str:
+    return f"{CHANNEL_PREFIX}{client_id}"
+
+
+def media_client_id(media_id: str) -> str:
+    """WebSocket client id that receives processing updates for one media."""
+    return f"media-{media_id}"
+
+
+def publish(client_id: str, message: dict) -> None:
+    """Send a message to every socket for client_id, in any API process.
+
+    Best-effort: a Redis outage must never fail the caller (e.g. a transcode).
+    """
+    try:
+        _redis_client.publish(channel_for(client_id), json.dumps(message))
+    except redis.RedisError as exc:
+        logger.warning("Realtime publish to %s failed: %s", client_id, exc)
+
+
+# Per-connection send buffer. A socket that falls this many messages behind
+# is disconnected rather than allowed to hold memory or delay its peers;
+# clients reconnect and re-sync from the REST API.
+SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "64"))
+SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+
+
+class _Connection:
+    """A socket plus its bounded outbox and the task draining it."""
+
+    __slots__ = ("websocket", "queue", "sender")
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+        self.sender: Optional[asyncio.Task] = None
+
+
+# WebSocket connection manager
+class ConnectionManager:
+    """
+    Sends never await the network: a message is serialised once and
+    enqueued on every target connection, and each connection's own sender
+    task writes it out. One stalled or dead socket therefore cannot delay
+    delivery to the others, and a failed send only removes that socket.
+    """
+
+    def __init__(self):
+        self.active_connections: Dict[str, Dict[WebSocket, _Connection]] = {}
+        self.evicted = 0
+
+    async def connect(self, websocket: WebSocket, client_id: str):
+        await websocket.accept()
+        conn = _Connection(websocket)
+        conn.sender = asyncio.create_task(self._drain(conn, client_id))
+        self.active_connections.setdefault(client_id, {})[websocket] = conn
+
+    def disconnect(self, websocket: WebSocket, client_id: str):
+        conns = self.active_connections.get(client_id)
+        if conns is None:
+            return
+        conn = conns.pop(websocket, None)
+        if not conns:
+            del self.active_connections[client_id]
+        if conn and conn.sender and conn.sender is not asyncio.current_task():
+            conn.sender.cancel()
+
+    async def send_message(self, message: dict, client_id: str):
+        await self.send_text(json.dumps(message), client_id)
+
+    async def send_text(self, text: str, client_id: str):
+        for conn in list(self.active_connections.get(client_id, {}).values()):
+            self._enqueue(conn, text, client_id)
+
+    async def broadcast(self, message: dict):
+        """Send one message to every connected client of this process."""
+        text = json.dumps(message)
+        for client_id, conns in list(self.active_connections.items()):
+            for conn in list(conns.values()):
+                self._enqueue(conn, text, client_id)
+
+    def connection_count(self) -> int:
+        return sum(len(conns) for conns in self.active_connections.values())
+
+    def _enqueue(self, conn: _Connection, text: str, client_id: str):
+        try:
+            conn.queue.put_nowait(text)
+        except asyncio.QueueFull:
+            logger.info("Disconnecting slow WebSocket consumer for %s", client_id)
+            self.evicted += 1
+            self._close(conn, client_id, code=1013)  # "try again later"
+
+    async def _drain(self, conn: _Connection, client_id: str):
+        try:
+            while True:
+                text = await conn.queue.get()
+                await asyncio.wait_for(conn.websocket.send_text(text), SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:  # noqa: BLE001 - any send failure means the socket is gone
+            logger.debug("WebSocket send to %s failed: %s", client_id, exc)
+            self.evicted += 1
+            self._close(conn, client_id, code=1011)
+
+    def _close(self, conn: _Connection, client_id: str, code: int):
+        self.disconnect(conn.websocket, client_id)
+        asyncio.create_task(self._safe_close(conn.websocket, code))
+
+    @staticmethod
+    async def _safe_close(websocket: WebSocket, code: int):
+        try:
+            await asyncio.wait_for(websocket.close(code=code), SEND_TIMEOUT)
+        except Exception:  # noqa: BLE001 - already closed or unresponsive
+            pass
+
+
+manager = ConnectionManager()
+
+
+async def relay_pubsub(manager: ConnectionManager):
+    """Forward published messages to this process's local sockets.
+
+    Runs for the lifetime of the API process and resubscribes with backoff
+    if Redis goes away. Messages for clients with no local socket are
+    dropped here; another process holds them.
+    """
+    backoff = 1
+    while True:
+        client = aioredis.from_url(REDIS_URL)
+        pubsub = client.pubsub()
+        try:
+            await pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+            backoff = 1
+            async for item in pubsub.listen():
+                if item["type"] != "pmessage":
+                    continue
+                client_id = item["channel"].decode()[len(CHANNEL_PREFIX):]
+                if client_id not in manager.active_connections:
+                    continue
+                try:
+                    await manager.send_text(item["data"].decode(), client_id)
+                except Exception as exc:  # noqa: BLE001 - one bad socket must not stop the relay
+                    logger.warning("Realtime relay to %s failed: %s", client_id, exc)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:  # noqa: BLE001 - reconnect on any Redis failure
+            logger.warning("Realtime subscription lost (%s); retrying in %ss", exc, backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+        finally:
+            await pubsub.aclose()
+            await client.aclose()
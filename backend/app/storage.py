@@ -0,0 +1,405 @@
+"""
+Where media files live.
+
+Files are addressed by their path relative to MEDIA_ROOT (the "key":
+original/<id>.mp4, hls/<id>/720p/segment_001.ts, thumbnails/<id>.jpg),
+which is also their URL under /media. MEDIA_ROOT is always a local
+working tree - ffmpeg reads and writes plain files there - and the
+backend decides what else has to happen:
+
+- local (default): MEDIA_ROOT is the volume nginx serves and every node
+  mounts, so save() and load() have nothing to do.
+- s3: files written under MEDIA_ROOT are uploaded to an S3-compatible
+  bucket (AWS S3, MinIO, R2, ...) and downloaded on demand by nodes that
+  lack them; nginx proxies /media to the bucket. MEDIA_ROOT is then
+  node-local scratch, so the API and workers need no shared volume.
+
+Delivery stays proxied through nginx in both cases: playlists reference
+segments by relative URI, which per-object presigned URLs can't follow,
+and the bandwidth tracker reads nginx's access log.
+"""
+
+import logging
+import mimetypes
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+MEDIA_ROOT = os.getenv("MEDIA_ROOT", "/media")
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+# Cold tier for the local backend: a cheaper mount (HDD, NAS) that nginx
+# also serves /media from. Unset disables tiering.
+ARCHIVE_ROOT = os.getenv("ARCHIVE_ROOT") or None
+
+S3_BUCKET = os.getenv("S3_BUCKET", "onplay-media")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None  # MinIO etc.; unset for AWS
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+# Files uploaded in parallel when saving a rendition directory
+S3_UPLOAD_CONCURRENCY = int(os.getenv("S3_UPLOAD_CONCURRENCY", "8"))
+# Files above this (originals, long single-file renditions) go up as
+# parallel multipart uploads
+S3_MULTIPART_THRESHOLD_MB = int(os.getenv("S3_MULTIPART_THRESHOLD_MB", "16"))
+# Cold tier on S3: a storage class that is still read instantly
+# (STANDARD_IA, ONEZONE_IA, GLACIER_IR); archival classes that need a
+# restore would break playback
+S3_ARCHIVE_STORAGE_CLASS = os.getenv("S3_ARCHIVE_STORAGE_CLASS", "STANDARD_IA")
+
+CONTENT_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".ts": "video/mp2t",
+    ".m4s": "video/iso.segment",
+    ".mp4": "video/mp4",
+    ".json": "application/json",
+}
+
+PathLike = Union[str, Path]
+
+
+def content_type(path: PathLike) -> str:
+    suffix = Path(path).suffix.lower()
+    return CONTENT_TYPES.get(suffix) or mimetypes.guess_type(str(path))[0] or "application/octet-stream"
+
+
+class LocalStorage:
+    """
+    Local-disk storage; MEDIA_ROOT is shared by every node.
+
+    With ARCHIVE_ROOT set, archive() moves files to that (cheaper, slower)
+    mount under the same key. nginx falls back to it for anything missing
+    from MEDIA_ROOT, so archived renditions stay playable, and load()
+    moves archived files back transparently for the jobs that need them.
+    """
+
+    local = True
+
+    def __init__(self, root: PathLike = MEDIA_ROOT, archive_root: Optional[PathLike] = ARCHIVE_ROOT):
+        self.root = Path(root)
+        self.archive_root = Path(archive_root) if archive_root else None
+
+    @property
+    def tiering(self) -> bool:
+        return self.archive_root is not None
+
+    def key(self, path: PathLike) -> str:
+        return Path(path).relative_to(self.root).as_posix()
+
+    def _archived(self, path: PathLike) -> Optional[Path]:
+        """Where path lives on the archive tier (None without one)."""
+        return self.archive_root / self.key(path) if self.archive_root else None
+
+    def save(self, path: PathLike):
+        """Make a file, or a directory tree, written under MEDIA_ROOT durable."""
+
+    def save_all(self, paths: List[PathLike]):
+        """save() for many files at once."""
+
+    def release(self, path: PathLike):
+        """Drop the local copy of a saved file or tree (never the only copy)."""
+
+    def load(self, path: PathLike) -> bool:
+        """Make a file, or a directory tree, available locally; False if it doesn't exist."""
+        return Path(path).exists() or self.recall(path)
+
+    def is_archived(self, path: PathLike) -> bool:
+        """Whether any of a file or tree is on the cold tier."""
+        archived = self._archived(path)
+        return archived is not None and archived.exists()
+
+    def archive(self, path: PathLike) -> bool:
+        """Move a file or tree to the cold tier; False if there was nothing to move."""
+        if not self.tiering or not Path(path).exists():
+            return False
+        _move(Path(path), self._archived(path), replace=True)
+        return True
+
+    def recall(self, path: PathLike) -> bool:
+        """Move a file or tree back from the cold tier; False if it isn't there."""
+        if not self.is_archived(path):
+            return False
+        _move(self._archived(path), Path(path), replace=False)
+        return True
+
+    def delete(self, path: PathLike):
+        """Remove a file or directory tree everywhere it is stored."""
+        for candidate in (Path(path), self._archived(path)):
+            if candidate:
+                _remove(candidate)
+
+    def copy(self, source: PathLike, target: PathLike):
+        """
+        Copy a file or tree to a new key, on whichever tiers hold the source.
+        Hard links: no bytes are copied and either side can be deleted
+        later without affecting the other. Raises OSError if the source is
+        missing or on another filesystem.
+        """
+        source, target = Path(source), Path(target)
+        archived = self.is_archived(source)
+        if not source.exists() and not archived:
+            raise FileNotFoundError(source)
+        if source.exists():
+            _link(source, target)
+        else:
+            # Archived sources give archived copies
+            _remove(target)
+        if archived:
+            _link(self._archived(source), self._archived(target))
+
+    def read_text(self, path: PathLike) -> Optional[str]:
+        """Current contents of a file, or None if it doesn't exist."""
+        for candidate in (Path(path), self._archived(path)):
+            try:
+                return candidate.read_text() if candidate else None
+            except OSError:
+                continue
+        return None
+
+    def size(self, path: PathLike) -> int:
+        """Bytes stored for a file or directory tree."""
+        path = Path(path)
+        if not path.exists() and self.is_archived(path):
+            path = self._archived(path)
+        if path.is_dir():
+            return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+        return path.stat().st_size if path.exists() else 0
+
+    def list(self, directory: PathLike, prefix: str = "") -> List[Path]:
+        """Files directly in directory whose names start with prefix, on either tier."""
+        directory = Path(directory)
+        found = set()
+        for candidate in (directory, self._archived(directory)):
+            if candidate and candidate.is_dir():
+                found.update(directory / p.name for p in candidate.glob(f"{prefix}*") if p.is_file())
+        return sorted(found)
+
+    def children(self, directory: PathLike) -> List[str]:
+        """Names of the files and subdirectories directly in directory, on either tier."""
+        names = set()
+        for candidate in (Path(directory), self._archived(directory)):
+            if candidate and candidate.is_dir():
+                names.update(p.name for p in candidate.iterdir())
+        return sorted(names)
+
+
+def _remove(path: Path):
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+
+def _link(source: Path, target: Path):
+    if source.is_dir():
+        shutil.copytree(source, target, copy_function=os.link)
+    else:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # Via a temporary name so an existing target is swapped atomically
+        linked = target.with_name(target.name + ".link")
+        os.link(source, linked)
+        os.replace(linked, target)
+
+
+def _move(source: Path, target: Path, replace: bool):
+    """
+    Move between tiers (usually different filesystems) file by file, each
+    copied next to its target, renamed into place and only then removed
+    from the source, so every file is complete on one tier or the other
+    at any moment. nginx looks at the hot tier first, which always holds
+    the newest copy: replace=False keeps a target that already exists.
+    """
+    if source.is_dir():
+        for child in source.iterdir():
+            _move(child, target / child.name, replace)
+        shutil.rmtree(source, ignore_errors=True)
+        return
+    if source.name.endswith(".moving"):
+        source.unlink(missing_ok=True)
+        return
+    if replace or not target.exists():
+        target.parent.mkdir(parents=True, exist_ok=True)
+        staging = target.with_name(target.name + ".moving")
+        shutil.copy2(source, staging)
+        os.replace(staging, target)
+    source.unlink()
+
+
+class S3Storage(LocalStorage):
+    """
+    Storage in an S3-compatible bucket, with MEDIA_ROOT as local scratch.
+    The cold tier is a cheaper storage class on the same keys, so reads
+    never need a recall.
+    """
+
+    local = False
+    tiering = True
+
+    def __init__(self, root: PathLike = MEDIA_ROOT, bucket: str = S3_BUCKET):
+        super().__init__(root, archive_root=None)
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+        except ImportError as e:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires boto3") from e
+
+        self.bucket = bucket
+        # Credentials come from the usual AWS_ACCESS_KEY_ID /
+        # AWS_SECRET_ACCESS_KEY environment (or instance role)
+        self.client = boto3.client("s3", endpoint_url=S3_ENDPOINT_URL, region_name=S3_REGION)
+        self.transfer_config = TransferConfig(
+            multipart_threshold=S3_MULTIPART_THRESHOLD_MB * 1024 * 1024,
+            multipart_chunksize=S3_MULTIPART_THRESHOLD_MB * 1024 * 1024,
+            max_concurrency=S3_UPLOAD_CONCURRENCY,
+        )
+
+    def _objects(self, key: str) -> List[dict]:
+        """Objects stored at key itself or under key/."""
+        objects = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=key):
+            for obj in page.get("Contents", []):
+                if obj["Key"] == key or obj["Key"].startswith(key + "/"):
+                    objects.append(obj)
+        return objects
+
+    def _upload(self, path: Path):
+        self.client.upload_file(
+            str(path),
+            self.bucket,
+            self.key(path),
+            ExtraArgs={"ContentType": content_type(path)},
+            Config=self.transfer_config,
+        )
+
+    def save(self, path: PathLike):
+        path = Path(path)
+        if path.is_dir():
+            self.save_all([f for f in path.rglob("*") if f.is_file() and not f.name.endswith(".tmp")])
+        else:
+            self._upload(path)
+
+    def save_all(self, paths: List[PathLike]):
+        paths = [Path(p) for p in paths]
+        # Playlists go last, so a complete playlist in the bucket implies
+        # every segment it lists is there too
+        segments = [p for p in paths if p.suffix != ".m3u8"]
+        playlists = [p for p in paths if p.suffix == ".m3u8"]
+        with ThreadPoolExecutor(max_workers=S3_UPLOAD_CONCURRENCY) as pool:
+            list(pool.map(self._upload, segments))
+            list(pool.map(self._upload, playlists))
+
+    def release(self, path: PathLike):
+        super().delete(path)
+
+    def load(self, path: PathLike) -> bool:
+        path = Path(path)
+        if path.is_file():
+            return True
+        objects = self._objects(self.key(path))
+        for obj in objects:
+            target = self.root / obj["Key"]
+            if target.is_file():
+                continue
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = target.with_name(target.name + ".tmp")
+            self.client.download_file(self.bucket, obj["Key"], str(tmp_path), Config=self.transfer_config)
+            os.replace(tmp_path, target)
+        return bool(objects)
+
+    def _set_storage_class(self, path: PathLike, storage_class: str) -> bool:
+        # In-place copy with the new class; objects listed without one are STANDARD
+        objects = [
+            obj for obj in self._objects(self.key(path))
+            if obj.get("StorageClass", "STANDARD") != storage_class
+        ]
+        with ThreadPoolExecutor(max_workers=S3_UPLOAD_CONCURRENCY) as pool:
+            list(pool.map(
+                lambda obj: self.client.copy(
+                    {"Bucket": self.bucket, "Key": obj["Key"]},
+                    self.bucket,
+                    obj["Key"],
+                    ExtraArgs={"StorageClass": storage_class, "MetadataDirective": "COPY"},
+                    Config=self.transfer_config,
+                ),
+                objects,
+            ))
+        return bool(objects)
+
+    def is_archived(self, path: PathLike) -> bool:
+        objects = self._objects(self.key(path))
+        return any(obj.get("StorageClass", "STANDARD") == S3_ARCHIVE_STORAGE_CLASS for obj in objects)
+
+    def archive(self, path: PathLike) -> bool:
+        archived = self._set_storage_class(path, S3_ARCHIVE_STORAGE_CLASS)
+        super().delete(path)
+        return archived
+
+    def recall(self, path: PathLike) -> bool:
+        return self._set_storage_class(path, "STANDARD")
+
+    def delete(self, path: PathLike):
+        keys = [{"Key": obj["Key"]} for obj in self._objects(self.key(path))]
+        for start in range(0, len(keys), 1000):
+            self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": keys[start:start + 1000]})
+        super().delete(path)
+
+    def copy(self, source: PathLike, target: PathLike):
+        source_key, target_key = self.key(source), self.key(target)
+        objects = self._objects(source_key)
+        if not objects:
+            raise FileNotFoundError(source_key)
+        # Server-side copies; nothing passes through this node
+        with ThreadPoolExecutor(max_workers=S3_UPLOAD_CONCURRENCY) as pool:
+            list(pool.map(
+                lambda obj: self.client.copy(
+                    {"Bucket": self.bucket, "Key": obj["Key"]},
+                    self.bucket,
+                    target_key + obj["Key"][len(source_key):],
+                    Config=self.transfer_config,
+                ),
+                objects,
+            ))
+
+    def read_text(self, path: PathLike) -> Optional[str]:
+        # Always from the bucket: playlists and bundles are rewritten in
+        # place, so a locally cached copy may be stale
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.key(path))
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return response["Body"].read().decode()
+
+    def size(self, path: PathLike) -> int:
+        return sum(obj["Size"] for obj in self._objects(self.key(path)))
+
+    def list(self, directory: PathLike, prefix: str = "") -> List[Path]:
+        key = f"{self.key(directory)}/{prefix}"
+        paginator = self.client.get_paginator("list_objects_v2")
+        return sorted(
+            self.root / obj["Key"]
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=key, Delimiter="/")
+            for obj in page.get("Contents", [])
+        )
+
+    def children(self, directory: PathLike) -> List[str]:
+        key = f"{self.key(directory)}/"
+        names = set()
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=key, Delimiter="/"):
+            names.update(obj["Key"][len(key):] for obj in page.get("Contents", []))
+            names.update(p["Prefix"][len(key):].rstrip("/") for p in page.get("CommonPrefixes", []))
+        return sorted(names)
+
+
+@lru_cache(maxsize=1)
+def get_storage() -> LocalStorage:
+    """The configured storage backend (STORAGE_BACKEND=local|s3)."""
+    if STORAGE_BACKEND == "s3":
+        logger.info("Media storage: s3://%s (%s)", S3_BUCKET, S3_ENDPOINT_URL or "AWS")
+        return S3Storage()
+    if STORAGE_BACKEND != "local":
+        raise RuntimeError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}")
+    return LocalStorage()
@@ -7,6 +7,7 @@ import re
 from datetime import datetime, timedelta
 from typing import Optional
 from pathlib import Path
+from urllib.parse import urlsplit
 from sqlalchemy.orm import Session
 from sqlalchemy import func, tuple_
 from ..models import BandwidthLog, BandwidthStats, Media
@@ -25,13 +26,25 @@ LOG_PATTERN = re.compile(
     r'(?P<request_time>[^\|]+)'
 )
 
-# Extract media ID from URI: /media/hls/{media_id}/...
-MEDIA_ID_PATTERN = re.compile(r'/media/hls/([^/]+)/')
+# Extract media ID from the URI path: /media/hls/{media_id}/...
+MEDIA_ID_PATTERN = re.compile(r'^/media/hls/([^/]+)/')
+
+# HLS payload requests: MPEG-TS segments, or fMP4 (CMAF) segments and
+# their init segments. Single-file renditions (HLS_SINGLE_FILE) are one
+# media.ts / media.m4s per rendition fetched in byte ranges; each range
+# request is a 206 whose $body_bytes_sent is just that range, so it is
+# counted like a segment.
+SEGMENT_EXTENSIONS = ('.ts', '.m4s', '.mp4')
+
+
+def request_path(uri: str) -> str:
+    """$request_uri without its query string (e.g. cache-busting ?v=)."""
+    return urlsplit(uri).path
 
 
 def extract_media_id(uri: str) -> Optional[str]:
     """Extract media ID from request URI"""
-    match = MEDIA_ID_PATTERN.search(uri)
+    match = MEDIA_ID_PATTERN.search(request_path(uri))
     return match.group(1) if match else None
 
 
@@ -44,8 +57,9 @@ def parse_log_line(line: str) -> Optional[dict]:
     try:
         data = match.groupdict()
 
-        # Only track HLS segment requests (.ts files)
-        if not data['uri'].endswith('.ts'):
+        # Only track HLS segment requests
+        path = request_path(data['uri'])
+        if not path.endswith(SEGMENT_EXTENSIONS) or not MEDIA_ID_PATTERN.search(path):
             return None
 
         # Parse timestamp
@@ -0,0 +1,256 @@
+"""
+HLS media playlist helpers for checkpointed encodes.
+
+A rendition (or a chunk of one) counts as finished only when its playlist
+carries #EXT-X-ENDLIST and every segment it lists is on disk. ffmpeg
+writes a VOD playlist once, at the end of the encode, so a worker killed
+mid-encode leaves either no playlist or segments without one.
+
+Segments are either files of their own or, for single-file renditions
+(hls_flags single_file), byte ranges of one media file per rendition
+(#EXT-X-BYTERANGE, and a BYTERANGE on the fMP4 init's EXT-X-MAP).
+Byte ranges are kept as (length, offset).
+"""
+
+import json
+import math
+import os
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+
+ENDLIST = "#EXT-X-ENDLIST"
+STARTUP_BUNDLE = "startup.json"
+
+ByteRange = Tuple[int, int]
+
+
+class Segment(NamedTuple):
+    duration: float
+    uri: str
+    init_uri: Optional[str] = None  # EXT-X-MAP in effect (fMP4), None for MPEG-TS
+    byterange: Optional[ByteRange] = None
+    init_byterange: Optional[ByteRange] = None
+
+
+def parse_byterange(value: str, next_offset: int = 0) -> ByteRange:
+    """"length[@offset]"; without an offset the range follows the previous one."""
+    length, _, offset = value.partition("@")
+    return int(length), int(offset) if offset else next_offset
+
+
+def format_byterange(byterange: ByteRange) -> str:
+    return f"{byterange[0]}@{byterange[1]}"
+
+
+def range_header(byterange: Optional[ByteRange]) -> Optional[str]:
+    """HTTP Range header value for a byte range (None for a whole file)."""
+    if byterange is None:
+        return None
+    length, offset = byterange
+    return f"bytes={offset}-{offset + length - 1}"
+
+
+def _map_attributes(line: str) -> Tuple[str, Optional[ByteRange]]:
+    """URI and BYTERANGE of an #EXT-X-MAP tag."""
+    uri = line.split('URI="', 1)[1].split('"', 1)[0]
+    byterange = None
+    if 'BYTERANGE="' in line:
+        byterange = parse_byterange(line.split('BYTERANGE="', 1)[1].split('"', 1)[0])
+    return uri, byterange
+
+
+def parse_segments(text: str) -> List[Segment]:
+    """Every segment a media playlist lists, in order."""
+    segments = []
+    duration = 0.0
+    init_uri = init_byterange = byterange = None
+    next_offsets = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXTINF:"):
+            duration = float(line[len("#EXTINF:"):].split(",")[0])
+        elif line.startswith("#EXT-X-MAP:"):
+            init_uri, init_byterange = _map_attributes(line)
+        elif line.startswith("#EXT-X-BYTERANGE:"):
+            byterange = line[len("#EXT-X-BYTERANGE:"):]
+        elif line and not line.startswith("#"):
+            if byterange is not None:
+                byterange = parse_byterange(byterange, next_offsets.get(line, 0))
+                next_offsets[line] = byterange[1] + byterange[0]
+            segments.append(Segment(duration, line, init_uri, byterange, init_byterange))
+            duration = 0.0
+            byterange = None
+    return segments
+
+
+def read_segments(playlist_path: Path, check_files: bool = True) -> Optional[List[Segment]]:
+    """
+    Segments of a complete playlist, else None. check_files=False trusts
+    the playlist without looking for its segments on disk (object storage
+    uploads playlists after their segments).
+    """
+    try:
+        text = Path(playlist_path).read_text()
+    except OSError:
+        return None
+    if ENDLIST not in text:
+        return None
+
+    segments = parse_segments(text)
+    parent = Path(playlist_path).parent
+    files = {s.uri for s in segments} | {s.init_uri for s in segments if s.init_uri}
+    if not segments:
+        return None
+    if check_files and not all((parent / uri).exists() for uri in files):
+        return None
+    return segments
+
+
+def playlist_complete(playlist_path: Path, check_files: bool = True) -> bool:
+    return read_segments(playlist_path, check_files) is not None
+
+
+def write_playlist(playlist_path: Path, segments: List[Segment]):
+    """Write a VOD media playlist via rename, so it is never seen half-written."""
+    fmp4 = any(s.init_uri for s in segments)
+    if fmp4:
+        # EXT-X-MAP needs version 6; ffmpeg writes 7 for fMP4
+        version = 7
+    else:
+        # EXT-X-BYTERANGE needs version 4
+        version = 4 if any(s.byterange for s in segments) else 3
+    lines = [
+        "#EXTM3U",
+        f"#EXT-X-VERSION:{version}",
+        f"#EXT-X-TARGETDURATION:{max(math.ceil(s.duration) for s in segments)}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+        "#EXT-X-INDEPENDENT-SEGMENTS",
+    ]
+    current_init = None
+    for segment in segments:
+        # Stitched fMP4 parts each carry their own init segment
+        init = (segment.init_uri, segment.init_byterange)
+        if segment.init_uri and init != current_init:
+            if segment.init_byterange:
+                lines.append(
+                    f'#EXT-X-MAP:URI="{segment.init_uri}",BYTERANGE="{format_byterange(segment.init_byterange)}"'
+                )
+            else:
+                lines.append(f'#EXT-X-MAP:URI="{segment.init_uri}"')
+            current_init = init
+        lines.append(f"#EXTINF:{segment.duration:.6f},")
+        if segment.byterange:
+            lines.append(f"#EXT-X-BYTERANGE:{format_byterange(segment.byterange)}")
+        lines.append(segment.uri)
+    lines.append(ENDLIST)
+
+    tmp_path = Path(playlist_path).with_suffix(".m3u8.tmp")
+    tmp_path.write_text("\n".join(lines) + "\n")
+    os.replace(tmp_path, playlist_path)
+
+
+def chunk_ranges(duration: float, chunk_seconds: int, segment_seconds: int) -> List[Tuple[float, Optional[float]]]:
+    """
+    Split a source into (start, length) chunks on segment boundaries.
+
+    Chunk starts are multiples of segment_seconds so every chunk opens on a
+    forced keyframe and the stitched playlist keeps uniform segments. The
+    last chunk has length None (encode to end of input) so it never drops
+    frames past the probed duration; a tail shorter than one segment is
+    folded into it rather than encoded on its own.
+    """
+    chunk = max(segment_seconds, chunk_seconds // segment_seconds * segment_seconds)
+    starts = [0.0]
+    while duration - (starts[-1] + chunk) >= segment_seconds:
+        starts.append(starts[-1] + chunk)
+    return [(start, chunk) for start in starts[:-1]] + [(starts[-1], None)]
+
+
+def playlist_is_fmp4(playlist_path: Path) -> bool:
+    """Whether a rendition is fMP4 (CMAF): its playlist maps an init
+    segment with #EXT-X-MAP. False if the playlist is missing."""
+    try:
+        return "#EXT-X-MAP:" in Path(playlist_path).read_text()
+    except OSError:
+        return False
+
+
+def first_segment(playlist_path: Path) -> List[Tuple[str, Optional[ByteRange]]]:
+    """
+    (uri, byte range) of what a player fetches before the first frame: the
+    EXT-X-MAP init segment (fMP4 only) and the first media segment. The
+    byte range is None for whole files. Empty if the playlist is missing
+    or lists no segments.
+    """
+    try:
+        text = Path(playlist_path).read_text()
+    except OSError:
+        return []
+    return parse_first_segment(text)
+
+
+def parse_first_segment(text: str) -> List[Tuple[str, Optional[ByteRange]]]:
+    segments = parse_segments(text)
+    if not segments:
+        return []
+    first = segments[0]
+    if first.init_uri:
+        return [(first.init_uri, first.init_byterange), (first.uri, first.byterange)]
+    return [(first.uri, first.byterange)]
+
+
+def variant_first_segments(variants, media_root: Path, read_text) -> List[Tuple[str, Optional[str]]]:
+    """
+    (url, Range header or None) of the first segment (plus fMP4 init
+    segment) of each variant playlist served from /media/, so a client can
+    warm the HLS cache before playback starts. read_text(path) returns a
+    playlist's text or None (Storage.read_text).
+    """
+    segments = []
+    for v in variants:
+        if not v.path or not v.path.startswith("/media/"):
+            continue
+        base = v.path.rsplit("/", 1)[0]
+        playlist = read_text(Path(media_root) / v.path[len("/media/"):])
+        segments.extend(
+            (f"{base}/{uri}", range_header(byterange))
+            for uri, byterange in parse_first_segment(playlist or "")
+        )
+    return segments
+
+
+def write_startup_bundle(hls_dir: Path, url_base: str, renditions: List[str]):
+    """
+    Record everything a player fetches before the first frame of a media
+    item: the master playlist, the playlists of the renditions it starts on
+    and their first segments. Clients fetch these in parallel (or from
+    cache) instead of walking master -> playlist -> segment one by one.
+    ranges lines up with segments: the Range header to send for each, or
+    None for a whole file.
+    """
+    hls_dir = Path(hls_dir)
+    playlists = []
+    segments = []
+    ranges = []
+    size = 0
+    for name in renditions:
+        parts = first_segment(hls_dir / name / "playlist.m3u8")
+        if not parts:
+            return
+        playlists.append(f"{url_base}/{name}/playlist.m3u8")
+        for uri, byterange in parts:
+            segments.append(f"{url_base}/{name}/{uri}")
+            ranges.append(range_header(byterange))
+            size += byterange[0] if byterange else (hls_dir / name / uri).stat().st_size
+
+    bundle = {
+        "master": f"{url_base}/master.m3u8",
+        "playlists": playlists,
+        "segments": segments,
+        "ranges": ranges,
+        "bytes": size,
+    }
+    tmp_path = hls_dir / (STARTUP_BUNDLE + ".tmp")
+    tmp_path.write_text(json.dumps(bundle))
+    os.replace(tmp_path, hls_dir / STARTUP_BUNDLE)
@@ -0,0 +1,107 @@
+"""
+Timing and throughput instrumentation for the media processing pipeline.
+
+StageTimer records wall time (and optionally bytes produced) for each
+stage of one process_media run; the result is stored on a ProcessingRun
+row and mirrored into Prometheus histograms.
+
+Prefork workers each write their samples to PROMETHEUS_MULTIPROC_DIR and
+the main worker process serves the aggregate on WORKER_METRICS_PORT.
+"""
+
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import List, Optional
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, multiprocess, start_http_server
+
+logger = logging.getLogger(__name__)
+
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9101"))
+
+STAGE_SECONDS = Histogram(
+    "onplay_worker_stage_seconds",
+    "Wall time of one processing stage",
+    ["media_type", "stage", "variant"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600),
+)
+STAGE_REALTIME_FACTOR = Histogram(
+    "onplay_worker_realtime_factor",
+    "Encode seconds per second of media (lower is faster)",
+    ["media_type", "variant"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8),
+)
+VARIANT_BYTES = Counter(
+    "onplay_worker_output_bytes_total",
+    "Bytes written per rendition",
+    ["media_type", "variant"],
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "onplay_worker_queue_wait_seconds",
+    "Time between enqueue and a worker starting the task",
+    ["task"],
+    buckets=(0.1, 1, 5, 15, 60, 300, 900, 1800, 3600, 7200),
+)
+RUNS = Counter(
+    "onplay_worker_processing_runs_total",
+    "Completed process_media runs",
+    ["media_type", "status"],
+)
+
+
+class StageTimer:
+    """Collects per-stage timings for one processing run."""
+
+    def __init__(self, media_type: str, media_duration: Optional[float] = None):
+        self.media_type = media_type
+        self.media_duration = media_duration
+        self.stages: List[dict] = []
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str, variant: Optional[str] = None):
+        """Time a block; set record["bytes"] inside it to account output size."""
+        record = {"stage": name, "variant": variant}
+        started = time.perf_counter()
+        try:
+            yield record
+        except Exception:
+            record["failed"] = True
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            record["seconds"] = round(seconds, 3)
+            if name == "encode" and self.media_duration:
+                record["realtime_factor"] = round(seconds / self.media_duration, 4)
+                STAGE_REALTIME_FACTOR.labels(self.media_type, variant or "").observe(
+                    record["realtime_factor"]
+                )
+            if record.get("bytes"):
+                VARIANT_BYTES.labels(self.media_type, variant or "").inc(record["bytes"])
+            STAGE_SECONDS.labels(self.media_type, name, variant or "").observe(seconds)
+            self.stages.append(record)
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+    @property
+    def encode_seconds(self) -> float:
+        return sum(s["seconds"] for s in self.stages if s["stage"] == "encode")
+
+    @property
+    def output_bytes(self) -> int:
+        return sum(s.get("bytes") or 0 for s in self.stages)
+
+
+def serve_worker_metrics():
+    """Expose aggregated worker metrics; call once in the main worker process."""
+    if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        logger.info("PROMETHEUS_MULTIPROC_DIR not set; worker metrics not exported")
+        return
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    start_http_server(WORKER_METRICS_PORT, registry=registry)
+    logger.info("Worker metrics on :%d/metrics", WORKER_METRICS_PORT)
@@ -1,233 +1,1394 @@
-from ..celery_app import celery_app
+from ..celery_app import QUEUE_TRANSCODE_HEAVY, QUEUE_TRANSCODE_LIGHT, celery_app
 from ..database import SessionLocal
-from ..models import Media, MediaVariant, MediaStatus, MediaType
+from ..models import Analytics, BandwidthStats, Media, MediaVariant, MediaStatus, MediaType, ProcessingRun
+from ..realtime import media_client_id, publish
+from ..storage import get_storage
+from .hls import (
+    STARTUP_BUNDLE,
+    chunk_ranges,
+    first_segment,
+    playlist_complete,
+    playlist_is_fmp4,
+    read_segments,
+    variant_first_segments,
+    write_playlist,
+    write_startup_bundle,
+)
+from .instrumentation import QUEUE_WAIT_SECONDS, RUNS, StageTimer
+from celery import chord
+from celery.exceptions import SoftTimeLimitExceeded
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from sqlalchemy import func, or_
+from sqlalchemy.exc import OperationalError
 import ffmpeg
+import json
 import os
 import redis
+import threading
+import time
 from pathlib import Path
 from PIL import Image
 import mutagen
 
 MEDIA_ROOT = os.getenv("MEDIA_ROOT", "/media")
-
-# Shared Redis connection for cross-worker state.
+# Videos up to this long are cheap enough for the light transcode queue
+TRANSCODE_LIGHT_MAX_SECONDS = float(os.getenv("TRANSCODE_LIGHT_MAX_SECONDS", "120"))
+
+HLS_TIME = 4  # seconds per segment
+# Sources longer than this are encoded per rung in chunks of this length,
+# each a checkpoint a retried task resumes from (rounded to HLS_TIME)
+CHECKPOINT_CHUNK_SECONDS = int(os.getenv("CHECKPOINT_CHUNK_SECONDS", "600"))
+# "mpegts" muxes audio into every video rung; "fmp4" writes CMAF segments
+# with video-only rungs sharing one audio rendition (EXT-X-MEDIA)
+HLS_SEGMENT_TYPE = os.getenv("HLS_SEGMENT_TYPE", "mpegts")
+# One media file per rendition (per chunk for chunked encodes) with segments
+# addressed by EXT-X-BYTERANGE, instead of a file per HLS_TIME segment.
+# Applies to new encodes; existing renditions keep their layout
+HLS_SINGLE_FILE = os.getenv("HLS_SINGLE_FILE", "false").lower() in ("1", "true", "yes")
+# Optional modern-codec ladder: "hevc" or "av1" (empty disables). With
+# MODERN_CODEC_MIN_PLAYS 0 it is encoded at ingest, otherwise like a lazy
+# rung once a video has that many plays (schedule_popular_encodes)
+MODERN_CODEC = os.getenv("MODERN_CODEC", "").lower()
+MODERN_CODEC_MIN_PLAYS = int(os.getenv("MODERN_CODEC_MIN_PLAYS", "0"))
+# Lazy ladder, e.g. "1080p:20,720p:5": those rungs are skipped at ingest
+# and encoded once a media item has that many plays within
+# POPULARITY_WINDOW_DAYS (schedule_popular_encodes). Deferred rungs with
+# no play for COLD_RENDITION_DAYS are deleted again. Empty encodes the
+# full ladder at ingest.
+LAZY_RUNG_THRESHOLDS = {
+    name.strip(): int(plays)
+    for name, _, plays in (item.partition(":") for item in os.getenv("LAZY_RUNG_THRESHOLDS", "").split(","))
+    if name.strip()
+}
+POPULARITY_WINDOW_DAYS = int(os.getenv("POPULARITY_WINDOW_DAYS", "7"))
+COLD_RENDITION_DAYS = int(os.getenv("COLD_RENDITION_DAYS", "30"))
+# Storage tiering (tier_media_storage; needs ARCHIVE_ROOT or s3): originals
+# and HLS trees of items neither uploaded nor played for this many days move
+# to the cold tier, and renditions come back once played again (0 disables)
+ORIGINAL_HOT_DAYS = int(os.getenv("ORIGINAL_HOT_DAYS", "7"))
+RENDITION_HOT_DAYS = int(os.getenv("RENDITION_HOT_DAYS", "60"))
+# Storage reconciliation (reconcile_media_storage): at most this many orphaned
+# files or trees are removed per run, and with RECONCILE_DELETE_ORPHANS off
+# they are only reported
+RECONCILE_BATCH_SIZE = int(os.getenv("RECONCILE_BATCH_SIZE", "100"))
+RECONCILE_DELETE_ORPHANS = os.getenv("RECONCILE_DELETE_ORPHANS", "true").lower() in ("1", "true", "yes")
+# Sources at least this long are encoded as chunks in parallel across
+# workers instead of rung by rung in one task (0 disables)
+PARALLEL_MIN_SECONDS = int(os.getenv("PARALLEL_MIN_SECONDS", "1200"))
+# Attempts per process_media task, counting worker crashes as well as retries
+PROCESS_MAX_ATTEMPTS = int(os.getenv("PROCESS_MAX_ATTEMPTS", "5"))
+# Below celery_app's task_time_limit so the task can record a retry and
+# resume from its checkpoints rather than being killed outright
+PROCESS_SOFT_TIME_LIMIT = int(os.getenv("PROCESS_SOFT_TIME_LIMIT", "3300"))
+# Errors that say nothing about the media itself; everything else fails the job
+RETRYABLE_ERRORS = (OperationalError, SoftTimeLimitExceeded)
+
+# Shared Redis connection for cross-worker state, created on first use.
 # Bandwidth tracking uses this to persist the nginx log file offset between
 # task runs — the previous module-level global was per-process, causing every
 # worker to re-parse the entire log from byte 0 when it picked up the task.
-_redis_client = redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+@lru_cache(maxsize=1)
+def _redis() -> redis.Redis:
+    return redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+
 _BANDWIDTH_POSITION_KEY = "onplay:bandwidth:last_position"
+_RECONCILE_ORPHANS_KEY = "onplay:reconcile:orphans"
+
+
+def report_progress(media_id: str, **fields):
+    """Push a processing update to the media's WebSocket subscribers."""
+    publish(media_client_id(media_id), {"type": "processing", "media_id": media_id, **fields})
+
+
+def run_ffmpeg(stream, duration: float = None, on_progress=None):
+    """
+    Run an ffmpeg graph, calling on_progress(fraction) as it encodes.
+
+    Progress comes from ffmpeg's machine-readable `-progress pipe:1` output
+    (key=value blocks roughly every 0.5s); out_time_us against the source
+    duration gives the fraction done. stderr is drained on a thread so a
+    chatty encode can't fill the pipe and deadlock, and is attached to the
+    ffmpeg.Error on failure just like ffmpeg.run(capture_stderr=True).
+
+    Returns the ffmpeg process's resource usage (CPU time, peak RSS), reaped
+    with wait4 so it covers exactly this encode.
+    """
+    process = ffmpeg.run_async(
+        stream.global_args('-progress', 'pipe:1', '-nostats'),
+        pipe_stdout=True,
+        pipe_stderr=True,
+        overwrite_output=True,
+    )
+    stderr = []
+    drain = threading.Thread(target=lambda: stderr.append(process.stderr.read()), daemon=True)
+    drain.start()
+
+    last_reported = -1
+    try:
+        for raw_line in process.stdout:
+            key, _, value = raw_line.decode(errors='replace').strip().partition('=')
+            if key != 'out_time_us' or not duration or not on_progress:
+                continue
+            try:
+                fraction = min(max(int(value) / 1_000_000 / duration, 0.0), 1.0)
+            except ValueError:
+                continue  # "N/A" before the first frame is muxed
+            # Whole-percent granularity keeps pub/sub traffic proportional to
+            # progress rather than to ffmpeg's report rate
+            if int(fraction * 100) != last_reported:
+                last_reported = int(fraction * 100)
+                on_progress(fraction)
+    except BaseException:
+        # Soft time limit or shutdown: don't leave an orphan encode running
+        process.kill()
+        os.waitpid(process.pid, 0)
+        raise
+
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    drain.join()
+    if process.returncode != 0:
+        raise ffmpeg.Error('ffmpeg', b'', b''.join(stderr))
+    return usage
+
+
+def _variant_progress(media_id: str, index: int, count: int, name: str):
+    """on_progress callback mapping one rung's fraction onto the whole job."""
+    def on_progress(fraction: float):
+        report_progress(
+            media_id,
+            stage="transcode",
+            variant=name,
+            variant_progress=round(fraction, 3),
+            progress=round((index + fraction) / count, 3),
+        )
+    return on_progress
+
+def extract_metadata(media: Media, original_path: str, db):
+    """Probe the original and store dimensions, codec, duration and bitrate."""
+    try:
+        probe = ffmpeg.probe(original_path)
+        video_stream = next((s for s in probe['streams'] if s['codec_type'] == 'video'), None)
+
+        if video_stream:
+            media.width = int(video_stream.get('width', 0))
+            media.height = int(video_stream.get('height', 0))
+            media.codec = video_stream.get('codec_name')
+
+        if 'format' in probe:
+            media.duration = float(probe['format'].get('duration', 0))
+            media.bitrate = int(probe['format'].get('bit_rate', 0))
+
+        db.commit()
+    except Exception as e:
+        print(f"Metadata extraction failed: {e}")
+
+def transcode_route(media: Media):
+    """
+    (queue, priority) for a media's transcode, from its probed metadata.
+
+    Audio and short videos go to the light queue so they are not stuck
+    behind hour-long encodes; within a queue shorter media get a higher
+    priority (0 is highest on the Redis broker).
+    """
+    duration = media.duration or 0
+    if media.media_type == MediaType.AUDIO:
+        return QUEUE_TRANSCODE_LIGHT, min(int(duration // 300), 4)
+    if duration and duration <= TRANSCODE_LIGHT_MAX_SECONDS:
+        return QUEUE_TRANSCODE_LIGHT, 5
+    # Unknown duration (probe failed) is treated as the most expensive
+    return QUEUE_TRANSCODE_HEAVY, min(int(duration // 600), 9) if duration else 9
+
+@celery_app.task(bind=True, name="app.worker.tasks.probe_media")
+def probe_media(self, media_id: str, original_path: str):
+    """Extract metadata, then queue the transcode by its expected cost."""
+    db = SessionLocal()
+    try:
+        media = db.query(Media).filter(Media.id == media_id).first()
+        if not media:
+            raise Exception(f"Media {media_id} not found")
+
+        get_storage().load(original_path)
+        extract_metadata(media, original_path, db)
+        queue, priority = transcode_route(media)
+        process_media.apply_async((media_id, original_path), queue=queue, priority=priority)
+        report_progress(media_id, stage="queued", progress=0.0, queue=queue)
+
+        return {"status": "queued", "media_id": media_id, "queue": queue, "priority": priority}
+    finally:
+        db.close()
 
-@celery_app.task(bind=True, name="app.worker.tasks.process_media")
+@celery_app.task(
+    bind=True,
+    name="app.worker.tasks.process_media",
+    # Ack only once the task finishes, and requeue if the worker process
+    # dies (OOM, max_tasks_per_child recycle, deploy): the next attempt
+    # resumes from the last finished rung/chunk instead of starting over.
+    acks_late=True,
+    reject_on_worker_lost=True,
+    soft_time_limit=PROCESS_SOFT_TIME_LIMIT,
+    max_retries=PROCESS_MAX_ATTEMPTS,
+)
 def process_media(self, media_id: str, original_path: str):
     db = SessionLocal()
+    run = None
+    timer = None
     try:
         media = db.query(Media).filter(Media.id == media_id).first()
         if not media:
             raise Exception(f"Media {media_id} not found")
 
-        # Extract metadata
-        try:
-            probe = ffmpeg.probe(original_path)
-            video_stream = next((s for s in probe['streams'] if s['codec_type'] == 'video'), None)
-            audio_stream = next((s for s in probe['streams'] if s['codec_type'] == 'audio'), None)
+        # Redeliveries after a lost worker keep the task id but never reach
+        # the retry counter, so attempts are counted from recorded runs.
+        # Runs still marked running belong to attempts that died.
+        attempts = db.query(ProcessingRun).filter(ProcessingRun.task_id == self.request.id).all()
+        for previous in attempts:
+            if previous.status == "running":
+                previous.status = "interrupted"
+        if len(attempts) >= PROCESS_MAX_ATTEMPTS:
+            media.status = MediaStatus.FAILED
+            media.error_message = f"Gave up after {len(attempts)} attempts"
+            db.commit()
+            report_progress(media_id, stage="done", status=MediaStatus.FAILED.value, error=media.error_message)
+            return {"status": "failed", "media_id": media_id}
+
+        # enqueued_at is stamped on the message by the before_task_publish
+        # hook in celery_app
+        enqueued_at = getattr(self.request, "enqueued_at", None)
+        queue_wait = max(time.time() - enqueued_at, 0.0) if enqueued_at else None
+        if queue_wait is not None:
+            QUEUE_WAIT_SECONDS.labels("process_media").observe(queue_wait)
+
+        run = ProcessingRun(
+            media_id=media_id,
+            task_id=self.request.id,
+            worker=self.request.hostname,
+            queued_at=datetime.fromtimestamp(enqueued_at, timezone.utc) if enqueued_at else None,
+            queue_wait_seconds=queue_wait,
+        )
+        db.add(run)
+        media.status = MediaStatus.PROCESSING
+        db.commit()
+
+        timer = StageTimer(media.media_type.value)
 
-            if video_stream:
-                media.width = int(video_stream.get('width', 0))
-                media.height = int(video_stream.get('height', 0))
-                media.codec = video_stream.get('codec_name')
+        # Workers share no disk with the API on object storage
+        with timer.stage("fetch"):
+            get_storage().load(original_path)
 
-            if 'format' in probe:
-                media.duration = float(probe['format'].get('duration', 0))
-                media.bitrate = int(probe['format'].get('bit_rate', 0))
+        # Metadata is normally extracted by probe_media before routing;
+        # probe here only for jobs queued directly
+        with timer.stage("probe"):
+            if media.duration is None:
+                extract_metadata(media, original_path, db)
 
+        timer.media_duration = media.duration
+        report_progress(media_id, stage="probe", progress=0.0)
+
+        # Long sources are split across workers; assemble_media finishes
+        # the run once every chunk is encoded
+        if PARALLEL_MIN_SECONDS and media.duration and media.duration >= PARALLEL_MIN_SECONDS:
+            run.status = "dispatched"
+            run.stages = timer.stages
             db.commit()
-        except Exception as e:
-            print(f"Metadata extraction failed: {e}")
+            chunk_tasks = dispatch_chunks(media, original_path, run.id, db)
+            return {"status": "dispatched", "media_id": media_id, "chunks": chunk_tasks}
 
         # Process based on media type
         if media.media_type == MediaType.VIDEO:
-            process_video(media_id, original_path, db)
+            process_video(media_id, original_path, db, timer)
         elif media.media_type == MediaType.AUDIO:
-            process_audio(media_id, original_path, db)
+            process_audio(media_id, original_path, db, timer)
 
         # Update status to ready
         media.status = MediaStatus.READY
+        _finish_run(run, timer, "success")
         db.commit()
+        report_progress(media_id, stage="done", status=MediaStatus.READY.value, progress=1.0)
+        release_outputs(media_id, original_path)
 
         return {"status": "success", "media_id": media_id}
 
     except Exception as e:
+        db.rollback()
+        retry = isinstance(e, RETRYABLE_ERRORS) and self.request.retries < self.max_retries
+        if run is not None and timer is not None:
+            _finish_run(run, timer, "retrying" if retry else "failed")
+        if retry:
+            db.commit()
+            # Soft time limit: checkpoints are on disk, carry on right away.
+            # Anything else is infrastructure (database), so back off.
+            countdown = 0 if isinstance(e, SoftTimeLimitExceeded) else 30 * 2 ** self.request.retries
+            raise self.retry(exc=e, countdown=countdown)
+
         # Update status to failed
         media = db.query(Media).filter(Media.id == media_id).first()
         if media:
             media.status = MediaStatus.FAILED
             media.error_message = str(e)
-            db.commit()
+        db.commit()
+        report_progress(media_id, stage="done", status=MediaStatus.FAILED.value, error=str(e))
         raise e
     finally:
         db.close()
 
-def process_video(media_id: str, input_path: str, db):
-    """Process video into multiple HLS variants"""
-    media = db.query(Media).filter(Media.id == media_id).first()
-
-    hls_dir = Path(MEDIA_ROOT) / "hls" / media_id
-    hls_dir.mkdir(parents=True, exist_ok=True)
+def _finish_run(run: ProcessingRun, timer: StageTimer, status: str):
+    """Copy a run's timings onto its ProcessingRun row and count it."""
+    run.status = status
+    run.finished_at = datetime.now(timezone.utc)
+    run.processing_seconds = round(timer.elapsed, 3)
+    run.media_duration = timer.media_duration
+    if timer.media_duration:
+        run.realtime_factor = round(timer.encode_seconds / timer.media_duration, 4)
+    run.output_bytes = timer.output_bytes
+    run.stages = timer.stages
+    RUNS.labels(timer.media_type, status).inc()
+
+# Encoding ladders; video rungs above the source height are skipped.
+# "codecs" is the RFC 6381 string for the master playlist's CODECS
+# attribute, so it must match the profile/level the encoder is held to.
+# Levels are sized for 16:9 at up to MAX_FRAME_RATE (H.264 macroblocks
+# per second: 480p30 is past 3.0's 40500, 720p30 exactly 3.1's 108000).
+MAX_FRAME_RATE = 30
+VIDEO_VARIANTS = [
+    {"name": "1080p", "height": 1080, "video_bitrate": "5000k", "audio_bitrate": "192k",
+     "level": "4.0", "codecs": "avc1.640028,mp4a.40.2"},
+    {"name": "720p", "height": 720, "video_bitrate": "2800k", "audio_bitrate": "128k",
+     "level": "3.1", "codecs": "avc1.64001f,mp4a.40.2"},
+    {"name": "480p", "height": 480, "video_bitrate": "1400k", "audio_bitrate": "128k",
+     "level": "3.1", "codecs": "avc1.64001f,mp4a.40.2"},
+    {"name": "360p", "height": 360, "video_bitrate": "800k", "audio_bitrate": "96k",
+     "level": "3.0", "codecs": "avc1.64001e,mp4a.40.2"},
+]
+AUDIO_VARIANTS = [
+    {"name": "320kbps", "bitrate": "320k", "codecs": "mp4a.40.2"},
+    {"name": "128kbps", "bitrate": "128k", "codecs": "mp4a.40.2"},
+    {"name": "64kbps", "bitrate": "64k", "codecs": "mp4a.40.2"},
+]
+
+# CMAF mode: the one audio rendition every video rung shares
+SHARED_AUDIO_VARIANT = {"name": "audio", "bitrate": "128k", "fmp4": True}
+
+# Optional second video ladder in a more efficient codec, always fMP4 and
+# video-only, paired with an Opus audio rendition. Players choose between
+# ladders by the CODECS attribute. Roughly the H.264 quality at 55-60%
+# (HEVC) or 50% (AV1) of the bitrate.
+MODERN_VARIANTS = {
+    "hevc": [
+        {"name": "1080p-hevc", "height": 1080, "video_bitrate": "3000k", "codec": "hevc",
+         "level": "4.0", "codecs": "hvc1.1.6.L120.90,opus"},
+        {"name": "720p-hevc", "height": 720, "video_bitrate": "1600k", "codec": "hevc",
+         "level": "3.1", "codecs": "hvc1.1.6.L93.90,opus"},
+        {"name": "480p-hevc", "height": 480, "video_bitrate": "800k", "codec": "hevc",
+         "level": "3.0", "codecs": "hvc1.1.6.L90.90,opus"},
+        {"name": "360p-hevc", "height": 360, "video_bitrate": "450k", "codec": "hevc",
+         "level": "3.0", "codecs": "hvc1.1.6.L90.90,opus"},
+    ],
+    "av1": [
+        {"name": "1080p-av1", "height": 1080, "video_bitrate": "2500k", "codec": "av1",
+         "level": "4.0", "codecs": "av01.0.08M.08,opus"},
+        {"name": "720p-av1", "height": 720, "video_bitrate": "1400k", "codec": "av1",
+         "level": "3.1", "codecs": "av01.0.05M.08,opus"},
+        {"name": "480p-av1", "height": 480, "video_bitrate": "700k", "codec": "av1",
+         "level": "3.0", "codecs": "av01.0.04M.08,opus"},
+        {"name": "360p-av1", "height": 360, "video_bitrate": "400k", "codec": "av1",
+         "level": "3.0", "codecs": "av01.0.04M.08,opus"},
+    ],
+}
+OPUS_AUDIO_VARIANT = {"name": "audio-opus", "bitrate": "96k", "codec": "opus"}
+
+VARIANTS_BY_NAME = {
+    v["name"]: v
+    for v in VIDEO_VARIANTS + AUDIO_VARIANTS + [v for ladder in MODERN_VARIANTS.values() for v in ladder]
+}
+
+def cmaf_enabled() -> bool:
+    """Segment type for new media; existing renditions keep theirs (see media_fmp4)."""
+    return HLS_SEGMENT_TYPE == "fmp4"
+
+def is_fmp4(variant: dict) -> bool:
+    """
+    Segment type to encode a rendition in. Modern codecs are only allowed
+    in fMP4 segments; H.264/AAC rungs follow HLS_SEGMENT_TYPE unless the
+    variant carries "fmp4" (pinned to an existing media's layout).
+    """
+    return variant.get("codec") in ("hevc", "av1", "opus") or variant.get("fmp4", cmaf_enabled())
 
-    # Define quality variants
-    variants = [
-        {"name": "1080p", "height": 1080, "video_bitrate": "5000k", "audio_bitrate": "192k"},
-        {"name": "720p", "height": 720, "video_bitrate": "2800k", "audio_bitrate": "128k"},
-        {"name": "480p", "height": 480, "video_bitrate": "1400k", "audio_bitrate": "128k"},
-        {"name": "360p", "height": 360, "video_bitrate": "800k", "audio_bitrate": "96k"},
-    ]
+def rendition_is_fmp4(playlist_path: Path) -> bool:
+    """Whether a published rendition was written as fMP4, from its playlist."""
+    get_storage().load(playlist_path)
+    return playlist_is_fmp4(playlist_path)
 
+def media_fmp4(media: Media) -> bool:
+    """
+    Segment type of a media item's H.264/AAC rungs, read from what was
+    published (a shared audio rendition or any rung's playlist), so rungs
+    added later match the ladder even if HLS_SEGMENT_TYPE changed since.
+    HLS_SEGMENT_TYPE for media with nothing published yet.
+    """
+    hls_dir = Path(MEDIA_ROOT) / "hls" / media.id
+    if playlist_published(hls_dir / SHARED_AUDIO_VARIANT["name"] / "playlist.m3u8"):
+        return True
+    for variant in media_variants(media):
+        playlist_path = hls_dir / variant["name"] / "playlist.m3u8"
+        if playlist_published(playlist_path):
+            return playlist_is_fmp4(playlist_path)
+    return cmaf_enabled()
+
+def media_variants(media: Media) -> list:
+    """The rungs to encode for a media item."""
+    if media.media_type == MediaType.AUDIO:
+        return AUDIO_VARIANTS
     # Only create variants that are smaller or equal to original
     original_height = media.height or 1080
-    variants = [v for v in variants if v["height"] <= original_height]
+    return [v for v in VIDEO_VARIANTS if v["height"] <= original_height]
+
+def modern_variants(media: Media) -> list:
+    """The MODERN_CODEC ladder for a video, empty when disabled."""
+    if media.media_type != MediaType.VIDEO or MODERN_CODEC not in MODERN_VARIANTS:
+        return []
+    original_height = media.height or 1080
+    return [v for v in MODERN_VARIANTS[MODERN_CODEC] if v["height"] <= original_height]
+
+def modern_renditions(media: Media) -> list:
+    variants = modern_variants(media)
+    return variants + [OPUS_AUDIO_VARIANT] if variants else []
+
+def media_renditions(media: Media) -> list:
+    """
+    Everything to encode at ingest: the rungs not deferred by popularity
+    (see deferred_thresholds), for CMAF video the shared audio, and the
+    modern ladder unless it waits for MODERN_CODEC_MIN_PLAYS.
+    """
+    deferred = deferred_thresholds(media)
+    renditions = [v for v in media_variants(media) if v["name"] not in deferred]
+    if media.media_type == MediaType.VIDEO and cmaf_enabled():
+        renditions.append(SHARED_AUDIO_VARIANT)
+    if MODERN_CODEC_MIN_PLAYS <= 0:
+        renditions += modern_renditions(media)
+    return renditions
+
+def rendition_output(variant: dict):
+    return video_output(variant) if "height" in variant else audio_output(variant)
+
+def segment_options(segment_pattern: str, fmp4: bool) -> dict:
+    """hls muxer options for the segment container (segment_pattern is the
+    single media file's name with HLS_SINGLE_FILE)."""
+    options = {
+        'hls_time': HLS_TIME,
+        'hls_playlist_type': 'vod',
+        'hls_segment_filename': segment_pattern,
+        'hls_segment_type': 'fmp4' if fmp4 else 'mpegts',
+        'hls_flags': 'independent_segments+single_file' if HLS_SINGLE_FILE else 'independent_segments',
+    }
+    if fmp4:
+        # Written next to the segments; chunks override it per part
+        options['hls_fmp4_init_filename'] = 'init.mp4'
+    return options
+
+def video_codec_options(variant: dict) -> dict:
+    """Encoder options for a video rung, pinned to the level its CODECS declares."""
+    codec = variant.get("codec", "h264")
+    if codec == "hevc":
+        # hvc1 (parameter sets in the init segment) is what Apple players accept
+        return {'c:v': 'libx265', 'tag:v': 'hvc1', 'preset': 'fast',
+                'x265-params': f'level-idc={variant["level"]}:log-level=error'}
+    if codec == "av1":
+        # svtav1-params takes the level as major.minor, like the ladder
+        return {'c:v': 'libsvtav1', 'preset': 8, 'svtav1-params': f'level={variant["level"]}'}
+    return {'c:v': 'libx264', 'profile:v': 'high', 'level': variant["level"], 'preset': 'fast'}
+
+def video_output(variant: dict):
+    """ffmpeg graph builder for a video rung: (input, playlist, segment pattern, **output options)."""
+    def build_output(input_stream, playlist_path, segment_pattern, **output_args):
+        video = input_stream.video.filter('scale', -2, variant["height"])
+        if is_fmp4(variant):
+            # Video-only: audio comes from the shared (or Opus) rendition
+            streams, audio_args = [video], {}
+        else:
+            streams, audio_args = [video, input_stream.audio], {'c:a': 'aac', 'b:a': variant["audio_bitrate"]}
+        return ffmpeg.output(
+            *streams,
+            str(playlist_path),
+            **{
+                **video_codec_options(variant),
+                'b:v': variant["video_bitrate"],
+                **audio_args,
+                **segment_options(segment_pattern, is_fmp4(variant)),
+                # 50/60 fps sources would exceed every rung's level
+                'fpsmax': MAX_FRAME_RATE,
+                'force_key_frames': f'expr:gte(t,n_forced*{HLS_TIME})',
+                'g': 80,  # GOP size: 2x segment duration at 20fps
+                'keyint_min': 80,  # Consistent keyframe interval
+                **output_args,
+            }
+        )
+    return build_output
+
+def audio_output(variant: dict):
+    """ffmpeg graph builder for an audio rung: (input, playlist, segment pattern, **output options)."""
+    def build_output(input_stream, playlist_path, segment_pattern, **output_args):
+        return ffmpeg.output(
+            input_stream.audio,
+            str(playlist_path),
+            **{
+                'c:a': 'libopus' if variant.get("codec") == "opus" else 'aac',
+                'b:a': variant["bitrate"],
+                **segment_options(segment_pattern, is_fmp4(variant)),
+                **output_args,
+            }
+        )
+    return build_output
+
+def segment_extension(variant: dict) -> str:
+    return ".m4s" if is_fmp4(variant) else ".ts"
+
+def segment_pattern(variant_dir: Path, variant: dict, index: int = None) -> str:
+    """hls_segment_filename for a rendition, or for chunk index of one."""
+    if HLS_SINGLE_FILE:
+        name = "media" if index is None else f"media_{index:03d}"
+    else:
+        name = "segment_%03d" if index is None else f"segment_{index:03d}_%03d"
+    return str(variant_dir / f"{name}{segment_extension(variant)}")
+
+def chunk_files(variant_dir: Path, index: int) -> list:
+    """Segments (or single media file) and fMP4 init written by one chunk."""
+    return (
+        list(variant_dir.glob(f"segment_{index:03d}_*"))
+        + list(variant_dir.glob(f"media_{index:03d}.*"))
+        + list(variant_dir.glob(f"init_{index:03d}.mp4"))
+    )
+
+def encode_chunk(input_path: str, variant_dir: Path, variant: dict, index: int, start: float, length: float,
+                 duration: float = None, on_progress=None):
+    """
+    Encode one segment-aligned chunk of a rendition to part_NNN.m3u8.
 
-    for variant in variants:
+    length None encodes to the end of the input; duration is the chunk's
+    expected duration, for on_progress.
+
+    Returns (cpu_seconds, peak_rss_kb), or None if a finished part from an
+    earlier attempt was kept. output_ts_offset keeps timestamps continuous
+    across chunks so the parts can be stitched without re-encoding.
+    """
+    part_path = variant_dir / f"part_{index:03d}.m3u8"
+    if playlist_published(part_path):
+        return None
+    for stale in chunk_files(variant_dir, index):
+        stale.unlink()
+
+    input_args = {"ss": start} if length is None else {"ss": start, "t": length}
+    output_args = {"output_ts_offset": start}
+    if is_fmp4(variant):
+        output_args["hls_fmp4_init_filename"] = f"init_{index:03d}.mp4"
+    stream = rendition_output(variant)(
+        ffmpeg.input(input_path, **input_args),
+        part_path,
+        segment_pattern(variant_dir, variant, index),
+        **output_args,
+    )
+    usage = run_ffmpeg(stream, duration=duration, on_progress=on_progress)
+    if not playlist_complete(part_path):
+        raise RuntimeError(f"Chunk {index} of {variant_dir.name} produced an incomplete playlist")
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss
+
+def stitch_rendition(variant_dir: Path, chunk_count: int, check_files: bool = True) -> bool:
+    """Join part playlists into playlist.m3u8; False if any part is missing."""
+    segments = []
+    for index in range(chunk_count):
+        part = read_segments(variant_dir / f"part_{index:03d}.m3u8", check_files)
+        if part is None:
+            return False
+        segments.extend(part)
+    write_playlist(variant_dir / "playlist.m3u8", segments)
+    return True
+
+def encode_rendition(input_path: str, variant_dir: Path, variant: dict, duration: float = None, on_progress=None):
+    """
+    Encode one rendition to variant_dir/playlist.m3u8, resuming if possible.
+
+    The ffmpeg graph comes from rendition_output(variant). Sources longer than
+    CHECKPOINT_CHUNK_SECONDS are encoded in chunks on segment boundaries,
+    each finished as its own part playlist, then stitched into
+    playlist.m3u8; a retry re-encodes only the chunks that never finished.
+
+    Returns (cpu_seconds, peak_rss_kb) of the ffmpeg runs.
+    """
+    playlist_path = variant_dir / "playlist.m3u8"
+
+    if not duration or duration <= CHECKPOINT_CHUNK_SECONDS:
+        for stale in variant_dir.glob("*"):
+            stale.unlink()
+        stream = rendition_output(variant)(
+            ffmpeg.input(input_path), playlist_path, segment_pattern(variant_dir, variant)
+        )
+        usage = run_ffmpeg(stream, duration=duration, on_progress=on_progress)
+        return usage.ru_utime + usage.ru_stime, usage.ru_maxrss
+
+    cpu_seconds, peak_rss_kb = 0.0, 0
+    chunks = chunk_ranges(duration, CHECKPOINT_CHUNK_SECONDS, HLS_TIME)
+    for index, (start, length) in enumerate(chunks):
+        chunk_duration = length or duration - start
+        usage = encode_chunk(
+            input_path,
+            variant_dir,
+            variant,
+            index,
+            start,
+            length,
+            duration=chunk_duration,
+            on_progress=on_progress and (
+                lambda f, start=start, chunk_duration=chunk_duration:
+                    on_progress((start + f * chunk_duration) / duration)
+            ),
+        )
+        if usage:
+            cpu_seconds += usage[0]
+            peak_rss_kb = max(peak_rss_kb, usage[1])
+
+    if not stitch_rendition(variant_dir, len(chunks), check_files=get_storage().local):
+        raise RuntimeError(f"Missing chunks for {variant_dir.name}")
+    return cpu_seconds, peak_rss_kb
+
+def save_variant(db, media_id: str, quality: str, **fields):
+    """Insert or update a rung's MediaVariant row and commit it as a checkpoint."""
+    db_variant = db.query(MediaVariant).filter(
+        MediaVariant.media_id == media_id, MediaVariant.quality == quality
+    ).first()
+    if db_variant is None:
+        db_variant = MediaVariant(media_id=media_id, quality=quality)
+        db.add(db_variant)
+    for key, value in fields.items():
+        setattr(db_variant, key, value)
+    db.commit()
+
+def save_rendition(db, media: Media, variant: dict, variant_dir: Path) -> int:
+    """Record a finished rung as a MediaVariant; returns its size on disk."""
+    variant_size = get_storage().size(variant_dir)
+    if variant in (SHARED_AUDIO_VARIANT, OPUS_AUDIO_VARIANT):
+        # Audio groups of a video are not selectable qualities; the master
+        # playlist finds them on disk
+        return variant_size
+    path = f"/media/hls/{media.id}/{variant['name']}/playlist.m3u8"
+    if media.media_type == MediaType.VIDEO:
+        save_variant(
+            db,
+            media.id,
+            variant["name"],
+            path=path,
+            bitrate=int(variant["video_bitrate"].rstrip('k')) * 1000,
+            file_size=variant_size,
+            width=int(variant["height"] * 16 / 9),  # Assume 16:9 aspect ratio
+            height=variant["height"]
+        )
+    else:
+        save_variant(
+            db,
+            media.id,
+            variant["name"],
+            path=path,
+            bitrate=int(variant["bitrate"].rstrip('k')) * 1000,
+            file_size=variant_size
+        )
+    return variant_size
+
+def prune_variants(db, media_id: str, qualities: list):
+    """Drop MediaVariant rows for rungs no longer in the ladder."""
+    db.query(MediaVariant).filter(
+        MediaVariant.media_id == media_id, MediaVariant.quality.notin_(qualities)
+    ).delete(synchronize_session=False)
+    db.flush()
+
+def _encode_variants(media: Media, input_path: str, db, timer: StageTimer, renditions: list = None):
+    """Encode each rendition in turn, skipping those finished by an earlier attempt."""
+    hls_dir = Path(MEDIA_ROOT) / "hls" / media.id
+    hls_dir.mkdir(parents=True, exist_ok=True)
+
+    variants = media_variants(media)
+    prune_variants(db, media.id, [v["name"] for v in variants + modern_variants(media)])
+
+    renditions = renditions or media_renditions(media)
+    for index, variant in enumerate(renditions):
         variant_dir = hls_dir / variant["name"]
         variant_dir.mkdir(exist_ok=True)
 
-        playlist_path = variant_dir / "playlist.m3u8"
-        segment_pattern = str(variant_dir / "segment_%03d.ts")
-
         try:
-            input_stream = ffmpeg.input(input_path)
-            video = input_stream.video.filter('scale', -2, variant["height"])
-            audio = input_stream.audio
-            stream = ffmpeg.output(
-                video,
-                audio,
-                str(playlist_path),
-                **{
-                    'c:v': 'libx264',
-                    'b:v': variant["video_bitrate"],
-                    'c:a': 'aac',
-                    'b:a': variant["audio_bitrate"],
-                    'hls_time': 4,
-                    'hls_playlist_type': 'vod',
-                    'hls_segment_filename': segment_pattern,
-                    'hls_segment_type': 'mpegts',
-                    'hls_flags': 'independent_segments',
-                    'force_key_frames': 'expr:gte(t,n_forced*4)',
-                    'g': 80,  # GOP size: 2x segment duration at 20fps
-                    'keyint_min': 80,  # Consistent keyframe interval
-                    'preset': 'fast'
-                }
-            )
-            ffmpeg.run(stream, overwrite_output=True, capture_stdout=True, capture_stderr=True)
-
-            # Calculate variant file size
-            variant_size = sum(f.stat().st_size for f in variant_dir.glob("*"))
-
-            # Save variant to database
-            db_variant = MediaVariant(
-                media_id=media_id,
-                quality=variant["name"],
-                path=f"/media/hls/{media_id}/{variant['name']}/playlist.m3u8",
-                bitrate=int(variant["video_bitrate"].rstrip('k')) * 1000,
-                file_size=variant_size,
-                width=int(variant["height"] * 16 / 9),  # Assume 16:9 aspect ratio
-                height=variant["height"]
-            )
-            db.add(db_variant)
-
+            # Checkpoint: a complete playlist from an earlier attempt is kept
+            if playlist_published(variant_dir / "playlist.m3u8"):
+                print(f"{variant['name']} already encoded for {media.id}, skipping")
+            else:
+                with timer.stage("encode", variant["name"]) as stage:
+                    cpu_seconds, peak_rss_kb = encode_rendition(
+                        input_path,
+                        variant_dir,
+                        variant,
+                        duration=media.duration,
+                        on_progress=_variant_progress(media.id, index, len(renditions), variant["name"]),
+                    )
+                    stage["cpu_seconds"] = round(cpu_seconds, 3)
+                    stage["peak_rss_kb"] = peak_rss_kb
+                    stage["bytes"] = sum(f.stat().st_size for f in variant_dir.glob("*"))
+
+            with timer.stage("upload", variant["name"]):
+                get_storage().save(variant_dir)
+            save_rendition(db, media, variant, variant_dir)
+
+        except RETRYABLE_ERRORS:
+            raise
         except Exception as e:
             print(f"Error processing {variant['name']}: {e}")
             continue
 
-    # Flush variants to database so they're queryable (but not yet committed)
-    db.flush()
+    return variants
+
+def process_video(media_id: str, input_path: str, db, timer: StageTimer = None):
+    """Process video into multiple HLS variants"""
+    media = db.query(Media).filter(Media.id == media_id).first()
+    timer = timer or StageTimer(MediaType.VIDEO.value, media.duration)
 
+    variants = _encode_variants(media, input_path, db, timer)
+    finish_video(media, input_path, variants, db, timer)
+
+def finish_video(media: Media, input_path: str, variants: list, db, timer: StageTimer):
+    """Master playlist and thumbnail once a video's rungs exist."""
     # Generate master playlist for adaptive bitrate streaming
-    try:
-        create_master_playlist_video(media_id, variants, db)
-    except Exception as e:
-        print(f"Master playlist generation failed: {e}")
+    with timer.stage("playlist"):
+        try:
+            create_master_playlist_video(media.id, variants, db)
+        except Exception as e:
+            print(f"Master playlist generation failed: {e}")
 
     # Generate thumbnail
-    try:
-        thumbnail_path = generate_thumbnail(input_path, media_id)
-        media.thumbnail_path = thumbnail_path
-    except Exception as e:
-        print(f"Thumbnail generation failed: {e}")
+    with timer.stage("thumbnail"):
+        try:
+            thumbnail_path = generate_thumbnail(input_path, media.id)
+            media.thumbnail_path = thumbnail_path
+        except Exception as e:
+            print(f"Thumbnail generation failed: {e}")
 
     db.commit()
 
-def process_audio(media_id: str, input_path: str, db):
+def process_audio(media_id: str, input_path: str, db, timer: StageTimer = None):
     """Process audio into multiple HLS variants"""
     media = db.query(Media).filter(Media.id == media_id).first()
+    timer = timer or StageTimer(MediaType.AUDIO.value, media.duration)
 
-    hls_dir = Path(MEDIA_ROOT) / "hls" / media_id
-    hls_dir.mkdir(parents=True, exist_ok=True)
+    variants = _encode_variants(media, input_path, db, timer)
+    finish_audio(media, variants, db, timer)
+
+def finish_audio(media: Media, variants: list, db, timer: StageTimer):
+    """Master playlist and thumbnail once an audio item's rungs exist."""
+    # Generate master playlist for adaptive bitrate streaming
+    with timer.stage("playlist"):
+        try:
+            create_master_playlist_audio(media.id, variants, db)
+        except Exception as e:
+            print(f"Master playlist generation failed: {e}")
+
+    # Generate waveform thumbnail for audio
+    with timer.stage("thumbnail"):
+        try:
+            thumbnail_path = generate_audio_thumbnail(media.id)
+            media.thumbnail_path = thumbnail_path
+        except Exception as e:
+            print(f"Audio thumbnail generation failed: {e}")
+
+    db.commit()
+
+def dispatch_chunks(media: Media, original_path: str, run_id: int, db) -> int:
+    """
+    Fan a long source out as one encode_chunk task per (rendition, chunk).
+
+    Chunks are the same segment-aligned ranges the sequential path
+    checkpoints, so parts already finished by an earlier attempt in either
+    mode are reused. assemble_media runs as the chord callback once every
+    chunk is done; chunks_failed marks the media failed if any chunk fails.
+    Returns the number of chunk tasks queued.
+    """
+    prune_variants(db, media.id, [v["name"] for v in media_variants(media) + modern_variants(media)])
+    db.commit()
 
-    # Define audio quality variants
-    variants = [
-        {"name": "320kbps", "bitrate": "320k"},
-        {"name": "128kbps", "bitrate": "128k"},
-        {"name": "64kbps", "bitrate": "64k"},
+    chunks = chunk_ranges(media.duration, CHECKPOINT_CHUNK_SECONDS, HLS_TIME)
+    header = [
+        encode_chunk_task.s(media.id, original_path, variant["name"], index, start, length)
+        for variant in media_renditions(media)
+        for index, (start, length) in enumerate(chunks)
     ]
+    try:
+        _redis().set(_chunk_progress_key(media.id), 0, ex=86400)
+    except redis.RedisError:
+        pass
+    callback = assemble_media.s(media.id, original_path, run_id).on_error(
+        chunks_failed.s(media.id, run_id)
+    )
+    chord(header)(callback)
+    return len(header)
+
+def _chunk_progress_key(media_id: str) -> str:
+    return f"onplay:transcode:{media_id}:chunks_done"
+
+@celery_app.task(
+    bind=True,
+    name="app.worker.tasks.encode_chunk",
+    acks_late=True,
+    reject_on_worker_lost=True,
+    soft_time_limit=PROCESS_SOFT_TIME_LIMIT,
+    max_retries=PROCESS_MAX_ATTEMPTS,
+)
+def encode_chunk_task(self, media_id: str, original_path: str, quality: str, index: int, start: float, length: float):
+    """Encode one chunk of one rung; returns its stage record for the run."""
+    db = SessionLocal()
+    try:
+        media = db.query(Media).filter(Media.id == media_id).first()
+        if not media:
+            raise Exception(f"Media {media_id} not found")
+        renditions = media_renditions(media)
+        variant = next(v for v in renditions if v["name"] == quality)
+        media_type = media.media_type.value
+        chunk_duration = length or media.duration - start
+        total_tasks = len(chunk_ranges(media.duration, CHECKPOINT_CHUNK_SECONDS, HLS_TIME)) * len(renditions)
+    finally:
+        db.close()
 
-    for variant in variants:
-        variant_dir = hls_dir / variant["name"]
-        variant_dir.mkdir(exist_ok=True)
+    variant_dir = Path(MEDIA_ROOT) / "hls" / media_id / quality
+    variant_dir.mkdir(parents=True, exist_ok=True)
+    storage = get_storage()
+    timer = StageTimer(media_type, chunk_duration)
+    try:
+        storage.load(original_path)
+        with timer.stage("encode", quality) as stage:
+            stage["chunk"] = index
+            usage = encode_chunk(original_path, variant_dir, variant, index, start, length, chunk_duration)
+            if usage:
+                stage["cpu_seconds"] = round(usage[0], 3)
+                stage["peak_rss_kb"] = usage[1]
+                stage["bytes"] = sum(f.stat().st_size for f in chunk_files(variant_dir, index))
+            else:
+                stage["skipped"] = True
+        # assemble_media may run on another node. Also re-saved when
+        # skipped: the attempt that encoded it may have died before uploading
+        outputs = chunk_files(variant_dir, index) + [variant_dir / f"part_{index:03d}.m3u8"]
+        storage.save_all([output for output in outputs if output.exists()])
+        for output in outputs:
+            storage.release(output)
+    except SoftTimeLimitExceeded as e:
+        raise self.retry(exc=e, countdown=0)
+
+    try:
+        done = _redis().incr(_chunk_progress_key(media_id))
+        report_progress(media_id, stage="transcode", variant=quality, progress=round(min(done / total_tasks, 1.0), 3))
+    except redis.RedisError:
+        pass
+    return timer.stages[0]
+
+@celery_app.task(bind=True, name="app.worker.tasks.assemble_media")
+def assemble_media(self, chunk_records: list, media_id: str, original_path: str, run_id: int):
+    """Chord callback: stitch each rung from its chunks and finish the media."""
+    db = SessionLocal()
+    try:
+        media = db.query(Media).filter(Media.id == media_id).first()
+        run = db.query(ProcessingRun).filter(ProcessingRun.id == run_id).first()
+        if not media or not run:
+            raise Exception(f"Media {media_id} or run {run_id} not found")
+
+        timer = StageTimer(media.media_type.value, media.duration)
+        chunk_count = len(chunk_ranges(media.duration, CHECKPOINT_CHUNK_SECONDS, HLS_TIME))
+        variants = media_variants(media)
+        storage = get_storage()
+        with timer.stage("stitch"):
+            for variant in media_renditions(media):
+                variant_dir = Path(MEDIA_ROOT) / "hls" / media_id / variant["name"]
+                # Only the part playlists are needed; chunk tasks uploaded
+                # each part after its segments
+                for index in range(chunk_count):
+                    storage.load(variant_dir / f"part_{index:03d}.m3u8")
+                if stitch_rendition(variant_dir, chunk_count, check_files=storage.local):
+                    storage.save(variant_dir / "playlist.m3u8")
+                    save_rendition(db, media, variant, variant_dir)
+                else:
+                    print(f"Missing chunks for {variant['name']} of {media_id}")
+
+        if media.media_type == MediaType.VIDEO:
+            finish_video(media, original_path, variants, db, timer)
+        else:
+            finish_audio(media, variants, db, timer)
+
+        # Chunk timings come from many workers: encode seconds summed over
+        # chunks is worker time, and processing_seconds the job's wall time
+        timer.stages = (run.stages or []) + [r for r in chunk_records if r] + timer.stages
+        media.status = MediaStatus.READY
+        _finish_run(run, timer, "success")
+        started_at = run.started_at.replace(tzinfo=run.started_at.tzinfo or timezone.utc)
+        run.processing_seconds = round((run.finished_at - started_at).total_seconds(), 3)
+        db.commit()
+        report_progress(media_id, stage="done", status=MediaStatus.READY.value, progress=1.0)
+        release_outputs(media_id, original_path)
+
+        return {"status": "success", "media_id": media_id}
+    finally:
+        db.close()
+
+@celery_app.task(name="app.worker.tasks.chunks_failed")
+def chunks_failed(request, exc, traceback, media_id: str, run_id: int):
+    """Errback for a chunked encode: mark the media and its run failed."""
+    db = SessionLocal()
+    try:
+        media = db.query(Media).filter(Media.id == media_id).first()
+        if media:
+            media.status = MediaStatus.FAILED
+            media.error_message = str(exc)
+        run = db.query(ProcessingRun).filter(ProcessingRun.id == run_id).first()
+        if run:
+            run.status = "failed"
+            run.finished_at = datetime.now(timezone.utc)
+        db.commit()
+        report_progress(media_id, stage="done", status=MediaStatus.FAILED.value, error=str(exc))
+    finally:
+        db.close()
+
+def find_original(media_id: str):
+    """Path of a media item's uploaded original, fetched locally, or None."""
+    storage = get_storage()
+    for path in storage.list(Path(MEDIA_ROOT) / "original", f"{media_id}."):
+        if storage.load(path):
+            return str(path)
+    return None
+
+def playlist_published(playlist_path: Path) -> bool:
+    """
+    Whether a finished playlist is in storage. On object storage it is
+    fetched if this node lacks it and trusted without its segments, which
+    are always uploaded before it.
+    """
+    storage = get_storage()
+    if not storage.local and not storage.load(playlist_path):
+        return False
+    return playlist_complete(playlist_path, check_files=storage.local)
+
+def release_outputs(media_id: str, original_path: str):
+    """Drop a finished item's local working files when they live in object storage."""
+    storage = get_storage()
+    storage.release(Path(MEDIA_ROOT) / "hls" / media_id)
+    storage.release(original_path)
+
+def _encode_pending_key(media_id: str) -> str:
+    return f"onplay:renditions:{media_id}:pending"
+
+def deferred_thresholds(media: Media) -> dict:
+    """
+    Rungs held back at ingest, mapped to the plays within
+    POPULARITY_WINDOW_DAYS that trigger encoding them.
+    """
+    variants = media_variants(media)
+    thresholds = {v["name"]: LAZY_RUNG_THRESHOLDS[v["name"]] for v in variants if v["name"] in LAZY_RUNG_THRESHOLDS}
+    if variants and len(thresholds) == len(variants):
+        # Always ingest at least the lowest rung so the item is playable
+        thresholds.pop(variants[-1]["name"])
+    if MODERN_CODEC_MIN_PLAYS > 0:
+        thresholds.update({v["name"]: MODERN_CODEC_MIN_PLAYS for v in modern_variants(media)})
+    return thresholds
+
+@celery_app.task(
+    bind=True,
+    name="app.worker.tasks.encode_renditions",
+    acks_late=True,
+    reject_on_worker_lost=True,
+    soft_time_limit=PROCESS_SOFT_TIME_LIMIT,
+    max_retries=PROCESS_MAX_ATTEMPTS,
+)
+def encode_renditions(self, media_id: str, qualities: list):
+    """Add deferred rungs to a ready media item and republish its master playlist."""
+    db = SessionLocal()
+    retrying = False
+    try:
+        media = db.query(Media).filter(Media.id == media_id).first()
+        if not media or media.status != MediaStatus.READY:
+            return {"status": "skipped", "media_id": media_id}
+        original_path = find_original(media_id)
+        if not original_path:
+            return {"status": "skipped", "media_id": media_id, "reason": "original missing"}
+
+        fmp4 = media_fmp4(media)
+        renditions = [{**v, "fmp4": fmp4} for v in media_variants(media) if v["name"] in qualities]
+        modern = [v for v in modern_variants(media) if v["name"] in qualities]
+        if modern:
+            renditions += modern + [OPUS_AUDIO_VARIANT]
+        if not renditions:
+            return {"status": "skipped", "media_id": media_id}
+        # Popular again: the existing rungs belong on the hot tier too
+        get_storage().recall(Path(MEDIA_ROOT) / "hls" / media_id)
+
+        run = ProcessingRun(media_id=media_id, task_id=self.request.id, worker=self.request.hostname)
+        db.add(run)
+        db.commit()
+        timer = StageTimer(media.media_type.value, media.duration)
+        try:
+            _encode_variants(media, original_path, db, timer, renditions=renditions)
+            with timer.stage("playlist"):
+                write_master_playlist(media, db)
+        except Exception as e:
+            db.rollback()
+            retry = isinstance(e, RETRYABLE_ERRORS) and self.request.retries < self.max_retries
+            _finish_run(run, timer, "retrying" if retry else "failed")
+            db.commit()
+            if retry:
+                # The pending key stays set: the popularity, cold-rung and
+                # tiering jobs must keep off this item until the retry ends
+                retrying = True
+                countdown = 0 if isinstance(e, SoftTimeLimitExceeded) else 30 * 2 ** self.request.retries
+                raise self.retry(exc=e, countdown=countdown)
+            raise
+        _finish_run(run, timer, "success")
+        db.commit()
+        release_outputs(media_id, original_path)
+        return {"status": "success", "media_id": media_id, "qualities": [v["name"] for v in renditions]}
+    finally:
+        if not retrying:
+            try:
+                _redis().delete(_encode_pending_key(media_id))
+            except redis.RedisError:
+                pass
+        db.close()
+
+@celery_app.task(bind=True, name="app.worker.tasks.schedule_popular_encodes")
+def schedule_popular_encodes(self):
+    """
+    Queue deferred rungs (LAZY_RUNG_THRESHOLDS, and the modern ladder when
+    MODERN_CODEC_MIN_PLAYS is set) for media that crossed their play
+    thresholds within POPULARITY_WINDOW_DAYS.
+
+    Encoding only popular titles saves most of the CPU and storage of a
+    full ladder, since most items are rarely played. Jobs run at the lowest
+    priority on the heavy queue, behind ingest.
+    """
+    if not LAZY_RUNG_THRESHOLDS and not (MODERN_CODEC in MODERN_VARIANTS and MODERN_CODEC_MIN_PLAYS > 0):
+        return {"queued": 0}
 
-        playlist_path = variant_dir / "playlist.m3u8"
-        segment_pattern = str(variant_dir / "segment_%03d.ts")
+    since = datetime.now(timezone.utc) - timedelta(days=POPULARITY_WINDOW_DAYS)
+    db = SessionLocal()
+    try:
+        plays = dict(
+            db.query(Analytics.media_id, func.count(Analytics.id))
+            .filter(Analytics.event_type == "play", Analytics.timestamp >= since)
+            .group_by(Analytics.media_id)
+            .all()
+        )
+        if not plays:
+            return {"queued": 0}
+        media_items = db.query(Media).filter(
+            Media.id.in_(plays), Media.status == MediaStatus.READY, Media.deleted_at.is_(None)
+        ).all()
+        existing = set(
+            db.query(MediaVariant.media_id, MediaVariant.quality)
+            .filter(MediaVariant.media_id.in_(plays))
+            .all()
+        )
+        due = {}
+        for media in media_items:
+            missing = [
+                quality for quality, threshold in deferred_thresholds(media).items()
+                if plays[media.id] >= threshold and (media.id, quality) not in existing
+            ]
+            if missing:
+                due[media.id] = missing
+    finally:
+        db.close()
 
+    queued = 0
+    for media_id, qualities in due.items():
+        # Skip items whose encode is already queued or running
         try:
-            stream = ffmpeg.input(input_path)
-            stream = ffmpeg.output(
-                stream,
-                str(playlist_path),
-                **{
-                    'c:a': 'aac',
-                    'b:a': variant["bitrate"],
-                    'hls_time': 4,
-                    'hls_playlist_type': 'vod',
-                    'hls_segment_filename': segment_pattern,
-                    'hls_segment_type': 'mpegts',
-                    'hls_flags': 'independent_segments'
-                }
-            )
-            ffmpeg.run(stream, overwrite_output=True, capture_stdout=True, capture_stderr=True)
-
-            # Calculate variant file size
-            variant_size = sum(f.stat().st_size for f in variant_dir.glob("*"))
-
-            # Save variant to database
-            db_variant = MediaVariant(
-                media_id=media_id,
-                quality=variant["name"],
-                path=f"/media/hls/{media_id}/{variant['name']}/playlist.m3u8",
-                bitrate=int(variant["bitrate"].rstrip('k')) * 1000,
-                file_size=variant_size
+            if not _redis().set(_encode_pending_key(media_id), 1, nx=True, ex=PROCESS_SOFT_TIME_LIMIT * 4):
+                continue
+        except redis.RedisError:
+            pass
+        encode_renditions.apply_async((media_id, qualities), queue=QUEUE_TRANSCODE_HEAVY, priority=9)
+        queued += 1
+    return {"queued": queued}
+
+@celery_app.task(bind=True, name="app.worker.tasks.collect_cold_renditions")
+def collect_cold_renditions(self):
+    """
+    Delete deferred rungs that have not been played for COLD_RENDITION_DAYS.
+
+    Only rungs that schedule_popular_encodes can recreate are removed; the
+    rungs produced at ingest are never touched. A player still holding the
+    old master playlist falls back to a remaining rung.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=COLD_RENDITION_DAYS)
+    lazy_names = set(LAZY_RUNG_THRESHOLDS)
+    if MODERN_CODEC_MIN_PLAYS > 0:
+        lazy_names |= {v["name"] for ladder in MODERN_VARIANTS.values() for v in ladder}
+    if not lazy_names:
+        return {"removed": 0}
+
+    db = SessionLocal()
+    removed = 0
+    try:
+        last_play = (
+            db.query(Analytics.media_id, func.max(Analytics.timestamp).label("last_play"))
+            .filter(Analytics.event_type == "play")
+            .group_by(Analytics.media_id)
+            .subquery()
+        )
+        candidates = (
+            db.query(MediaVariant)
+            .outerjoin(last_play, last_play.c.media_id == MediaVariant.media_id)
+            .filter(
+                MediaVariant.quality.in_(lazy_names),
+                MediaVariant.created_at < cutoff,
+                or_(last_play.c.last_play.is_(None), last_play.c.last_play < cutoff),
             )
-            db.add(db_variant)
+            .all()
+        )
+        by_media = {}
+        for db_variant in candidates:
+            by_media.setdefault(db_variant.media_id, []).append(db_variant)
+
+        for media_id, db_variants in by_media.items():
+            try:
+                if _redis().exists(_encode_pending_key(media_id)):
+                    continue
+            except redis.RedisError:
+                pass
+            media = db.query(Media).filter(Media.id == media_id).first()
+            # Rungs that are no longer deferred were produced at ingest
+            deferred = deferred_thresholds(media)
+            hls_dir = Path(MEDIA_ROOT) / "hls" / media_id
+            for db_variant in db_variants:
+                if db_variant.quality not in deferred:
+                    continue
+                get_storage().delete(hls_dir / db_variant.quality)
+                db.delete(db_variant)
+                removed += 1
+            db.flush()
+            if not db.query(MediaVariant).filter(
+                MediaVariant.media_id == media_id,
+                MediaVariant.quality.in_([v["name"] for v in modern_variants(media)]),
+            ).count():
+                get_storage().delete(hls_dir / OPUS_AUDIO_VARIANT["name"])
+            write_master_playlist(media, db)
+            db.commit()
+    finally:
+        db.close()
+    return {"removed": removed}
 
-        except Exception as e:
-            print(f"Error processing {variant['name']}: {e}")
+def _as_utc(value: datetime) -> datetime:
+    # SQLite hands back naive datetimes for timezone-aware columns
+    return value.replace(tzinfo=timezone.utc) if value and value.tzinfo is None else value
+
+@celery_app.task(bind=True, name="app.worker.tasks.tier_media_storage")
+def tier_media_storage(self):
+    """
+    Move the files of idle media to the cold storage tier and bring
+    renditions back once they are played again.
+
+    An item is idle once it was neither uploaded nor played (analytics
+    play events, or bytes served per BandwidthStats) within
+    ORIGINAL_HOT_DAYS for its original, RENDITION_HOT_DAYS for its HLS
+    tree. Originals are only needed to re-encode or pick a new thumbnail,
+    and those recall them through storage.load(); archived renditions
+    keep playing straight from the cold tier, just from slower disks.
+    """
+    storage = get_storage()
+    if not storage.tiering:
+        return {"archived": 0, "recalled": 0}
+
+    now = datetime.now(timezone.utc)
+    db = SessionLocal()
+    try:
+        last_play = dict(
+            db.query(Analytics.media_id, func.max(Analytics.timestamp))
+            .filter(Analytics.event_type == "play")
+            .group_by(Analytics.media_id)
+            .all()
+        )
+        last_served = dict(
+            db.query(BandwidthStats.media_id, func.max(BandwidthStats.date))
+            .filter(BandwidthStats.media_id.isnot(None))
+            .group_by(BandwidthStats.media_id)
+            .all()
+        )
+        media_items = db.query(Media.id, Media.created_at).filter(
+            Media.status == MediaStatus.READY, Media.deleted_at.is_(None)
+        ).all()
+    finally:
+        db.close()
+
+    archived = recalled = 0
+    for media_id, created_at in media_items:
+        seen = [_as_utc(t) for t in (created_at, last_play.get(media_id), last_served.get(media_id)) if t]
+        if not seen:
             continue
+        idle = now - max(seen)
+        try:
+            # A pending encode is about to write next to (and read) these files
+            if _redis().exists(_encode_pending_key(media_id)):
+                continue
+        except redis.RedisError:
+            pass
+        try:
+            if ORIGINAL_HOT_DAYS > 0 and idle > timedelta(days=ORIGINAL_HOT_DAYS):
+                for path in storage.list(Path(MEDIA_ROOT) / "original", f"{media_id}."):
+                    archived += storage.archive(path)
+            if RENDITION_HOT_DAYS > 0:
+                hls_dir = Path(MEDIA_ROOT) / "hls" / media_id
+                if idle > timedelta(days=RENDITION_HOT_DAYS):
+                    archived += storage.archive(hls_dir)
+                elif storage.is_archived(hls_dir):
+                    recalled += storage.recall(hls_dir)
+        except Exception as e:
+            print(f"Storage tiering failed for {media_id}: {e}")
+    return {"archived": archived, "recalled": recalled}
+
+def remove_media_files(media_id: str):
+    """Delete everything stored for a media item: originals, HLS tree, thumbnail."""
+    storage = get_storage()
+    media_root = Path(MEDIA_ROOT)
+    for path in storage.list(media_root / "original", f"{media_id}."):
+        storage.delete(path)
+    storage.delete(media_root / "hls" / media_id)
+    # Only the item's own thumbnail; audio items may point at the shared default
+    for path in storage.list(media_root / "thumbnails", f"{media_id}."):
+        storage.delete(path)
+
+def _purge(media: Media, db):
+    remove_media_files(media.id)
+    db.delete(media)
+    db.commit()
 
-    # Flush variants to database so they're queryable (but not yet committed)
-    db.flush()
+@celery_app.task(
+    bind=True,
+    name="app.worker.tasks.purge_media",
+    acks_late=True,
+    reject_on_worker_lost=True,
+)
+def purge_media(self, media_id: str):
+    """
+    Remove a soft-deleted media item: files first, then its row (and by
+    cascade its variants, runs and analytics). Safe to repeat - a purge
+    cut short leaves the row, so the next attempt picks up where it left.
+    """
+    db = SessionLocal()
+    try:
+        media = db.query(Media).filter(Media.id == media_id).first()
+        if not media or media.deleted_at is None:
+            return {"status": "skipped", "media_id": media_id}
+        _purge(media, db)
+        return {"status": "success", "media_id": media_id}
+    finally:
+        db.close()
 
-    # Generate master playlist for adaptive bitrate streaming
+@celery_app.task(bind=True, name="app.worker.tasks.collect_deleted_media")
+def collect_deleted_media(self):
+    """Purge soft-deleted items whose purge_media task was lost or failed."""
+    cutoff = datetime.now(timezone.utc) - timedelta(minutes=10)
+    db = SessionLocal()
+    purged = 0
     try:
-        create_master_playlist_audio(media_id, variants, db)
-    except Exception as e:
-        print(f"Master playlist generation failed: {e}")
+        stale = (
+            db.query(Media)
+            .filter(Media.deleted_at.isnot(None), Media.deleted_at < cutoff)
+            .order_by(Media.deleted_at)
+            .limit(RECONCILE_BATCH_SIZE)
+            .all()
+        )
+        for media in stale:
+            try:
+                _purge(media, db)
+                purged += 1
+            except Exception as e:
+                db.rollback()
+                print(f"Purge of {media.id} failed: {e}")
+    finally:
+        db.close()
+    return {"purged": purged}
 
-    # Generate waveform thumbnail for audio
+# Files under MEDIA_ROOT not owned by a single media item
+SHARED_MEDIA_FILES = {("thumbnails", "audio-default.jpg")}
+
+@celery_app.task(bind=True, name="app.worker.tasks.reconcile_media_storage")
+def reconcile_media_storage(self):
+    """
+    Compare storage with the media table, both ways.
+
+    Originals, HLS trees and thumbnails whose media row is gone (left by a
+    crash mid-delete or mid-upload) are orphans. One is only removed once
+    two consecutive runs have seen it, so nothing that is being written
+    right now can be taken; at most RECONCILE_BATCH_SIZE go per run.
+    Ready items whose original or HLS tree is missing are only reported,
+    since they need a re-upload rather than a cleanup.
+    """
+    storage = get_storage()
+    media_root = Path(MEDIA_ROOT)
+    entries = {area: storage.children(media_root / area) for area in ("original", "hls", "thumbnails")}
+    owners = {
+        (area, name): name.split(".", 1)[0]
+        for area, names in entries.items()
+        for name in names
+        if (area, name) not in SHARED_MEDIA_FILES
+    }
+
+    db = SessionLocal()
     try:
-        thumbnail_path = generate_audio_thumbnail(media_id)
-        media.thumbnail_path = thumbnail_path
-    except Exception as e:
-        print(f"Audio thumbnail generation failed: {e}")
+        ids = sorted(set(owners.values()))
+        known = set()
+        for start in range(0, len(ids), 500):
+            known.update(row.id for row in db.query(Media.id).filter(Media.id.in_(ids[start:start + 500])))
+        ready = [
+            row.id for row in db.query(Media.id).filter(
+                Media.status == MediaStatus.READY, Media.deleted_at.is_(None)
+            )
+        ]
+    finally:
+        db.close()
 
-    db.commit()
+    orphans = {f"{area}/{name}" for (area, name), media_id in owners.items() if media_id not in known}
+    try:
+        seen_before = {m.decode() for m in _redis().smembers(_RECONCILE_ORPHANS_KEY)}
+        pipe = _redis().pipeline()
+        pipe.delete(_RECONCILE_ORPHANS_KEY)
+        if orphans:
+            pipe.sadd(_RECONCILE_ORPHANS_KEY, *orphans)
+            pipe.expire(_RECONCILE_ORPHANS_KEY, 7 * 24 * 3600)
+        pipe.execute()
+    except redis.RedisError:
+        # Without the previous sighting nothing is confirmed; report only
+        seen_before = set()
+
+    removed = []
+    if RECONCILE_DELETE_ORPHANS:
+        for key in sorted(orphans & seen_before)[:RECONCILE_BATCH_SIZE]:
+            try:
+                storage.delete(media_root / key)
+                removed.append(key)
+            except Exception as e:
+                print(f"Could not remove orphaned {key}: {e}")
+
+    originals = {name.split(".", 1)[0] for name in entries["original"]}
+    renditions = set(entries["hls"])
+    missing_original = [media_id for media_id in ready if media_id not in originals]
+    missing_hls = [media_id for media_id in ready if media_id not in renditions]
+    if orphans or missing_original or missing_hls:
+        print(
+            f"Storage reconcile: {len(orphans)} orphaned, {len(removed)} removed, "
+            f"{len(missing_original)} ready without original, {len(missing_hls)} ready without HLS"
+        )
+    return {
+        "orphans": sorted(orphans)[:RECONCILE_BATCH_SIZE],
+        "orphan_count": len(orphans),
+        "removed": removed,
+        "missing_original": missing_original[:RECONCILE_BATCH_SIZE],
+        "missing_hls": missing_hls[:RECONCILE_BATCH_SIZE],
+    }
+
+def write_master_playlist(media: Media, db):
+    """Regenerate a media item's master playlist from its current variants."""
+    if media.media_type == MediaType.VIDEO:
+        create_master_playlist_video(media.id, media_variants(media), db)
+    else:
+        create_master_playlist_audio(media.id, media_variants(media), db)
 
 def create_master_playlist_video(media_id: str, variants: list, db):
     """
@@ -245,26 +1406,74 @@ def create_master_playlist_video(media_id: str, variants: list, db):
         print(f"No variants found for media {media_id}, skipping master playlist")
         return
 
-    # Build master playlist content
+    # Audio groups for video-only rungs: the shared AAC rendition (CMAF)
+    # and the Opus rendition of the modern ladder
+    audio_groups = {}
+    for group_id, audio_variant in (("audio", SHARED_AUDIO_VARIANT), ("opus", OPUS_AUDIO_VARIANT)):
+        if playlist_published(hls_dir / audio_variant["name"] / "playlist.m3u8"):
+            audio_groups[group_id] = audio_variant
+
+    # Build master playlist content; only fMP4 renditions have audio groups
     lines = [
         "#EXTM3U",
-        "#EXT-X-VERSION:3"
+        "#EXT-X-VERSION:7" if audio_groups else "#EXT-X-VERSION:3"
     ]
+    for group_id, audio_variant in audio_groups.items():
+        lines.append(
+            f'#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="{group_id}",NAME="Default",DEFAULT=YES,AUTOSELECT=YES,'
+            f'URI="{audio_variant["name"]}/playlist.m3u8"'
+        )
 
+    listed = []
     for db_variant in sorted(db_variants, key=lambda v: v.bitrate, reverse=True):
-        # EXT-X-STREAM-INF tag with bandwidth and resolution
-        stream_info = f"#EXT-X-STREAM-INF:BANDWIDTH={db_variant.bitrate}"
+        variant = VARIANTS_BY_NAME.get(db_variant.quality, {})
+        group_id = None
+        if variant.get("codec") in ("hevc", "av1"):
+            group_id = "opus"
+        elif rendition_is_fmp4(hls_dir / db_variant.quality / "playlist.m3u8"):
+            # Segment type from the files: HLS_SEGMENT_TYPE may have changed
+            # since this rung was encoded
+            group_id = "audio"
+        if group_id and group_id not in audio_groups:
+            # A video-only rung is unplayable without its audio rendition
+            continue
+
+        # EXT-X-STREAM-INF tag with bandwidth and resolution; BANDWIDTH
+        # covers the audio the player fetches alongside the rung
+        bandwidth = db_variant.bitrate
+        if group_id:
+            bandwidth += int(audio_groups[group_id]["bitrate"].rstrip('k')) * 1000
+        stream_info = f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth}"
 
         if db_variant.width and db_variant.height:
             stream_info += f",RESOLUTION={db_variant.width}x{db_variant.height}"
+        # CODECS lets players skip ladders they can't decode
+        if variant.get("codecs"):
+            stream_info += f',CODECS="{variant["codecs"]}"'
+        if group_id:
+            stream_info += f',AUDIO="{group_id}"'
 
         lines.append(stream_info)
         # Relative path to variant playlist
         lines.append(f"{db_variant.quality}/playlist.m3u8")
+        listed.append((db_variant.quality, variant.get("codec", "h264"), group_id))
 
-    # Write master playlist
-    with open(master_playlist_path, 'w') as f:
+    # Write master playlist; renamed into place because it may be rewritten
+    # while being served (modern ladder added later)
+    hls_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = master_playlist_path.with_suffix(".m3u8.tmp")
+    with open(tmp_path, 'w') as f:
         f.write('\n'.join(lines) + '\n')
+    os.replace(tmp_path, master_playlist_path)
+    get_storage().save(master_playlist_path)
+
+    # The player opens on the lowest rung (enableLowInitialPlaylist) among
+    # those it can decode; H.264 is the one every client can
+    startable = [rung for rung in listed if rung[1] == "h264"] or listed
+    if startable:
+        quality, _, group_id = startable[-1]
+        renditions = [quality] + ([audio_groups[group_id]["name"]] if group_id else [])
+        publish_startup_bundle(media_id, renditions, db)
 
     print(f"Master playlist created at {master_playlist_path}")
 
@@ -283,23 +1492,65 @@ def create_master_playlist_audio(media_id: str, variants: list, db):
         return
 
     # Build master playlist content
+    fmp4 = any(rendition_is_fmp4(hls_dir / v.quality / "playlist.m3u8") for v in db_variants)
     lines = [
         "#EXTM3U",
-        "#EXT-X-VERSION:3"
+        "#EXT-X-VERSION:7" if fmp4 else "#EXT-X-VERSION:3"
     ]
 
     for db_variant in sorted(db_variants, key=lambda v: v.bitrate, reverse=True):
         # EXT-X-STREAM-INF tag with bandwidth only (audio has no resolution)
-        lines.append(f"#EXT-X-STREAM-INF:BANDWIDTH={db_variant.bitrate}")
+        stream_info = f"#EXT-X-STREAM-INF:BANDWIDTH={db_variant.bitrate}"
+        codecs = VARIANTS_BY_NAME.get(db_variant.quality, {}).get("codecs")
+        if codecs:
+            stream_info += f',CODECS="{codecs}"'
+        lines.append(stream_info)
         # Relative path to variant playlist
         lines.append(f"{db_variant.quality}/playlist.m3u8")
 
-    # Write master playlist
-    with open(master_playlist_path, 'w') as f:
+    # Write master playlist; renamed into place because a duplicate's copy
+    # may be a hard link to this file, and it may be rewritten while served
+    hls_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = master_playlist_path.with_suffix(".m3u8.tmp")
+    with open(tmp_path, 'w') as f:
         f.write('\n'.join(lines) + '\n')
+    os.replace(tmp_path, master_playlist_path)
+    get_storage().save(master_playlist_path)
+    # The player opens on the lowest rung (enableLowInitialPlaylist)
+    lowest = min(db_variants, key=lambda v: v.bitrate)
+    publish_startup_bundle(media_id, [lowest.quality], db)
 
     print(f"Master playlist created at {master_playlist_path}")
 
+def publish_startup_bundle(media_id: str, renditions: list, db):
+    """
+    write_startup_bundle, fetching the files it reads from storage first.
+    The bundle and the first segments of every variant are also kept on
+    the media row (committed by the caller), so the API serves them without
+    storage reads per request.
+    """
+    storage = get_storage()
+    hls_dir = Path(MEDIA_ROOT) / "hls" / media_id
+    for name in renditions:
+        playlist = hls_dir / name / "playlist.m3u8"
+        storage.load(playlist)
+        for uri, byterange in first_segment(playlist):
+            # Only whole-file segments are measured on disk
+            if byterange is None:
+                storage.load(playlist.parent / uri)
+    write_startup_bundle(hls_dir, f"/media/hls/{media_id}", renditions)
+    if (hls_dir / STARTUP_BUNDLE).exists():
+        storage.save(hls_dir / STARTUP_BUNDLE)
+    bundle = storage.read_text(hls_dir / STARTUP_BUNDLE)
+    media = db.query(Media).filter(Media.id == media_id).first()
+    if media:
+        variants = db.query(MediaVariant).filter(MediaVariant.media_id == media_id).all()
+        media.playback = {
+            "startup": json.loads(bundle) if bundle else None,
+            "first_segments": variant_first_segments(variants, MEDIA_ROOT, storage.read_text),
+        }
+
+
 def generate_thumbnail(input_path: str, media_id: str) -> str:
     """Generate video thumbnail from middle of video"""
     thumbnail_dir = Path(MEDIA_ROOT) / "thumbnails"
@@ -324,6 +1575,7 @@ def generate_thumbnail(input_path: str, media_id: str) -> str:
         img = Image.open(thumbnail_path)
         img.thumbnail((640, 360))
         img.save(thumbnail_path, quality=82, optimize=True, progressive=True)
+        get_storage().save(thumbnail_path)
 
         return f"/media/thumbnails/{media_id}.jpg"
     except Exception as e:
@@ -346,6 +1598,7 @@ def generate_thumbnail_at_timestamp(input_path: str, media_id: str, timestamp: f
         img = Image.open(thumbnail_path)
         img.thumbnail((640, 360))
         img.save(thumbnail_path, quality=82, optimize=True, progressive=True)
+        get_storage().save(thumbnail_path)
 
         return f"/media/thumbnails/{media_id}.jpg"
     except Exception as e:
@@ -368,6 +1621,7 @@ def generate_audio_thumbnail(media_id: str) -> str:
 
         if source.exists():
             shutil.copy2(source, destination)
+            get_storage().save(destination)
             print(f"Copied audio-default.jpg from assets to {destination}")
         else:
             print(f"Warning: Source audio thumbnail not found at {source}")
@@ -391,7 +1645,7 @@ def process_bandwidth_logs_task(self):
     from ..database import SessionLocal
 
     try:
-        raw_position = _redis_client.get(_BANDWIDTH_POSITION_KEY)
+        raw_position = _redis().get(_BANDWIDTH_POSITION_KEY)
         last_position = int(raw_position) if raw_position else 0
 
         new_position = process_bandwidth_logs(
@@ -399,7 +1653,7 @@ def process_bandwidth_logs_task(self):
             last_position=last_position,
         )
 
-        _redis_client.set(_BANDWIDTH_POSITION_KEY, new_position)
+        _redis().set(_BANDWIDTH_POSITION_KEY, new_position)
 
         # Cleanup old logs (keep last 90 days)
         db = SessionLocal()
@@ -0,0 +1 @@
+# Offline benchmark and load-test harnesses (run with python -m benchmarks.<name>)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark for API worker processes.
+
+Starts --workers fresh Python processes at once, like uvicorn --workers N
+on a rolling restart, and has each one import app.main and run the app's
+lifespan startup - everything before the first request can be served.
+Reports per-worker import and startup times and fails when the slowest
+worker takes longer than --target seconds.
+
+Target 1.5s with one worker per core. Measured on one core against a
+migrated local Postgres: 1.26s (median of 7), down from 1.43s before
+schema setup left import time and Celery became a first-use import;
+FastAPI's own import is ~0.6s of that. Four workers racing for the
+one core: 5.60s, down from 5.96s.
+
+Point it at a database that is already migrated (the normal deploy: the
+release step runs python -m app.manage migrate once, the workers only
+verify), and compare against an older tree by passing its backend dir:
+
+    python -m app.manage migrate
+    python -m benchmarks.startup --workers 4 --schema-mode verify
+    git worktree add /tmp/onplay-before <rev>
+    python -m benchmarks.startup --workers 4 --app-dir /tmp/onplay-before/backend
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Runs in each worker process; prints one JSON line of timings
+WORKER = """
+import asyncio, json, sys, time
+start = float(sys.argv[1])
+import app.main as main
+imported = time.time()
+
+async def startup():
+    async with main.app.router.lifespan_context(main.app):
+        return time.time()
+
+ready = asyncio.run(startup())
+print(json.dumps({"import": imported - start, "ready": ready - start,
+                  "heavy": [m for m in ("PIL", "ffmpeg", "maxminddb", "mutagen") if m in sys.modules]}))
+"""
+
+
+def run_round(args, env):
+    start = time.time()
+    procs = [
+        subprocess.Popen([sys.executable, "-c", WORKER, str(start)], cwd=args.app_dir, env=env,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        for _ in range(args.workers)
+    ]
+    results = []
+    for proc in procs:
+        out, err = proc.communicate(timeout=args.timeout)
+        if proc.returncode != 0:
+            raise SystemExit(f"Worker failed:\n{err.strip()}")
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app-dir", default=str(BACKEND_DIR), help="backend directory to start")
+    # More workers than cores just queues them on the CPU
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--schema-mode", default="verify", choices=["migrate", "verify"])
+    parser.add_argument("--target", type=float, default=1.5, help="max seconds until the slowest worker is ready")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    # An existing (empty) file keeps the lifespan from starting the GeoIP download
+    geoip_path = Path(tempfile.gettempdir()) / "onplay-bench" / "geoip.mmdb"
+    geoip_path.parent.mkdir(parents=True, exist_ok=True)
+    geoip_path.touch()
+    env = {**os.environ, "DB_SCHEMA_MODE": args.schema_mode, "GEOIP_DB_PATH": str(geoip_path),
+           "PYTHONPATH": args.app_dir}
+
+    run_round(args, env)  # compile bytecode and warm the OS page cache
+    slowest, imports, heavy = [], [], set()
+    for i in range(args.rounds):
+        results = run_round(args, env)
+        ready = max(r["ready"] for r in results)
+        slowest.append(ready)
+        imports.extend(r["import"] for r in results)
+        heavy.update(m for r in results for m in r["heavy"])
+        print(f"round {i + 1}: import {min(r['import'] for r in results):.2f}-{max(r['import'] for r in results):.2f}s, "
+              f"slowest worker ready {ready:.2f}s")
+
+    median = statistics.median(slowest)
+    print(f"\nworkers:             {args.workers} ({args.schema_mode})")
+    print(f"import app.main:     median {statistics.median(imports):.2f}s")
+    print(f"slowest ready:       median {median:.2f}s (target {args.target:.2f}s)")
+    print(f"heavy modules:       {', '.join(sorted(heavy)) or 'none'}")
+    ok = median <= args.target
+    print("PASS" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
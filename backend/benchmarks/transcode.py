@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the media ingest pipeline.
+
+Generates synthetic sources with ffmpeg's lavfi (testsrc2 + sine for video,
+sine for audio) at several resolutions and durations, runs each through
+process_media against a throwaway MEDIA_ROOT and database, and reports per
+rung: wall time, CPU time and peak RSS of the ffmpeg process, realtime
+factor and output bytes.
+
+Needs only ffmpeg/ffprobe on PATH. Uses a temporary SQLite database unless
+--database-url points at a local Postgres. Redis is not required; progress
+publishing is switched off for the run.
+
+    python -m benchmarks.transcode --resolutions 360,720,1080 --durations 10,60
+    python -m benchmarks.transcode --save before.json
+    python -m benchmarks.transcode --compare before.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+HEIGHT_TO_SIZE = {
+    240: "426x240",
+    360: "640x360",
+    480: "854x480",
+    720: "1280x720",
+    1080: "1920x1080",
+    1440: "2560x1440",
+    2160: "3840x2160",
+}
+
+
+def generate_video(path: Path, height: int, duration: int, fps: int):
+    subprocess.run(
+        [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "lavfi", "-i", f"testsrc2=size={HEIGHT_TO_SIZE[height]}:rate={fps}:duration={duration}",
+            "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={duration}",
+            # Near-lossless intermediate so the benchmark measures our encode,
+            # not artefacts of the fixture
+            "-c:v", "libx264", "-preset", "ultrafast", "-crf", "10", "-pix_fmt", "yuv420p",
+            "-c:a", "aac", "-b:a", "320k", "-shortest",
+            str(path),
+        ],
+        check=True,
+    )
+
+
+def generate_audio(path: Path, duration: int):
+    subprocess.run(
+        [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={duration}",
+            "-ac", "2",
+            str(path),
+        ],
+        check=True,
+    )
+
+
+def build_fixtures(args, source_dir: Path):
+    fixtures = []
+    for height in args.resolutions:
+        if height not in HEIGHT_TO_SIZE:
+            raise SystemExit(f"Unsupported resolution {height}p; choose from {sorted(HEIGHT_TO_SIZE)}")
+        for duration in args.durations:
+            path = source_dir / f"video_{height}p_{duration}s.mp4"
+            generate_video(path, height, duration, args.fps)
+            fixtures.append({"name": path.stem, "path": path, "duration": duration})
+    for duration in args.audio_durations:
+        path = source_dir / f"audio_{duration}s.wav"
+        generate_audio(path, duration)
+        fixtures.append({"name": path.stem, "path": path, "duration": duration})
+    return fixtures
+
+
+def run_fixture(fixture, db_models):
+    SessionLocal, Media, MediaStatus, ProcessingRun, get_media_type, process_media = db_models
+
+    db = SessionLocal()
+    try:
+        media = Media(
+            filename=fixture["path"].name,
+            original_filename=fixture["path"].name,
+            media_type=get_media_type(fixture["path"].name),
+            status=MediaStatus.PROCESSING,
+            file_size=fixture["path"].stat().st_size,
+        )
+        db.add(media)
+        db.commit()
+        media_id = media.id
+    finally:
+        db.close()
+
+    cpu_before = os.times()
+    started = time.perf_counter()
+    result = process_media.apply(args=(media_id, str(fixture["path"])))
+    wall = time.perf_counter() - started
+    cpu_after = os.times()
+
+    db = SessionLocal()
+    try:
+        run = db.query(ProcessingRun).filter(ProcessingRun.media_id == media_id).one()
+        stages = run.stages or []
+        status = run.status
+    finally:
+        db.close()
+
+    child_cpu = (cpu_after.children_user - cpu_before.children_user) + (
+        cpu_after.children_system - cpu_before.children_system
+    )
+    return {
+        "name": fixture["name"],
+        "duration": fixture["duration"],
+        "status": status if result.successful() else "failed",
+        "wall_seconds": round(wall, 3),
+        "cpu_seconds": round(child_cpu, 3),
+        "output_bytes": sum(s.get("bytes") or 0 for s in stages),
+        "rungs": [
+            {
+                "variant": s["variant"],
+                "wall_seconds": s["seconds"],
+                "cpu_seconds": s.get("cpu_seconds"),
+                "peak_rss_mb": round(s["peak_rss_kb"] / 1024, 1) if s.get("peak_rss_kb") else None,
+                "realtime_factor": s.get("realtime_factor"),
+                "bytes": s.get("bytes"),
+            }
+            for s in stages
+            if s["stage"] == "encode"
+        ],
+        "other_stages": {s["stage"]: s["seconds"] for s in stages if s["stage"] != "encode"},
+    }
+
+
+def print_report(results, baseline=None):
+    base_rungs = {}
+    if baseline:
+        for r in baseline["results"]:
+            for rung in r["rungs"]:
+                base_rungs[(r["name"], rung["variant"])] = rung
+
+    header = f"{'source':<22} {'rung':<8} {'wall s':>8} {'cpu s':>8} {'rss MB':>8} {'x rt':>7} {'MB out':>9}"
+    if baseline:
+        header += f" {'wall Δ':>8} {'bytes Δ':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        for rung in r["rungs"]:
+            line = (
+                f"{r['name']:<22} {rung['variant']:<8} {rung['wall_seconds']:>8.2f} "
+                f"{(rung['cpu_seconds'] or 0):>8.2f} {(rung['peak_rss_mb'] or 0):>8.1f} "
+                f"{(rung['realtime_factor'] or 0):>7.3f} {(rung['bytes'] or 0) / 1e6:>9.2f}"
+            )
+            base = base_rungs.get((r["name"], rung["variant"]))
+            if baseline:
+                line += f" {_pct(rung['wall_seconds'], base and base['wall_seconds']):>8}"
+                line += f" {_pct(rung['bytes'], base and base['bytes']):>8}"
+            print(line)
+        others = ", ".join(f"{k} {v:.2f}s" for k, v in r["other_stages"].items())
+        print(
+            f"{r['name']:<22} {'total':<8} {r['wall_seconds']:>8.2f} {r['cpu_seconds']:>8.2f} "
+            f"{'':>8} {'':>7} {r['output_bytes'] / 1e6:>9.2f}  [{r['status']}; {others}]"
+        )
+
+
+def _pct(current, previous):
+    if not previous:
+        return "n/a"
+    return f"{(current - previous) / previous * 100:+.1f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--resolutions", default="360,720,1080", help="source heights, comma separated")
+    parser.add_argument("--durations", default="10,60", help="video durations in seconds")
+    parser.add_argument("--audio-durations", default="60,300", help="audio durations in seconds (empty to skip)")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--database-url", default=None, help="defaults to a temporary SQLite file")
+    parser.add_argument("--workdir", default=None, help="keep sources and renditions here instead of a temp dir")
+    parser.add_argument("--save", default=None, help="write results as JSON for later --compare")
+    parser.add_argument("--compare", default=None, help="baseline JSON from a previous --save")
+    args = parser.parse_args()
+
+    def ints(value):
+        return [int(v) for v in value.split(",") if v.strip()]
+
+    args.resolutions = ints(args.resolutions)
+    args.durations = ints(args.durations)
+    args.audio_durations = ints(args.audio_durations)
+
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix="onplay-bench-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    source_dir = workdir / "sources"
+    source_dir.mkdir(exist_ok=True)
+
+    # Configure before any app import: these are read at import time
+    os.environ["MEDIA_ROOT"] = str(workdir / "media")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{workdir / 'bench.db'}"
+
+    from app.api.upload import get_media_type
+    from app.database import Base, SessionLocal, engine
+    from app.models import Media, MediaStatus, ProcessingRun
+    from app.worker import tasks
+
+    tasks.report_progress = lambda *a, **k: None  # no Redis needed offline
+    Base.metadata.create_all(bind=engine)
+
+    print(f"Generating fixtures in {source_dir} ...")
+    fixtures = build_fixtures(args, source_dir)
+
+    db_models = (SessionLocal, Media, MediaStatus, ProcessingRun, get_media_type, tasks.process_media)
+    results = []
+    for fixture in fixtures:
+        print(f"Processing {fixture['name']} ...", flush=True)
+        results.append(run_fixture(fixture, db_models))
+
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+    print()
+    print_report(results, baseline)
+
+    if args.save:
+        Path(args.save).write_text(json.dumps({
+            "resolutions": args.resolutions,
+            "durations": args.durations,
+            "audio_durations": args.audio_durations,
+            "fps": args.fps,
+            "results": results,
+        }, indent=2))
+        print(f"\nSaved results to {args.save}")
+
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Load test for ConnectionManager fan-out with simulated WebSocket clients.
+
+No network or Redis is involved: each simulated socket implements the small
+part of the Starlette WebSocket interface the manager uses, with a
+configurable send latency. A fraction of the sockets never complete a send
+(stalled consumers) and a fraction raise on send (dead peers). The test
+checks that healthy sockets receive every message, that stalled and dead
+sockets are evicted, and that a broadcast never waits on a slow socket.
+
+    python -m benchmarks.ws_broadcast --connections 5000 --messages 200
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.realtime import SEND_QUEUE_SIZE, ConnectionManager  # noqa: E402
+
+
+class SimulatedSocket:
+    def __init__(self, latency: float, mode: str = "ok"):
+        self.latency = latency
+        self.mode = mode
+        self.received = 0
+        self.closed_with = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        if self.mode == "stalled":
+            await asyncio.Event().wait()  # never returns
+        if self.mode == "dead":
+            raise ConnectionResetError("peer went away")
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.received += 1
+
+    async def close(self, code: int = 1000):
+        self.closed_with = code
+
+
+async def run(args) -> bool:
+    rng = random.Random(args.seed)
+    manager = ConnectionManager()
+    sockets = []
+
+    for i in range(args.connections):
+        roll = rng.random()
+        if roll < args.stalled:
+            mode = "stalled"
+        elif roll < args.stalled + args.dead:
+            mode = "dead"
+        else:
+            mode = "ok"
+        sock = SimulatedSocket(rng.uniform(0, args.max_latency), mode)
+        sockets.append(sock)
+        # A few dashboards per admin client id, like several open tabs
+        await manager.connect(sock, f"admin-{i // 4}")
+
+    payload = {"type": "dashboard", "viewers": list(range(50))}
+    broadcast_times = []
+    start = time.perf_counter()
+    for seq in range(args.messages):
+        t0 = time.perf_counter()
+        await manager.broadcast({**payload, "seq": seq})
+        broadcast_times.append(time.perf_counter() - t0)
+        await asyncio.sleep(args.interval)
+
+    # Let healthy senders finish draining their queues
+    deadline = time.perf_counter() + args.drain_timeout
+    healthy = [s for s in sockets if s.mode == "ok"]
+    while time.perf_counter() < deadline and any(s.received < args.messages for s in healthy):
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - start
+
+    delivered = sum(s.received for s in sockets)
+    complete = sum(1 for s in healthy if s.received == args.messages)
+    unhealthy = [s for s in sockets if s.mode != "ok"]
+    evicted = sum(1 for s in unhealthy if s.closed_with is not None)
+    leaked = manager.connection_count() - len(healthy)
+
+    times_ms = sorted(t * 1000 for t in broadcast_times)
+    p99 = times_ms[min(len(times_ms) - 1, int(len(times_ms) * 0.99))]
+    print(f"connections:         {args.connections} ({len(healthy)} healthy, {len(unhealthy)} stalled/dead)")
+    print(f"messages:            {args.messages} x {len(json.dumps(payload))} bytes, queue size {SEND_QUEUE_SIZE}")
+    print(f"broadcast call:      median {statistics.median(times_ms):.2f} ms, p99 {p99:.2f} ms")
+    print(f"delivered:           {delivered} frames in {elapsed:.2f}s ({delivered / elapsed:,.0f}/s)")
+    print(f"healthy complete:    {complete}/{len(healthy)}")
+    print(f"unhealthy evicted:   {evicted}/{len(unhealthy)}")
+    print(f"leaked connections:  {max(leaked, 0)}")
+
+    return complete == len(healthy) and evicted == len(unhealthy) and leaked == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=5000)
+    parser.add_argument("--messages", type=int, default=SEND_QUEUE_SIZE * 2)
+    parser.add_argument("--interval", type=float, default=0.01, help="seconds between broadcasts")
+    parser.add_argument("--max-latency", type=float, default=0.005, help="max per-send latency of healthy sockets")
+    parser.add_argument("--stalled", type=float, default=0.02, help="fraction of sockets that never complete a send")
+    parser.add_argument("--dead", type=float, default=0.02, help="fraction of sockets that fail on send")
+    parser.add_argument("--drain-timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    ok = asyncio.run(run(args))
+    print("PASS" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,11 @@
 import { useState, useCallback } from "react";
 import { useNavigate } from "react-router-dom";
 import { mediaApi } from "../../lib/api";
+import {
+  subscribe,
+  mediaClientId,
+  type ProcessingUpdate,
+} from "../../lib/realtime";
 import { useGallery } from "../../contexts/GalleryContext";
 import {
   Upload as UploadIcon,
@@ -79,13 +84,13 @@ export default function Upload() {
       setUploads((prev) =>
         prev.map((u) =>
           u.id === upload.id
-            ? { ...u, status: "processing", mediaId, progress: 100 }
+            ? { ...u, status: "processing", mediaId, progress: 0 }
             : u,
         ),
       );
 
-      // Poll for processing status
-      pollStatus(upload.id, mediaId);
+      // Processing progress is pushed over the WebSocket
+      watchProcessing(upload.id, mediaId);
     } catch (error: any) {
       setUploads((prev) =>
         prev.map((u) =>
@@ -138,6 +143,64 @@ export default function Upload() {
     setUploads((prev) => prev.filter((u) => u.id !== id));
   };
 
+  const finishProcessing = (
+    uploadId: string,
+    status: "ready" | "failed",
+  ) => {
+    setUploads((prev) =>
+      prev.map((u) =>
+        u.id === uploadId
+          ? {
+              ...u,
+              status,
+              progress: 100,
+              error:
+                status === "failed" ? "Processing failed on the server" : u.error,
+            }
+          : u,
+      ),
+    );
+    if (status === "ready") {
+      refreshMedia();
+    }
+  };
+
+  const watchProcessing = (uploadId: string, mediaId: string) => {
+    let done = false;
+    const unsubscribe = subscribe<ProcessingUpdate>(mediaClientId(mediaId), {
+      // The job may have finished before the socket opened
+      onOpen: async () => {
+        try {
+          const response = await mediaApi.getUploadStatus(mediaId);
+          const status = response.data.status;
+          if (!done && (status === "ready" || status === "failed")) {
+            done = true;
+            unsubscribe();
+            finishProcessing(uploadId, status);
+          }
+        } catch {
+          // the socket is still authoritative
+        }
+      },
+      onMessage: (update) => {
+        if (done || update.type !== "processing") return;
+        if (update.status) {
+          done = true;
+          unsubscribe();
+          finishProcessing(uploadId, update.status);
+        } else if (update.progress !== undefined) {
+          const progress = Math.round(update.progress * 100);
+          setUploads((prev) =>
+            prev.map((u) => (u.id === uploadId ? { ...u, progress } : u)),
+          );
+        }
+      },
+      onClose: () => {
+        if (!done) pollStatus(uploadId, mediaId);
+      },
+    });
+  };
+
   const pollStatus = async (uploadId: string, mediaId: string) => {
     const interval = setInterval(async () => {
       try {
@@ -299,17 +362,20 @@ export default function Upload() {
                 >
                   <div
                     className={`h-2 rounded-full transition-all ${
-                      upload.status === "processing" ? "animate-pulse" : ""
+                      upload.status === "processing" && upload.progress === 0
+                        ? "animate-pulse"
+                        : ""
                     }`}
                     style={{
                       background:
                         upload.status === "uploading"
                           ? "var(--status-info)"
                           : "var(--status-warning)",
+                      // Indeterminate pulse until the first progress update
                       width:
-                        upload.status === "uploading"
-                          ? `${upload.progress}%`
-                          : "100%",
+                        upload.status === "processing" && upload.progress === 0
+                          ? "100%"
+                          : `${upload.progress}%`,
                     }}
                   />
                 </div>
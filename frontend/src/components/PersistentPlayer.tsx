@@ -10,6 +10,7 @@ import DualVideoPlayer from "./DualVideoPlayer";
 import QueuePanel from "./QueuePanel";
 import SeekBar from "./SeekBar";
 import { mediaApi } from "../lib/api";
+import { qoe } from "../lib/qoe";
 import { formatDuration } from "../lib/utils";
 import { useHaptics } from "../hooks/useHaptics";
 import { useSwipeGesture } from "../hooks/useSwipeGesture";
@@ -39,6 +40,9 @@ import {
 } from "lucide-react";
 import { WakeLockInfoModal } from "./WakeLockInfoModal";
 
+// Matches HEARTBEAT_INTERVAL in backend/app/live.py
+const HEARTBEAT_INTERVAL_MS = 15_000;
+
 export default function PersistentPlayer() {
   const {
     currentMedia,
@@ -277,6 +281,20 @@ export default function PersistentPlayer() {
     [currentMedia, sessionId],
   );
 
+  // One QoE measurement session per track
+  useEffect(() => {
+    if (!currentMedia) return;
+    qoe.begin(currentMedia.id, sessionId);
+    return () => qoe.end();
+  }, [currentMedia?.id, sessionId]);
+
+  // Heartbeats feed the live concurrent-viewer counter while playing
+  useEffect(() => {
+    if (!currentMedia || !isPlaying) return;
+    const id = setInterval(() => trackEvent("heartbeat"), HEARTBEAT_INTERVAL_MS);
+    return () => clearInterval(id);
+  }, [currentMedia, isPlaying, trackEvent]);
+
   const handleSeek = useCallback(
     (time: number) => {
       haptics.buttonPress();
@@ -295,10 +313,15 @@ export default function PersistentPlayer() {
     if (!currentMedia) return;
     const id = setInterval(() => {
       try {
-        const end = playerRef.current?.getPlayer()?.bufferedEnd();
+        const player = playerRef.current?.getPlayer();
+        const end = player?.bufferedEnd();
         if (typeof end === "number" && !Number.isNaN(end)) {
           setBufferedEnd(end);
         }
+        // Variant playlists live at {quality}/playlist.m3u8
+        const tech = player?.tech({ IWillNotUseThisInPlugins: true }) as any;
+        const uri: string | undefined = tech?.vhs?.playlists?.media()?.uri;
+        if (uri) qoe.variant(uri.split("/").slice(-2, -1)[0] ?? null);
       } catch {
         // buffered ranges unavailable until media attaches
       }
@@ -372,6 +395,7 @@ export default function PersistentPlayer() {
       if (!isDragging) {
         handleTimeUpdate(time);
       }
+      if (isPlaying && time > 0) qoe.playing();
       // Track progress milestones
       if (duration) {
         const progress = (time / duration) * 100;
@@ -380,7 +404,7 @@ export default function PersistentPlayer() {
         if (progress > 75 && progress < 76) trackEvent("progress_75");
       }
     },
-    [isDragging, handleTimeUpdate, duration, trackEvent],
+    [isDragging, handleTimeUpdate, duration, trackEvent, isPlaying],
   );
 
   const handlePlayWithTracking = useCallback(() => {
@@ -392,15 +416,27 @@ export default function PersistentPlayer() {
   const handlePauseWithTracking = useCallback(() => {
     console.log("[PersistentPlayer] ⏸️  onPause event fired");
     handlePlaybackPaused();
+    qoe.paused();
     trackEvent("pause");
   }, [handlePlaybackPaused, trackEvent]);
 
   const handleEndedWithTracking = useCallback(async () => {
     console.log("[PersistentPlayer] ⏹️  onEnded event fired");
+    qoe.paused();
     await trackEvent("complete");
     handlePlaybackEnded();
   }, [trackEvent, handlePlaybackEnded]);
 
+  const handleBufferStartWithQoe = useCallback(() => {
+    qoe.bufferStart();
+    handleBufferStart();
+  }, [handleBufferStart]);
+
+  const handleBufferEndWithQoe = useCallback(() => {
+    qoe.bufferEnd();
+    handleBufferEnd();
+  }, [handleBufferEnd]);
+
   if (!currentMedia) return null;
 
   // Use master playlist for adaptive bitrate streaming
@@ -461,8 +497,8 @@ export default function PersistentPlayer() {
           onEnded={handleEndedWithTracking}
           onTimeUpdate={handleTimeUpdateWithTracking}
           onDurationChange={handleDurationChange}
-          onBufferStart={handleBufferStart}
-          onBufferEnd={handleBufferEnd}
+          onBufferStart={handleBufferStartWithQoe}
+          onBufferEnd={handleBufferEndWithQoe}
           onError={handleError}
         />
       </div>
@@ -44,6 +44,22 @@ export interface MediaVariant {
   height?: number;
 }
 
+export interface StartupBundle {
+  master: string;
+  playlists: string[];
+  segments: string[];
+  // Range header for each of segments; null fetches the whole file
+  ranges?: (string | null)[];
+  bytes: number;
+}
+
+export interface MediaBatchItem extends Media {
+  master_playlist?: string;
+  first_segments?: string[];
+  first_segment_ranges?: (string | null)[];
+  startup?: StartupBundle | null;
+}
+
 export interface Analytics {
   media_id: string;
   filename: string;
@@ -86,6 +102,13 @@ export const mediaApi = {
     return api.get<Media>(`/media/${id}`);
   },
 
+  async getMediaBatch(ids: string[], includePlayback = false) {
+    return api.get<{ items: MediaBatchItem[]; missing: string[] }>(
+      "/media/batch",
+      { params: { ids: ids.join(","), include_playback: includePlayback } },
+    );
+  },
+
   async deleteMedia(id: string) {
     return api.delete(`/media/${id}`);
   },
@@ -224,19 +247,30 @@ export interface ListenerDetail extends Omit<
 }
 
 export const analyticsApi = {
-  async getListeners(skip = 0, limit = 50, days?: number) {
+  async getListeners(
+    skip = 0,
+    limit = 50,
+    days?: number,
+    location?: { country?: string; region?: string; city?: string },
+  ) {
     return api.get<{
       total: number;
       skip: number;
       limit: number;
       items: ListenerSummary[];
-    }>("/analytics/listeners", { params: { skip, limit, days } });
+    }>("/analytics/listeners", { params: { skip, limit, days, ...location } });
   },
 
   async getListenerDetail(listenerId: string) {
     return api.get<ListenerDetail>(`/analytics/listeners/${listenerId}`);
   },
 
+  async getLiveViewers(mediaId?: string) {
+    return api.get<LiveViewers>("/analytics/live", {
+      params: { media_id: mediaId },
+    });
+  },
+
   async getDashboard(days = 7) {
     return api.get<AnalyticsDashboard>("/analytics/dashboard", {
       params: { days },
@@ -244,6 +278,17 @@ export const analyticsApi = {
   },
 };
 
+export interface LiveViewers {
+  window_seconds: number;
+  total: number;
+  media: {
+    media_id: string;
+    filename: string;
+    media_type: string;
+    viewers: number;
+  }[];
+}
+
 export interface DashboardKpis {
   plays: number;
   unique_listeners: number;
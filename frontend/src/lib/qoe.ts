@@ -0,0 +1,187 @@
+import { api } from "./api";
+import { getListenerId } from "./listenerId";
+
+// Playback quality-of-experience collector. Measures startup time,
+// rebuffering and HLS variant switches for the current playback session
+// and ships them to /analytics/qoe as column-oriented batches: one report
+// per session per flush, counters as deltas since the previous report.
+
+const FLUSH_INTERVAL_MS = 30_000;
+const MAX_BATCH = 500;
+
+interface QoeReport {
+  media_id: string;
+  session_id: string | null;
+  variant: string | null;
+  startup_ms: number | null;
+  played_ms: number;
+  rebuffer_ms: number;
+  rebuffer_count: number;
+  switch_count: number;
+}
+
+interface SessionState {
+  mediaId: string;
+  sessionId: string | null;
+  playRequestedAt: number | null;
+  startupMs: number | null;
+  startupReported: boolean;
+  playingSince: number | null;
+  bufferingSince: number | null;
+  playedMs: number;
+  rebufferMs: number;
+  rebufferCount: number;
+  variant: string | null;
+  switchCount: number;
+}
+
+let session: SessionState | null = null;
+let pending: QoeReport[] = [];
+let timer: ReturnType<typeof setInterval> | null = null;
+
+const now = () => performance.now();
+
+function settle(s: SessionState) {
+  const t = now();
+  if (s.playingSince !== null) {
+    s.playedMs += t - s.playingSince;
+    s.playingSince = t;
+  }
+  if (s.bufferingSince !== null) {
+    s.rebufferMs += t - s.bufferingSince;
+    s.bufferingSince = t;
+  }
+}
+
+function takeReport(s: SessionState) {
+  settle(s);
+  const hasStartup = s.startupMs !== null && !s.startupReported;
+  if (!hasStartup && s.playedMs < 1 && s.rebufferMs < 1 && !s.switchCount) {
+    return;
+  }
+  pending.push({
+    media_id: s.mediaId,
+    session_id: s.sessionId,
+    variant: s.variant,
+    startup_ms: hasStartup ? Math.round(s.startupMs!) : null,
+    played_ms: Math.round(s.playedMs),
+    rebuffer_ms: Math.round(s.rebufferMs),
+    rebuffer_count: s.rebufferCount,
+    switch_count: s.switchCount,
+  });
+  if (hasStartup) s.startupReported = true;
+  s.playedMs = 0;
+  s.rebufferMs = 0;
+  s.rebufferCount = 0;
+  s.switchCount = 0;
+}
+
+function toColumns(reports: QoeReport[]) {
+  return {
+    listener_id: getListenerId(),
+    media_id: reports.map((r) => r.media_id),
+    session_id: reports.map((r) => r.session_id),
+    variant: reports.map((r) => r.variant),
+    startup_ms: reports.map((r) => r.startup_ms),
+    played_ms: reports.map((r) => r.played_ms),
+    rebuffer_ms: reports.map((r) => r.rebuffer_ms),
+    rebuffer_count: reports.map((r) => r.rebuffer_count),
+    switch_count: reports.map((r) => r.switch_count),
+  };
+}
+
+function flush(useBeacon = false) {
+  if (session) takeReport(session);
+  if (pending.length === 0) return;
+  const batch = toColumns(pending.slice(0, MAX_BATCH));
+  pending = pending.slice(MAX_BATCH);
+
+  if (useBeacon && navigator.sendBeacon) {
+    const url = `${api.defaults.baseURL}/analytics/qoe`;
+    const blob = new Blob([JSON.stringify(batch)], {
+      type: "application/json",
+    });
+    navigator.sendBeacon(url, blob);
+    return;
+  }
+  api.post("/analytics/qoe", batch).catch(() => {
+    // QoE is best-effort; drop the batch rather than grow unbounded
+  });
+}
+
+function ensureTimer() {
+  if (timer) return;
+  timer = setInterval(() => flush(), FLUSH_INTERVAL_MS);
+  window.addEventListener("pagehide", () => flush(true));
+}
+
+export const qoe = {
+  /** Start measuring a new playback session (closes the previous one). */
+  begin(mediaId: string, sessionId: string | null) {
+    if (session) takeReport(session);
+    ensureTimer();
+    session = {
+      mediaId,
+      sessionId,
+      playRequestedAt: now(),
+      startupMs: null,
+      startupReported: false,
+      playingSince: null,
+      bufferingSince: null,
+      playedMs: 0,
+      rebufferMs: 0,
+      rebufferCount: 0,
+      variant: null,
+      switchCount: 0,
+    };
+  },
+
+  /** First frame rendered / playback advancing. */
+  playing() {
+    const s = session;
+    if (!s) return;
+    if (s.startupMs === null && s.playRequestedAt !== null) {
+      s.startupMs = now() - s.playRequestedAt;
+    }
+    if (s.bufferingSince !== null) return;
+    if (s.playingSince === null) s.playingSince = now();
+  },
+
+  paused() {
+    const s = session;
+    if (!s) return;
+    settle(s);
+    s.playingSince = null;
+  },
+
+  bufferStart() {
+    const s = session;
+    // Waiting before the first frame is startup time, not a rebuffer
+    if (!s || s.startupMs === null || s.bufferingSince !== null) return;
+    settle(s);
+    s.playingSince = null;
+    s.bufferingSince = now();
+    s.rebufferCount += 1;
+  },
+
+  bufferEnd() {
+    const s = session;
+    if (!s || s.bufferingSince === null) return;
+    settle(s);
+    s.bufferingSince = null;
+    s.playingSince = now();
+  },
+
+  /** Current HLS rendition, e.g. "720p"; counts changes as switches. */
+  variant(name: string | null) {
+    const s = session;
+    if (!s || !name || name === s.variant) return;
+    if (s.variant !== null) s.switchCount += 1;
+    s.variant = name;
+  },
+
+  end() {
+    flush();
+    session = null;
+  },
+};
@@ -0,0 +1,54 @@
+// Use same-origin /ws in production, VITE_WS_URL for local dev
+const WS_URL =
+  import.meta.env.VITE_WS_URL ||
+  `${window.location.protocol === "https:" ? "wss" : "ws"}://${window.location.host}/ws`;
+
+export interface ProcessingUpdate {
+  type: "processing";
+  media_id: string;
+  stage: "probe" | "transcode" | "done";
+  progress?: number;
+  variant?: string;
+  variant_progress?: number;
+  status?: "ready" | "failed";
+  error?: string;
+}
+
+/**
+ * Open a socket for a server-side client id. Messages published by any API
+ * process or worker for that id are delivered here. onClose fires when the
+ * socket ends without being closed by the caller, so callers can fall back
+ * to polling. Returns an unsubscribe function.
+ */
+export function subscribe<T>(
+  clientId: string,
+  handlers: {
+    onOpen?: () => void;
+    onMessage: (message: T) => void;
+    onClose?: () => void;
+  },
+): () => void {
+  const socket = new WebSocket(`${WS_URL}/${encodeURIComponent(clientId)}`);
+  let closedByCaller = false;
+
+  socket.onopen = () => handlers.onOpen?.();
+  socket.onmessage = (event) => {
+    try {
+      handlers.onMessage(JSON.parse(event.data) as T);
+    } catch {
+      // ignore non-JSON frames
+    }
+  };
+  socket.onclose = () => {
+    if (!closedByCaller) handlers.onClose?.();
+  };
+
+  return () => {
+    closedByCaller = true;
+    socket.close();
+  };
+}
+
+export function mediaClientId(mediaId: string): string {
+  return `media-${mediaId}`;
+}
@@ -1,4 +1,4 @@
-import { mediaApi, type Media } from "../lib/api";
+import { mediaApi, type Media, type MediaBatchItem } from "../lib/api";
 import type { DualVideoPlayerRef } from "../components/DualVideoPlayer";
 
 export interface PreloadConfig {
@@ -13,6 +13,13 @@ export interface PreloadConfig {
    * Default: true
    */
   enabled: boolean;
+
+  /**
+   * Number of upcoming tracks fetched in one batch request; tracks after
+   * the next one get their first HLS segments warmed in the HTTP cache
+   * Default: 3
+   */
+  lookahead: number;
 }
 
 export class PreloadService {
@@ -20,11 +27,14 @@ export class PreloadService {
   private preloadTriggered = false;
   private intervalId: number | null = null;
   private onPreloadComplete?: (media: Media) => void;
+  private details = new Map<string, MediaBatchItem>();
+  private warmed = new Set<string>();
 
   constructor(config: Partial<PreloadConfig> = {}) {
     this.config = {
       preloadThreshold: config.preloadThreshold ?? 80,
       enabled: config.enabled ?? true,
+      lookahead: config.lookahead ?? 3,
     };
   }
 
@@ -53,6 +63,10 @@ export class PreloadService {
       return;
     }
 
+    this.fetchUpcoming(
+      queue.slice(currentIndex + 1, currentIndex + 1 + this.config.lookahead),
+    );
+
     // Monitor playback progress
     this.intervalId = window.setInterval(() => {
       const player = playerRef.current;
@@ -85,6 +99,59 @@ export class PreloadService {
     this.preloadTriggered = false;
   }
 
+  /**
+   * Resolve upcoming tracks with a single batch request instead of one
+   * request per track, and warm the cache for the ones after the next
+   */
+  private async fetchUpcoming(tracks: Media[]): Promise<void> {
+    const ids = tracks.map((t) => t.id).filter((id) => !this.details.has(id));
+    if (ids.length === 0) return;
+
+    try {
+      const response = await mediaApi.getMediaBatch(ids, true);
+      for (const item of response.data.items) {
+        this.details.set(item.id, item);
+      }
+    } catch (error) {
+      console.error("[PreloadService] Batch fetch failed:", error);
+      return;
+    }
+
+    // The next track gets a full preload player; later ones only need
+    // their master playlist and first segments in the HTTP cache
+    for (const track of tracks.slice(1)) {
+      const item = this.details.get(track.id);
+      if (!item || this.warmed.has(item.id)) continue;
+      this.warmed.add(item.id);
+      this.warm(item).catch(() => {});
+    }
+  }
+
+  /**
+   * Fetch everything the player requests before the first frame in
+   * parallel, so its master -> playlist -> segment walk hits the cache
+   */
+  private async warm(item: MediaBatchItem): Promise<void> {
+    const playlists = item.startup
+      ? [item.startup.master, ...item.startup.playlists]
+      : [item.master_playlist];
+    const segments = item.startup?.segments ?? item.first_segments ?? [];
+    const ranges = item.startup ? item.startup.ranges : item.first_segment_ranges;
+    // Single-file renditions: segments are byte ranges of one file, and
+    // only the range the player will ask for is fetched
+    const requests: { url?: string; range?: string | null }[] = [
+      ...playlists.map((url) => ({ url })),
+      ...segments.map((url, i) => ({ url, range: ranges?.[i] })),
+    ];
+    await Promise.allSettled(
+      requests
+        .filter((request): request is { url: string; range?: string | null } => !!request.url)
+        .map(({ url, range }) =>
+          fetch(url, range ? { headers: { Range: range } } : undefined),
+        ),
+    );
+  }
+
   /**
    * Trigger preload for next track
    */
@@ -93,13 +160,22 @@ export class PreloadService {
     player: DualVideoPlayerRef,
   ): Promise<void> {
     try {
-      // Fetch full media details including variants
-      const response = await mediaApi.getMediaById(nextTrack.id);
-      const fullMedia = response.data;
+      // Full media details including variants, usually already fetched
+      // by the batch request in start()
+      const fullMedia: MediaBatchItem =
+        this.details.get(nextTrack.id) ??
+        (await mediaApi.getMediaById(nextTrack.id)).data;
 
       // Use master playlist for adaptive bitrate streaming
       // The master playlist allows Video.js to automatically switch quality variants
-      const masterPlaylistPath = `/media/hls/${fullMedia.id}/master.m3u8`;
+      const masterPlaylistPath =
+        fullMedia.master_playlist ?? `/media/hls/${fullMedia.id}/master.m3u8`;
+
+      // Startup bundle in the HTTP cache before the preload player asks
+      if (!this.warmed.has(fullMedia.id)) {
+        this.warmed.add(fullMedia.id);
+        await this.warm(fullMedia);
+      }
 
       // Trigger player preload
       player.preloadNext(